@@ -0,0 +1,5 @@
+"""
+    Benchmarks for the hot paths of viur-datastore.
+
+    Each module can be run on its own, e.g. ``python -m benchmarks.lookup``.
+"""
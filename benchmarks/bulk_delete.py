@@ -0,0 +1,49 @@
+"""
+    Measures purging all entities matching a query: Once by iterating over the full entities and deleting them one
+    by one, and once using BulkDelete(query.iterKeys()), which fetches only the keys and deletes them in batches of
+    up to 500 keys, with up to config["max_concurrent_commits"] commits in flight.
+
+    This benchmark runs against the project configured for the current environment (just like the tests do) and
+    writes up to 2000 entities of the kind "viur-datastore-benchmark", which are deleted by the benchmark itself.
+"""
+import time
+
+from viur import datastore
+
+from .cache_codec import benchmarkKindName, buildEntity
+from .utils import print_table, use_fake_backend
+
+entityCounts = [200, 2000]
+
+
+def populate(count: int) -> None:
+    entities = [buildEntity(idx) for idx in range(1, count + 1)]
+    for idx in range(0, len(entities), 500):
+        datastore.Put(entities[idx:idx + 500])
+
+
+def deleteOneByOne() -> None:
+    for entity in datastore.Query(benchmarkKindName).iter():
+        datastore.Delete(entity)
+
+
+def deleteBulk() -> None:
+    datastore.BulkDelete(datastore.Query(benchmarkKindName).iterKeys())
+
+
+def main():
+    use_fake_backend()
+    rows = []
+    for entityCount in entityCounts:
+        timings = []
+        for func in [deleteOneByOne, deleteBulk]:
+            populate(entityCount)
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        rows.append([entityCount, timings[0], timings[1], "%.1fx" % (timings[0] / timings[1])])
+    print_table(["entities", "iter() + Delete() [s]", "BulkDelete(iterKeys()) [s]", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
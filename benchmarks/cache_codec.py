@@ -0,0 +1,75 @@
+"""
+    Compares the serialization of cached entities: The binary codec used by the cache against pickle (used by the
+    memcache client when handed entity objects) and the previous way of storing entities (cache.get_size to
+    enforce the size limit, then pickle). It also reports the size of the serialized entities.
+
+    This benchmark runs offline; no datastore requests are made.
+"""
+import pickle
+from datetime import datetime, timezone
+
+from viur import datastore
+from viur.datastore import cache, codec
+
+from .utils import measure, print_table
+
+benchmarkKindName = "viur-datastore-benchmark"
+
+
+def buildEntity(idx: int) -> datastore.Entity:
+    """
+        Builds an entity resembling a typical ViUR skeleton with about 30 properties.
+    """
+    entity = datastore.Entity(datastore.Key(benchmarkKindName, idx))
+    entity.version = "1684147200000000"
+    entity.exclude_from_indexes = {"description", "content"}
+    entity["name"] = "Entity number %s" % idx
+    entity["description"] = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 10
+    entity["content"] = "<p>%s</p>" % ("Sed ut perspiciatis unde omnis iste natus error sit voluptatem. " * 30)
+    entity["creationdate"] = datetime(2023, 5, 15, 12, 0, idx % 60, tzinfo=timezone.utc)
+    entity["changedate"] = datetime(2023, 6, 1, 8, 30, idx % 60, tzinfo=timezone.utc)
+    entity["sortindex"] = float(idx)
+    entity["viewcount"] = idx * 17
+    entity["visible"] = True
+    entity["archived"] = False
+    entity["tags"] = ["tag-%s" % x for x in range(10)]
+    entity["parententry"] = datastore.Key(benchmarkKindName, idx + 1)
+    entity["parentrepo"] = datastore.Key(benchmarkKindName, "repository")
+    entity["image"] = {
+        "dest": datastore.Entity(datastore.Key("file", idx)),
+        "rel": None,
+    }
+    entity["image"]["dest"].update({"name": "image-%s.jpg" % idx, "size": 123456, "mimetype": "image/jpeg"})
+    for lang in ["de", "en", "fr"]:
+        entity["title.%s" % lang] = "Title %s in %s" % (idx, lang)
+        entity["seo_keywords.%s" % lang] = ["keyword-%s" % x for x in range(5)]
+    for x in range(8):
+        entity["field%s" % x] = x * 3
+    entity["blob"] = bytes(range(256))
+    entity["viurCurrentSeoKeys"] = {"de": "entity-%s" % idx, "en": "entity-%s" % idx}
+    return entity
+
+
+def main():
+    entities = [buildEntity(idx) for idx in range(100)]
+    encoded = [codec.encode(entity) for entity in entities]
+    pickled = [pickle.dumps(entity) for entity in entities]
+    rows = [
+        ["encode: codec.encode", measure(lambda: [codec.encode(x) for x in entities]) / len(entities) * 1e6],
+        ["encode: pickle.dumps", measure(lambda: [pickle.dumps(x) for x in entities]) / len(entities) * 1e6],
+        ["encode: get_size + pickle.dumps (previous cache.put)",
+         measure(lambda: [cache.get_size(x) <= cache.MEMCACHE_MAX_SIZE and pickle.dumps(x) for x in entities])
+         / len(entities) * 1e6],
+        ["decode: codec.decode", measure(lambda: [codec.decode(x) for x in encoded]) / len(entities) * 1e6],
+        ["decode: pickle.loads", measure(lambda: [pickle.loads(x) for x in pickled]) / len(entities) * 1e6],
+    ]
+    print_table(["operation", "time per entity [us]"], rows)
+    print()
+    print_table(["format", "bytes per entity"], [
+        ["codec", sum(len(x) for x in encoded) // len(entities)],
+        ["pickle", sum(len(x) for x in pickled) // len(entities)],
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+    Measures decoding query results: wide entities (many properties of all common types) and entities with long
+    lists that are excluded from indexing. Each query is answered with the same, canned response, so only
+    the decoding on our side is measured.
+    Lazy queries are measured reading three properties of each entity, like a list view would.
+
+    This benchmark runs offline; no datastore requests are made (but credentials are needed to import transport).
+"""
+import json
+
+from viur import datastore
+from viur.datastore import transport
+
+from .cache_codec import benchmarkKindName
+from .utils import CannedSession, measure, print_table
+
+
+def keyJson(idx: int) -> dict:
+    return {
+        "partitionId": {"projectId": transport.projectID},
+        "path": [{"kind": benchmarkKindName, "id": str(idx)}]
+    }
+
+
+def buildWideProperties(idx: int) -> dict:
+    """
+        200 properties, as used by large skeletons (including translated and relational bones)
+    """
+    properties = {}
+    for x in range(40):
+        properties["string%s" % x] = {"stringValue": "Value %s of entity %s" % (x, idx)}
+        properties["int%s" % x] = {"integerValue": str(idx * x)}
+        properties["date%s" % x] = {"timestampValue": "2023-05-15T12:%02d:%02d.123456Z" % (x, idx % 60)}
+        properties["bool%s" % x] = {"booleanValue": bool(x % 2)}
+        properties["text%s" % x] = {"stringValue": "<p>Lorem ipsum</p>" * 5, "excludeFromIndexes": True}
+    return properties
+
+
+def buildListProperties(idx: int) -> dict:
+    """
+        Two long lists excluded from indexing and one indexed one
+    """
+    return {
+        "keywords": {"arrayValue": {"values": [
+            {"stringValue": "keyword-%s" % x, "excludeFromIndexes": True} for x in range(500)]}},
+        "refs": {"arrayValue": {"values": [
+            {"keyValue": keyJson(x + 1), "excludeFromIndexes": True} for x in range(200)]}},
+        "tags": {"arrayValue": {"values": [{"stringValue": "tag-%s" % x} for x in range(50)]}},
+    }
+
+
+def buildQueryResponse(count: int, buildProperties) -> bytes:
+    return json.dumps({
+        "batch": {
+            "entityResultType": "FULL",
+            "entityResults": [{
+                "entity": {"key": keyJson(idx + 1), "properties": buildProperties(idx)},
+                "version": "1684147200000000",
+            } for idx in range(count)],
+            "endCursor": "Y3Vyc29y",
+            "moreResults": "NO_MORE_RESULTS",
+        }
+    }).encode("UTF-8")
+
+
+def readProperties(entities: list, names: list) -> None:
+    for entity in entities:
+        for name in names:
+            entity[name]
+
+
+def main():
+    queryDefinition = datastore.QueryDefinition(benchmarkKindName, {}, [])
+    lazyQueryDefinition = datastore.QueryDefinition(benchmarkKindName, {}, [], lazy=True)
+    oldSession = transport._http_internal
+    rows = []
+    try:
+        for name, count, buildProperties, readNames in [
+            ("wide entities (200 properties)", 1000, buildWideProperties, ["string0", "int1", "date2"]),
+            ("long lists (750 values)", 200, buildListProperties, ["tags"]),
+        ]:
+            response = buildQueryResponse(count, buildProperties)
+            transport._http_internal = CannedSession(response)
+            duration = measure(lambda: transport.runSingleFilter(queryDefinition, count), repeat=5)
+            rows.append([name, duration / count * 1e6, len(response) / duration / 1e6])
+            duration = measure(
+                lambda: readProperties(transport.runSingleFilter(lazyQueryDefinition, count), readNames), repeat=5)
+            rows.append(["%s, lazy, reading %s" % (name, ", ".join(readNames)), duration / count * 1e6,
+                         len(response) / duration / 1e6])
+    finally:
+        transport._http_internal = oldSession
+    print_table(["entities", "time per entity [us]", "throughput [MB/s]"], rows)
+
+
+if __name__ == "__main__":
+    main()
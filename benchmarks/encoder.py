@@ -0,0 +1,62 @@
+"""
+    Compares the throughput of encoding request bodies: The direct JSON encoder in transport against
+    json.dumps() of the dictionaries built by pythonPropToJson / keyToPath, which the encoder replaces.
+
+    This benchmark runs offline; no datastore requests are made (but credentials are needed to import transport).
+"""
+import json
+
+from viur import datastore
+from viur.datastore import transport
+
+from .cache_codec import benchmarkKindName, buildEntity
+from .utils import measure, print_table
+
+
+def commitViaDicts(entities) -> bytes:
+    return json.dumps({
+        "mode": "NON_TRANSACTIONAL",
+        "mutations": [{"upsert": transport.pythonPropToJson(x)["entityValue"]} for x in entities]
+    }).encode("UTF-8")
+
+
+def commitViaEncoder(entities) -> bytes:
+    return transport.encodeCommitRequest(
+        "NON_TRANSACTIONAL", [transport.encodeUpsertMutation(x) for x in entities])
+
+
+def lookupViaDicts(keys) -> bytes:
+    return json.dumps({
+        "readOptions": {"readConsistency": "STRONG"},
+        "keys": [{"partitionId": {"project_id": transport.projectID}, "path": transport.keyToPath(x)} for x in keys]
+    }).encode("UTF-8")
+
+
+def lookupViaEncoder(keys) -> bytes:
+    return transport.encodeLookupRequest(keys, {"readConsistency": "STRONG"})
+
+
+def main():
+    entities = [buildEntity(idx) for idx in range(500)]
+    keys = [datastore.Key(benchmarkKindName, idx, parent=datastore.Key(benchmarkKindName, "parent"))
+            for idx in range(1, 301)]
+    assert commitViaDicts(entities) == commitViaEncoder(entities)
+    assert lookupViaDicts(keys) == lookupViaEncoder(keys)
+    bodySize = len(commitViaEncoder(entities))
+    rows = []
+    for name, func, arg, count in [
+        ("commit: pythonPropToJson + json.dumps", commitViaDicts, entities, len(entities)),
+        ("commit: encoder", commitViaEncoder, entities, len(entities)),
+        ("lookup: keyToPath + json.dumps", lookupViaDicts, keys, len(keys)),
+        ("lookup: encoder", lookupViaEncoder, keys, len(keys)),
+    ]:
+        duration = measure(lambda: func(arg))
+        rows.append([name, duration / count * 1e6, count / duration])
+    print_table(["operation", "time per item [us]", "items per second"], rows)
+    print()
+    print("Commit request body for %s entities: %s bytes (%.1f MB/s via the encoder)" % (
+        len(entities), bodySize, bodySize / measure(lambda: commitViaEncoder(entities)) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
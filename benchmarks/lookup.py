@@ -0,0 +1,65 @@
+"""
+    Measures how the latency of Get() scales with the number of keys requested, once with all lookup batches sent
+    one after another and once with up to config["max_concurrent_lookups"] batches in flight.
+    Afterwards, many threads fetch the same few (hot) keys at the same time, with and without
+    config["coalesce_lookups"].
+
+    This benchmark runs against the project configured for the current environment (just like the tests do) and
+    writes up to 3000 entities of the kind "viur-datastore-benchmark", which are deleted afterwards.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from viur import datastore
+
+from .utils import measure, print_table, use_fake_backend
+
+benchmarkKindName = "viur-datastore-benchmark"
+keyCounts = [100, 300, 1000, 3000]
+hotKeyThreads = 32
+
+
+def getHotKeys(executor: ThreadPoolExecutor, keys: list) -> None:
+    futures = [executor.submit(datastore.Get, keys[idx % len(keys)]) for idx in range(hotKeyThreads * 4)]
+    for future in futures:
+        future.result()
+
+
+def main():
+    use_fake_backend()
+    keys = [datastore.Key(benchmarkKindName, "entity-%s" % idx) for idx in range(max(keyCounts))]
+    for idx in range(0, len(keys), 500):
+        entities = []
+        for key in keys[idx:idx + 500]:
+            entity = datastore.Entity(key)
+            entity["name"] = key.name
+            entity["value"] = idx
+            entities.append(entity)
+        datastore.Put(entities)
+    oldMemcacheClient = datastore.config["memcache_client"]
+    oldMaxConcurrentLookups = datastore.config["max_concurrent_lookups"]
+    datastore.config["memcache_client"] = None
+    try:
+        rows = []
+        for keyCount in keyCounts:
+            datastore.config["max_concurrent_lookups"] = 1
+            serial = measure(lambda: datastore.Get(keys[:keyCount]), repeat=3)
+            datastore.config["max_concurrent_lookups"] = oldMaxConcurrentLookups
+            concurrent = measure(lambda: datastore.Get(keys[:keyCount]), repeat=3)
+            rows.append([keyCount, serial, concurrent, "%.1fx" % (serial / concurrent)])
+        print_table(["keys", "serial [s]", "concurrent [s]", "speedup"], rows)
+        rows = []
+        with ThreadPoolExecutor(max_workers=hotKeyThreads) as executor:
+            for coalesce in [False, True]:
+                datastore.config["coalesce_lookups"] = coalesce
+                rows.append([coalesce, measure(lambda: getHotKeys(executor, keys[:3]), repeat=3)])
+        print_table(["coalesce_lookups", "%s hot key lookups [s]" % (hotKeyThreads * 4)], rows)
+    finally:
+        datastore.config["memcache_client"] = oldMemcacheClient
+        datastore.config["max_concurrent_lookups"] = oldMaxConcurrentLookups
+        datastore.config["coalesce_lookups"] = False
+        for idx in range(0, len(keys), 500):
+            datastore.Delete(keys[idx:idx + 500])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+    Measures the reuse of simdjson parsers across requests with many small lookups (a single key each).
+    Each lookup is answered with the same, canned response, so only the overhead on our side is measured.
+    Setting config["max_retained_buffer_size"] to 0 disables the reuse, so each response gets a new parser (as it
+    did before parsers were pooled).
+
+    This benchmark runs offline; no datastore requests are made (but credentials are needed to import transport).
+"""
+import json
+
+from viur import datastore
+from viur.datastore import transport
+
+from .cache_codec import benchmarkKindName
+from .utils import CannedSession, measure, print_table
+
+lookupCount = 10000
+
+
+def buildLookupResponse(key: datastore.Key) -> bytes:
+    return json.dumps({
+        "found": [{
+            "entity": {
+                "key": {
+                    "partitionId": {"projectId": transport.projectID},
+                    "path": [{"kind": key.kind, "id": str(key.id)}]
+                },
+                "properties": {
+                    "name": {"stringValue": "Entity number %s" % key.id},
+                    "viewcount": {"integerValue": "42"},
+                    "changedate": {"timestampValue": "2023-06-01T08:30:00.123456Z"},
+                    "visible": {"booleanValue": True},
+                },
+            },
+            "version": "1684147200000000",
+        }],
+        "readTime": "2023-06-01T08:30:00.123456Z",
+    }).encode("UTF-8")
+
+
+def main():
+    key = datastore.Key(benchmarkKindName, 1)
+    oldSession, oldLimit = transport._http_internal, datastore.config["max_retained_buffer_size"]
+    transport._http_internal = CannedSession(buildLookupResponse(key))
+    rows = []
+    try:
+        for name, limit in [("new parser per response", 0), ("pooled parsers", oldLimit)]:
+            datastore.config["max_retained_buffer_size"] = limit
+            statsBefore = transport.parserPoolStats()
+            duration = measure(lambda: [datastore.Get(key) for _ in range(lookupCount)], repeat=3)
+            stats = {k: v - statsBefore[k] for k, v in transport.parserPoolStats().items()}
+            rows.append([name, duration / lookupCount * 1e6, stats["created"], stats["allocated_capacity"]])
+    finally:
+        transport._http_internal = oldSession
+        datastore.config["max_retained_buffer_size"] = oldLimit
+    print_table(["mode", "time per lookup [us]", "parsers created", "capacity allocated [bytes]"], rows)
+
+
+if __name__ == "__main__":
+    main()
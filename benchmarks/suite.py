@@ -0,0 +1,200 @@
+"""
+    Runs the CPU-bound hot paths of this library over synthetic corpora of realistic sizes and compares the results
+    against the baselines saved in benchmarks/baseline.json, so that regressions show up in review:
+
+        python -m benchmarks.suite             # Compare against the saved baselines
+        python -m benchmarks.suite --save      # Update the baselines after an intended change
+        python -m benchmarks.suite -k Key      # Only run the cases containing "Key"
+
+    Cases taking more than --tolerance (default 20%) longer than their baseline are marked as REGRESSION, and the
+    exit code is 1 if there are any. Apparent regressions are measured up to two more times first, as they're
+    often caused by other processes. Timings depend on the machine, so baselines should be saved (and compared) on
+    the same one; commit updated baselines together with the change causing them.
+
+    This benchmark runs offline; no datastore requests are made.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from viur import datastore
+from viur.datastore import cache, transport, utils
+
+from .cache_codec import benchmarkKindName, buildEntity
+from .utils import CannedSession, print_table
+
+baselinePath = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def buildKeys(count: int) -> List[datastore.Key]:
+    """
+        Keys as found in a typical application: Half of them numeric, half named, every third one with a parent.
+    """
+    keys = []
+    for idx in range(count):
+        parent = datastore.Key("parent-kind", "parent-%s" % (idx % 10)) if idx % 3 == 0 else None
+        idOrName = 5629499534213120 + idx if idx % 2 else "entity-%s" % idx
+        keys.append(datastore.Key(benchmarkKindName, idOrName, parent=parent))
+    return keys
+
+
+def buildResponse(entities: List[datastore.Entity], lookup: bool) -> bytes:
+    """
+        The json the datastore answers a lookup of (or a query for) the given entities with.
+    """
+    results = [{"entity": transport.pythonPropToJson(entity)["entityValue"], "version": entity.version}
+               for entity in entities]
+    if lookup:
+        return json.dumps({"found": results}).encode("UTF-8")
+    return json.dumps({
+        "batch": {
+            "entityResultType": "FULL",
+            "entityResults": results,
+            "endCursor": "Y3Vyc29y",
+            "moreResults": "NO_MORE_RESULTS",
+        }
+    }).encode("UTF-8")
+
+
+def withSession(session, func: Callable[[], object]) -> Callable[[], object]:
+    """
+        Wraps func to be run with transport sending its requests to the given session.
+    """
+    def run():
+        oldSession = transport._http_internal
+        transport._http_internal = session
+        try:
+            return func()
+        finally:
+            transport._http_internal = oldSession
+    return run
+
+
+def buildCases() -> List[Tuple[str, Callable[[], object], int]]:
+    """
+        Builds the corpora and returns the cases to measure as (name, function, number of items it processes).
+    """
+    entities = [buildEntity(idx) for idx in range(1, 501)]
+    keys = buildKeys(1000)
+    urlsafeKeys = [key.to_legacy_urlsafe().decode("ASCII") for key in keys]
+    keyCopies = [datastore.Key.from_legacy_urlsafe(x) for x in urlsafeKeys]
+    queryDefinition = datastore.QueryDefinition(benchmarkKindName, {}, [])
+    querySession = CannedSession(buildResponse(entities, lookup=False))
+    lookupEntities = entities[:300]
+    lookupKeys = [entity.key for entity in lookupEntities]
+    lookupSession = CannedSession(buildResponse(lookupEntities, lookup=True))
+    # Four IN-queries of 250 results each, sorted by viewcount and overlapping by half (counted as 1000 items)
+    multiQuery = datastore.Query(benchmarkKindName).filter("tags IN", ["a", "b", "c", "d"]).order("viewcount")
+    multiResults = [sorted((buildEntity(idx) for idx in range(run * 125 + 1, run * 125 + 251)),
+                           key=lambda x: x["viewcount"]) for run in range(4)]
+    shuffled = [buildEntity(idx) for idx in range(1, 1001)]
+    random.Random(42).shuffle(shuffled)
+    orders = [("sortindex", datastore.SortOrder.Ascending)]
+    unindexable = [buildEntity(idx) for idx in range(1, 501)]  # Fixed in place, so keep them apart from the others
+    return [
+        ("encode: pythonPropToJson + json.dumps",
+         lambda: [json.dumps(transport.pythonPropToJson(x)) for x in entities], len(entities)),
+        ("encode: encodeUpsertMutation", lambda: [transport.encodeUpsertMutation(x) for x in entities], len(entities)),
+        ("decode: runSingleFilter",
+         withSession(querySession, lambda: transport.runSingleFilter(queryDefinition, len(entities))), len(entities)),
+        ("decode: Get", withSession(lookupSession, lambda: datastore.Get(lookupKeys)), len(lookupKeys)),
+        ("Key.to_legacy_urlsafe", lambda: [key.to_legacy_urlsafe() for key in keys], len(keys)),
+        ("Key.from_legacy_urlsafe", lambda: [datastore.Key.from_legacy_urlsafe(x) for x in urlsafeKeys], len(keys)),
+        ("Key.__hash__ + __eq__ (set of keys)", lambda: set(keys).issuperset(keyCopies), len(keys)),
+        ("cache.get_size", lambda: [cache.get_size(x) for x in entities], len(entities)),
+        ("Query._mergeMultiQueryResults", lambda: multiQuery._mergeMultiQueryResults(multiResults), 1000),
+        ("Query._mergeMultiQueryResults (limit 100)",
+         lambda: multiQuery._mergeMultiQueryResults(multiResults, 100), 1000),
+        ("Query._resortResult", lambda: multiQuery._resortResult(list(shuffled), {}, orders), len(shuffled)),
+        ("fixUnindexableProperties", lambda: [utils.fixUnindexableProperties(x) for x in unindexable],
+         len(unindexable)),
+    ]
+
+
+def measureBest(func: Callable[[], object], repeat: int = 9, minTime: float = 0.05) -> float:
+    """
+        Returns the fastest of repeat runs of func in seconds. Each run calls func as often as needed to take at
+        least minTime, so that short cases aren't dominated by timer resolution and noise.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        duration = time.perf_counter() - start
+        if duration >= minTime:
+            break
+        number *= 2
+    timings = [duration / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def loadBaselines() -> Dict[str, float]:
+    if not os.path.exists(baselinePath):
+        return {}
+    with open(baselinePath) as f:
+        return json.load(f)["cases"]
+
+
+def saveBaselines(results: Dict[str, float]) -> None:
+    with open(baselinePath, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cases": results,
+        }, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the hot paths against the saved baselines")
+    parser.add_argument("--save", action="store_true", help="Save the results as new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown (default: 0.2 = 20%%)")
+    parser.add_argument("-k", dest="filter", default="", help="Only run cases containing this string")
+    args = parser.parse_args()
+    baselines = loadBaselines()
+    results = {}
+    rows = []
+    regressions = 0
+    for name, func, count in buildCases():
+        if args.filter not in name:
+            continue
+        func()  # Warm up (caches, parser pool, ...)
+        result = measureBest(func) / count * 1e6
+        baseline = baselines.get(name)
+        for _ in range(2):  # Confirm apparent regressions, they're often just noise of other processes
+            if baseline is None or result <= baseline * (1 + args.tolerance):
+                break
+            result = min(result, measureBest(func) / count * 1e6)
+        results[name] = round(result, 4)
+        if baseline is None:
+            rows.append([name, results[name], "-", "-", ""])
+            continue
+        ratio = results[name] / baseline
+        status = ""
+        if ratio > 1 + args.tolerance:
+            status = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 - args.tolerance:
+            status = "faster"
+        rows.append([name, results[name], baseline, "%.2fx" % ratio, status])
+    print_table(["case", "time per item [us]", "baseline [us]", "ratio", ""], rows)
+    if args.save:
+        saveBaselines({**baselines, **results})
+        print("\nSaved baselines to %s" % baselinePath)
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
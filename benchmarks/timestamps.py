@@ -0,0 +1,87 @@
+"""
+    Measures the decoding of timestampValues: The RFC 3339 parser in transport against datetime.strptime (as
+    used before), on its own and as part of decoding query results with several date properties per entity.
+
+    This benchmark runs offline; no datastore requests are made (but credentials are needed to import transport).
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from viur import datastore
+from viur.datastore import transport
+
+from .cache_codec import benchmarkKindName
+from .utils import CannedSession, measure, print_table
+
+entityCount = 100000
+batchSize = 1000
+
+
+def parseViaStrptime(value: str) -> datetime:
+    dateStr = value[:-1]  # Strip "Z" at the end
+    if "." in dateStr:  # With milli-seconds
+        return datetime.strptime(dateStr, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
+    else:
+        return datetime.strptime(dateStr, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def buildTimestamps(count: int):
+    start = datetime(2023, 5, 15, tzinfo=timezone.utc)
+    return [(start + timedelta(seconds=idx * 7919, microseconds=idx % 1000000)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            for idx in range(count)]
+
+
+def buildQueryResponse(timestamps) -> bytes:
+    """
+        Builds a runQuery response with batchSize entities having four date properties each.
+    """
+    return json.dumps({
+        "batch": {
+            "entityResultType": "FULL",
+            "entityResults": [{
+                "entity": {
+                    "key": {
+                        "partitionId": {"projectId": transport.projectID},
+                        "path": [{"kind": benchmarkKindName, "id": str(idx + 1)}]
+                    },
+                    "properties": {
+                        "name": {"stringValue": "Entity number %s" % idx},
+                        "creationdate": {"timestampValue": timestamps[4 * idx]},
+                        "changedate": {"timestampValue": timestamps[4 * idx + 1]},
+                        "startdate": {"timestampValue": timestamps[4 * idx + 2]},
+                        "enddate": {"timestampValue": timestamps[4 * idx + 3]},
+                    },
+                },
+                "version": "1684147200000000",
+            } for idx in range(batchSize)],
+            "endCursor": "Y3Vyc29y",
+            "moreResults": "NO_MORE_RESULTS",
+        }
+    }).encode("UTF-8")
+
+
+def main():
+    timestamps = buildTimestamps(entityCount)
+    assert [parseViaStrptime(x) for x in timestamps[:1000]] == [transport.parseTimestamp(x) for x in timestamps[:1000]]
+    rows = [
+        ["datetime.strptime", measure(lambda: [parseViaStrptime(x) for x in timestamps], repeat=3)
+         / entityCount * 1e6],
+        ["transport.parseTimestamp", measure(lambda: [transport.parseTimestamp(x) for x in timestamps], repeat=3)
+         / entityCount * 1e6],
+    ]
+    print_table(["timestamp parser", "time per timestamp [us]"], rows)
+    print()
+    oldSession = transport._http_internal
+    transport._http_internal = CannedSession(buildQueryResponse(timestamps))
+    queryDefinition = datastore.QueryDefinition(benchmarkKindName, {}, [])
+    try:
+        duration = measure(lambda: [transport.runSingleFilter(queryDefinition, batchSize)
+                                    for _ in range(entityCount // batchSize)], repeat=3)
+    finally:
+        transport._http_internal = oldSession
+    print("Decoding %s query results with four date properties each: %.2f us per entity" % (
+        entityCount, duration / entityCount * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+    Small helpers shared by all benchmarks: timing a callable, printing the results as a table and serving canned
+    responses (or the in-memory fake datastore) instead of the datastore.
+"""
+import os
+import statistics
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+import requests
+
+from viur.datastore import fake, transport
+
+
+def measure(func: Callable[[], object], repeat: int = 5, number: int = 1) -> float:
+    """
+        Runs func number times in a row, repeat times, and returns the median time of a single call in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return statistics.median(timings)
+
+
+def print_table(headers: Sequence[str], rows: List[Sequence[object]]) -> None:
+    """
+        Prints rows as a simple, aligned text table.
+    """
+    rows = [[("%.4f" % x) if isinstance(x, float) else str(x) for x in row] for row in rows]
+    widths = [max(len(str(headers[idx])), *(len(row[idx]) for row in rows)) for idx in range(len(headers))]
+    print("  ".join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(col.rjust(w) for col, w in zip(row, widths)))
+
+
+class CannedSession:
+    """
+        Replaces the http session of transport, answering every request with the same response.
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def post(self, url: str, data: bytes, timeout: Any = None) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = self.content
+        return resp
+
+
+def use_fake_backend() -> Optional[fake.FakeDatastore]:
+    """
+        If the environment variable VIUR_DATASTORE_FAKE_LATENCY is set, the benchmark runs against an in-memory
+        FakeDatastore (answering each request after that many seconds) instead of the configured project.
+
+        :return: The FakeDatastore in use, if any
+    """
+    latency = os.environ.get("VIUR_DATASTORE_FAKE_LATENCY")
+    if latency is None:
+        return None
+    backend = fake.FakeDatastore(latency=float(latency))
+    transport.setBackend(backend)
+    return backend
@@ -23,6 +23,8 @@ setup(
     ],
     cmdclass={'build_ext': build_ext},
     ext_modules=cythonize([Extension("viur.datastore.transport", ["src/viur/datastore/transport.pyx"], language="c++",
+                                     extra_compile_args=["-std=c++11"]),
+                           Extension("viur.datastore.codec", ["src/viur/datastore/codec.pyx"], language="c++",
                                      extra_compile_args=["-std=c++11"])]),
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -2,12 +2,13 @@ from viur.datastore.config import conf as config
 from viur.datastore.errors import *
 from viur.datastore import cache
 from viur.datastore.query import Query
-from viur.datastore.transport import AllocateIDs, Delete, Get, Put, RunInTransaction, Count
+from viur.datastore.transport import AllocateIDs, BulkDelete, Delete, Get, Put, RunInTransaction, Count
 from viur.datastore.types import (
     currentDbAccessLog,
     DATASTORE_BASE_TYPES,
     Entity,
     KEY_SPECIAL_PROPERTY,
+    LazyEntity,
     Key,
     SortOrder,
     SkelListRef,
@@ -21,7 +22,12 @@ from viur.datastore.utils import (
     encodeKey,
     acquireTransactionSuccessMarker,
     startDataAccessLog,
-    endDataAccessLog)
+    endDataAccessLog,
+    startProfiling,
+    endProfiling,
+    bufferedWrites)
+from viur.datastore import aio
+from viur.datastore import metrics
 
 import logging
 
@@ -35,6 +41,7 @@ __all__ = [
     "SortOrder",
     "SkelListRef",
     "Entity",
+    "LazyEntity",
     "QueryDefinition",
     "Key",
     "Query",
@@ -45,6 +52,7 @@ __all__ = [
     "Count",
     "Put",
     "Delete",
+    "BulkDelete",
     "RunInTransaction",
     "IsInTransaction",
     "currentDbAccessLog",
@@ -55,6 +63,9 @@ __all__ = [
     "config",
     "startDataAccessLog",
     "endDataAccessLog",
+    "startProfiling",
+    "endProfiling",
+    "bufferedWrites",
     "ViurDatastoreError",
     "AbortedError",
     "CollisionError",
@@ -68,6 +79,9 @@ __all__ = [
     "UnauthenticatedError",
     "UnavailableError",
     "NoMutationResultsError",
+    "PartialEntityError",
     "is_viur_datastore_request_ok",
     "cache",
+    "aio",
+    "metrics",
 ]
@@ -0,0 +1,534 @@
+"""
+    Awaitable twins of the transport functions, for use from asyncio code.
+
+    The requests are sent from the event loop with an httpx.AsyncClient (pip install httpx, or "httpx[http2]" for
+    conf["http2"]), using the same encoders, parsers and retries as the blocking functions. Each request only
+    occupies a connection (of up to conf["http_pool_maxsize"] per event loop) while it's in flight, so many
+    lookups, queries and commits can be in flight at once without blocking the event loop. Backends set with
+    :func:`viur.datastore.transport.setBackend` are used as well, through their apost() coroutine if they have one.
+
+    Work that would block the event loop is still run on a shared pool of up to config["aio_max_workers"] threads:
+    Loading and refreshing the credentials, reading and writing the cache (if config["memcache_client"] is set),
+    post() of backends without apost(), regular (not async) callbacks of RunInTransaction, BulkDelete (as its
+    iterable may block), fulltext searches and queries whose _runSingleFilterQuery has been overridden.
+
+    Like in :mod:`viur.datastore.concurrency`, ContextVars like currentTransaction and currentDbAccessLog work per
+    task, exactly as they do per thread:
+    ..  code-block:: python
+    from viur.datastore import aio
+
+    async def increment(key):
+        entity = await aio.Get(key)
+        entity["count"] += 1
+        await aio.Put(entity)
+
+    await aio.RunInTransaction(increment, key)
+
+    Cancelling a task aborts the requests it's waiting for. Like failed requests, commits might have been applied
+    nevertheless.
+"""
+import asyncio
+import inspect
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+from time import perf_counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Generator, Iterable, List, Optional, Union
+
+import google.auth
+import google.auth.transport.requests
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+
+from viur.datastore import cache, transport
+from viur.datastore.concurrency import submit
+from viur.datastore.config import conf
+from viur.datastore.errors import AbortedError, CollisionError
+from viur.datastore.metrics import currentOperation
+from viur.datastore.query import Query
+from viur.datastore.transport import COMMIT_MAX_MUTATIONS, HTTP_RETRY_STATUS_CODES, LOOKUP_MAX_BATCH_SIZE, \
+    WriteBuffer
+from viur.datastore.types import Entity, Key, QueryDefinition, currentTransaction, currentWriteBuffer
+
+__all__ = [
+    "Get",
+    "Put",
+    "Delete",
+    "BulkDelete",
+    "AllocateIDs",
+    "Count",
+    "runSingleFilter",
+    "run",
+    "RunInTransaction",
+    "bufferedWrites",
+]
+
+_executor = None
+_executorLock = threading.Lock()
+_sessions = weakref.WeakKeyDictionary()  # Event loop -> (transport._httpSessionGeneration, _AsyncSession)
+
+
+def _getExecutor() -> ThreadPoolExecutor:
+    """
+        Returns the thread pool shared by all calls, creating it on the first call.
+    """
+    global _executor
+    if _executor is None:
+        with _executorLock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=conf["aio_max_workers"],
+                                               thread_name_prefix="viur-datastore-aio")
+    return _executor
+
+
+async def _run(func: Callable, *args, **kwargs) -> Any:
+    """
+        Runs func(*args, **kwargs) on the shared thread pool, inside a copy of the current context.
+    """
+    return await asyncio.wrap_future(submit(_getExecutor(), func, *args, **kwargs))
+
+
+async def _runWithCache(func: Callable, *args) -> Any:
+    """
+        Runs func(*args), which reads or writes the cache: On the thread pool if conf["memcache_client"] is set, as
+        it might block, or right away otherwise.
+    """
+    if conf["memcache_client"] is None:
+        return func(*args)
+    return await _run(func, *args)
+
+
+class _AsyncSession:
+    """
+        Sends the requests of one event loop with an httpx.AsyncClient, authenticated with the default credentials.
+    """
+
+    def __init__(self):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError('viur.datastore.aio requires httpx (pip install httpx, or "httpx[http2]" for '
+                              'conf["http2"])') from e
+        self._httpx = httpx
+        self._credentials = None
+        self._authRequest = google.auth.transport.requests.Request()
+        self._authLock = asyncio.Lock()
+        self._client = httpx.AsyncClient(
+            http2=conf["http2"],
+            limits=httpx.Limits(
+                max_connections=conf["http_pool_maxsize"],
+                max_keepalive_connections=conf["http_pool_maxsize"] if conf["http_keep_alive"] else 0,
+            ),
+        )
+
+    async def post(self, url: str, data: bytes, timeout: tuple):
+        """
+            Sends one authenticated POST request. The credentials are refreshed (once) if the request is rejected
+            as unauthenticated. Errors are raised as the corresponding exceptions of requests.
+        """
+        for refreshed in (False, True):
+            async with self._authLock:
+                if self._credentials is None:
+                    self._credentials, _ = await _run(google.auth.default,
+                                                      scopes=["https://www.googleapis.com/auth/datastore"])
+                if refreshed or not self._credentials.valid:
+                    await _run(self._credentials.refresh, self._authRequest)
+            headers = {"Content-Type": "application/json"}
+            self._credentials.apply(headers)
+            try:
+                resp = await self._client.post(url, content=data, headers=headers,
+                                               timeout=self._httpx.Timeout(timeout[1], connect=timeout[0]))
+            except self._httpx.TimeoutException as e:
+                raise RequestsTimeout(str(e)) from e
+            except self._httpx.TransportError as e:
+                raise RequestsConnectionError(str(e)) from e
+            if resp.status_code != 401:
+                break
+        return resp
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+async def _getPost() -> Callable[[str, bytes, tuple], Awaitable]:
+    """
+        Returns the coroutine function sending requests for the running event loop: The backend's (see
+        :func:`viur.datastore.transport.setBackend`), if one is set, or the post method of this loop's session,
+        creating it if necessary.
+    """
+    backend = transport._httpBackend
+    if backend is not None:
+        if hasattr(backend, "apost"):
+            return backend.apost
+        return partial(_run, backend.post)
+    loop = asyncio.get_running_loop()
+    generation, session = _sessions.get(loop, (None, None))
+    if generation != transport._httpSessionGeneration:  # resetHttpSession() has been called since
+        oldSession = session
+        session = _AsyncSession()
+        _sessions[loop] = transport._httpSessionGeneration, session
+        if oldSession is not None:
+            await oldSession.aclose()
+    return session.post
+
+
+async def _request(method: str, data: bytes, idempotent: bool) -> Any:
+    """
+        Awaitable version of :func:`viur.datastore.transport.authenticated_request`, retrying the same requests.
+
+        :param method: The rest api method to call
+        :param data: The data to include in the post request
+        :param idempotent: Whether the request can safely be sent again, even if it might have been processed
+        :return: The response
+    """
+    url = transport._apiUrl(method)
+    metrics = currentOperation.get()
+    post = await _getPost()
+    timeout = (conf["http_connect_timeout"], conf["http_read_timeout"])
+    retries = conf["http_retries"]
+    for attempt in range(0, retries + 1):
+        if attempt:
+            await asyncio.sleep(transport._retryDelay(attempt))
+        start = transport._requestStarted(attempt)
+        try:
+            resp = await post(url, data, timeout)
+        except RequestsConnectionError:
+            logging.debug("Retrying http post request to datastore")
+            if attempt == retries:
+                raise
+            continue
+        except RequestsTimeout:
+            if not idempotent or attempt == retries:
+                raise
+            logging.debug("Retrying timed out http post request to datastore")
+            continue
+        finally:
+            transport._requestFinished(metrics, url, data, start, attempt)
+        if metrics is not None:
+            metrics.add(response_bytes=len(resp.content))
+        if idempotent and resp.status_code in HTTP_RETRY_STATUS_CODES and attempt < retries:
+            logging.debug(f"Retrying http post request to datastore after status {resp.status_code}")
+            continue
+        return resp
+
+
+async def _drive(steps: Generator) -> Any:
+    """
+        Runs the given steps (see :func:`viur.datastore.transport._drive`), awaiting their requests and delays.
+
+        :return: The value returned by the steps
+    """
+    try:
+        step = next(steps)
+        while True:
+            if isinstance(step, tuple):
+                step = steps.send(await _request(*step))
+            else:
+                await asyncio.sleep(step)
+                step = steps.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+async def _runConcurrently(func: Callable[..., Awaitable], argsList: Iterable[tuple], max_workers: int) -> List[Any]:
+    """
+        Awaitable version of :func:`viur.datastore.concurrency.run_concurrently`, awaiting func once for each tuple
+        of arguments in argsList, with up to max_workers calls in flight at once.
+        The results are returned in the order of argsList. If any call raises, all calls that have not been started
+        yet are skipped and the exception is re-raised.
+    """
+    argsList = list(argsList)
+    if max_workers == 1 or len(argsList) <= 1:
+        return [await func(*args) for args in argsList]
+    semaphore = asyncio.Semaphore(max_workers)
+    failed = False
+
+    async def limited(args: tuple) -> Any:
+        nonlocal failed
+        async with semaphore:
+            if failed:
+                return None
+            try:
+                return await func(*args)
+            except BaseException:
+                failed = True
+                raise
+
+    return await asyncio.gather(*[limited(args) for args in argsList])
+
+
+def _instrumented(operation: str, kindOf: Callable[..., Optional[str]]) -> Callable:
+    """
+        Coroutine version of the decorator :func:`viur.datastore.transport._instrumented`.
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            state = transport._startOperation(operation, kindOf, args, kwargs)
+            if state is None:
+                return await func(*args, **kwargs)
+            error = None
+            try:
+                return await func(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                transport._finishOperation(state, error)
+        return wrapper
+    return decorator
+
+
+@_instrumented("Get", transport._kindOfKeys)
+async def Get(keys: Union[Key, List[Key]]) -> Union[None, Entity, List[Entity]]:
+    """
+        Awaitable version of :func:`viur.datastore.transport.Get`. Its lookups are not coalesced with those of
+        other tasks or threads (see conf["coalesce_lookups"]).
+    """
+    isMulti = True
+    if isinstance(keys, Key):
+        keys = [keys]
+        isMulti = False
+    res, missingKeys, readOptions = await _runWithCache(transport._startGet, keys)
+    if missingKeys:
+        fetchStart = perf_counter()
+        found = {}
+        batches = [(missingKeys[idx:idx + LOOKUP_MAX_BATCH_SIZE], readOptions)
+                   for idx in range(0, len(missingKeys), LOOKUP_MAX_BATCH_SIZE)]
+        maxWorkers = 1 if currentTransaction.get() else conf["max_concurrent_lookups"]
+        for batchRes in await _runConcurrently(_lookupBatch, batches, maxWorkers):
+            found.update(batchRes)
+        await _runWithCache(transport._finishGet, missingKeys, found, perf_counter() - fetchStart, res)
+    if not isMulti:
+        return res.get(keys[0])
+    return [res.get(key) for key in keys]
+
+
+async def _lookupBatch(keys: List[Key], readOptions: dict) -> dict:
+    """
+        Awaitable version of :func:`viur.datastore.transport._lookupBatch`.
+    """
+    return await _drive(transport._lookupSteps(keys, readOptions))
+
+
+@_instrumented("Put", transport._kindOfKeys)
+async def Put(entities: Union[Entity, List[Entity]]) -> Union[Entity, List[Entity]]:
+    """
+        Awaitable version of :func:`viur.datastore.transport.Put`.
+    """
+    if isinstance(entities, Entity):
+        entities = [entities]
+    mutations = transport._encodePut(entities)
+    currentTxn = currentTransaction.get()
+    if currentTxn:  # We're currently inside a transaction, just queue the changes
+        transport._putInTxn(currentTxn, entities, mutations)
+        return
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Committed later, together with other writes
+        if writeBuffer._add(entities, mutations):
+            await _flush(writeBuffer)
+        return entities
+    await _runConcurrently(
+        _commitBatch,
+        [(batchItems, batchMutations, True) for batchItems, batchMutations in
+         transport._commitBatches(entities, mutations)],
+        conf["max_concurrent_commits"],
+    )
+    return entities
+
+
+async def _commitBatch(items: list, mutations: List[bytes], cacheEntities: bool) -> None:
+    """
+        Awaitable version of :func:`viur.datastore.transport._commitBatch`.
+    """
+    await _drive(transport._commitSteps(items, mutations))
+    if conf["memcache_client"] is not None:
+        await _run(transport._cacheCommitted, items, cacheEntities)
+
+
+@_instrumented("Delete", transport._kindOfKeys)
+async def Delete(keys: Union[Key, List[Key], Entity, List[Entity]]) -> None:
+    """
+        Awaitable version of :func:`viur.datastore.transport.Delete`.
+    """
+    keys = transport._deletedKeys(keys)
+    if not keys:
+        return
+    currentTxn = currentTransaction.get()
+    if currentTxn:
+        transport._deleteInTxn(currentTxn, keys)
+        return
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Committed later, together with other writes
+        if writeBuffer._add(keys, [transport.encodeDeleteMutation(x) for x in keys]):
+            await _flush(writeBuffer)
+        return
+    await _runConcurrently(_deleteBatch, transport._keyBatches(keys, COMMIT_MAX_MUTATIONS),
+                           conf["max_concurrent_commits"])
+
+
+async def _deleteBatch(keys: List[Key]) -> None:
+    """
+        Awaitable version of :func:`viur.datastore.transport._deleteBatch`.
+    """
+    await _drive(transport._deleteSteps(keys))
+    if conf["memcache_client"] is not None:
+        await _run(cache.delete, keys)
+
+
+async def BulkDelete(keys: Iterable[Union[Key, Entity]]) -> int:
+    """
+        Awaitable version of :func:`viur.datastore.transport.BulkDelete`. It's run on the thread pool, as the
+        iterable may block (like :meth:`viur.datastore.query.Query.iterKeys` does).
+    """
+    return await _run(transport.BulkDelete, keys)
+
+
+@_instrumented("AllocateIDs", transport._kindOfKeys)
+async def AllocateIDs(keys: Union[Key, List[Key]]) -> Union[Key, List[Key]]:
+    """
+        Awaitable version of :func:`viur.datastore.transport.AllocateIDs`.
+    """
+    return await _drive(transport._allocateIdsSteps(keys))
+
+
+@_instrumented("Count", transport._kindOfCount)
+async def Count(kind: str = None, up_to=2 ** 63 - 1, queryDefinition: QueryDefinition = None) -> int:
+    """
+        Awaitable version of :func:`viur.datastore.transport.Count`.
+    """
+    return await _drive(transport._countSteps(kind, up_to, queryDefinition))
+
+
+@_instrumented("runSingleFilter", transport._kindOfQuery)
+async def runSingleFilter(queryDefinition: QueryDefinition, limit: int) -> List[Entity]:
+    """
+        Awaitable version of :func:`viur.datastore.transport.runSingleFilter`.
+    """
+    return await _drive(transport._runQuerySteps(queryDefinition, limit))
+
+
+async def run(query: Query, limit: int = -1) -> List[Entity]:
+    """
+        Awaitable version of :meth:`viur.datastore.query.Query.run`. Fulltext searches and queries of classes
+        overriding _runSingleFilterQuery are run on the thread pool.
+    """
+    if query.queries is None:  # Not satisfiable, nothing to wait for
+        return query.run(limit)
+    if query._fulltextQueryString or type(query)._runSingleFilterQuery is not Query._runSingleFilterQuery:
+        return await _run(query.run, limit)
+    if isinstance(query.queries, list):
+        requestedLimit, limit = query._multiQueryLimits(limit)
+        # We send all queries at once, so we'll only have to wait for the slowest one to return
+        res = await _runConcurrently(
+            _runSingleFilterAndFixKind,
+            [(query, singleQuery, limit if limit != -1 else singleQuery.limit) for singleQuery in query.queries],
+            1 if currentTransaction.get() else conf["max_concurrent_queries"],
+        )
+        res = query._mergeMultiQuery(res, requestedLimit, limit)
+    else:  # We have just one single query
+        res = await _runSingleFilterAndFixKind(query, query.queries, limit if limit != -1 else query.queries.limit)
+    if res:
+        query._lastEntry = res[-1]
+    return res
+
+
+async def _runSingleFilterAndFixKind(query: Query, queryDefinition: QueryDefinition, limit: int) -> List[Entity]:
+    """
+        Awaitable version of :meth:`viur.datastore.query.Query._runSingleFilterQueryAndFixKind`.
+    """
+    res = list(await runSingleFilter(queryDefinition, limit))
+    parentKeys = query._parentKeys(res)
+    if parentKeys is not None:
+        return list(await Get(parentKeys))
+    return res
+
+
+@_instrumented("RunInTransaction", lambda *args, **kwargs: None)
+async def RunInTransaction(callback: Callable, *args, **kwargs) -> Any:
+    """
+        Awaitable version of :func:`viur.datastore.transport.RunInTransaction`. The callback can be a coroutine
+        function (using the functions of this module) or a regular one, which is run on the thread pool (so it
+        may use the blocking functions) instead of blocking the event loop. The transaction is only visible to the
+        task running it.
+
+        :param callback: The function to run inside a transaction
+        :param args: Args to pass to the function
+        :param kwargs: Kwargs to pass to the function
+        :return: The return-value of the callback function
+    """
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Buffered writes must not overwrite the writes of this transaction later on
+        await _flush(writeBuffer)
+    allowOverriding = kwargs.pop("__allowOverriding__", None)
+    metrics = currentOperation.get()
+    for exponential_backoff in range(1, 4):
+        if metrics is not None and exponential_backoff > 1:
+            metrics.add(retries=1)
+        try:
+            currentTxn = await _drive(transport._beginTxnSteps(allowOverriding))
+            try:
+                currentTransaction.set(currentTxn)
+                try:
+                    if inspect.iscoroutinefunction(callback):
+                        res = await callback(*args, **kwargs)
+                    else:  # Runs inside a copy of our context, so it sees the transaction as well
+                        res = await _run(callback, *args, **kwargs)
+                        if inspect.isawaitable(res):
+                            res = await res
+                except:
+                    await _drive(transport._rollbackTxnSteps(currentTxn["key"]))
+                    raise
+                await _drive(transport._commitTxnSteps(currentTxn))
+                if currentTxn["mutations"] and conf["memcache_client"] is not None:
+                    await _run(transport._publishTxn, currentTxn)
+                return res
+            finally:  # Ensure, currentTransaction is always set back to none
+                currentTransaction.set(None)
+        except (CollisionError, AbortedError):  # Got a collision or is aborted; retry the entire transaction
+            sleep_time = 2 ** exponential_backoff
+            logging.error(f"We got an error in a transaction we try again in {sleep_time} seconds")
+            await asyncio.sleep(sleep_time)
+    raise CollisionError("All retries are exhausted for this transaction")
+
+
+async def _flush(writeBuffer: WriteBuffer) -> None:
+    """
+        Awaitable version of :meth:`viur.datastore.transport.WriteBuffer.flush`.
+    """
+    items, mutations = writeBuffer._take()
+    if items:
+        await _commitBuffered(items, mutations)
+
+
+@_instrumented("Commit", transport._kindOfKeys)
+async def _commitBuffered(items: list, mutations: List[bytes]) -> None:
+    """
+        Awaitable version of :func:`viur.datastore.transport._commitBuffered`.
+    """
+    await _runConcurrently(
+        _commitBatch,
+        [(batchItems, batchMutations, False) for batchItems, batchMutations in
+         transport._commitBatches(items, mutations)],
+        conf["max_concurrent_commits"],
+    )
+
+
+@asynccontextmanager
+async def bufferedWrites(max_mutations: int = COMMIT_MAX_MUTATIONS) -> AsyncIterator[WriteBuffer]:
+    """
+        Asynchronous version of :func:`viur.datastore.utils.bufferedWrites`.
+    """
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # The outer context will flush
+        yield writeBuffer
+        return
+    writeBuffer = WriteBuffer(max_mutations)
+    token = currentWriteBuffer.set(writeBuffer)
+    try:
+        yield writeBuffer
+    finally:
+        currentWriteBuffer.reset(token)
+        await _flush(writeBuffer)
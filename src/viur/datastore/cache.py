@@ -1,16 +1,42 @@
+import heapq
+import math
+import random
+import re
+import struct
 import sys
+import threading
 import time
 import time as time_module
-from typing import Any, Dict, List, Union
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Dict, List, Optional, Union
 
 import logging
+from viur.datastore import codec
 from viur.datastore.config import conf
 from viur.datastore.types import Entity, Key
 
 MEMCACHE_MAX_BATCH_SIZE = 30
-MEMCACHE_NAMESPACE = "viur-datastore"
+# Versioned, as entries written with another format of the cache keys or values must not be read
+MEMCACHE_NAMESPACE = "viur-datastore-v2"
 MEMCACHE_TIMEOUT = 60 * 60
 MEMCACHE_MAX_SIZE = 1_000_000
+# How long (in seconds) a key that hasn't been found in the datastore is remembered as missing. 0 disables this.
+MEMCACHE_NEGATIVE_TIMEOUT = 60
+# Each timeout is shortened by a random fraction of up to this, so entries cached together don't expire together
+MEMCACHE_TIMEOUT_JITTER = 0.1
+# Entries are refreshed early with a probability growing the closer they get to their expiry (and the longer
+# they took to fetch), so that usually one reader refreshes a hot entry before it expires. 0 disables this.
+MEMCACHE_EARLY_REFRESH_BETA = 1.0
+# The time (in seconds) assumed to fetch an entry, unless it's given on put()
+MEMCACHE_DEFAULT_FETCH_TIME = 0.05
+
+# Entries written by put() are prefixed by this tag, followed by their expiry and the time it took to fetch them.
+# Anything else has been written by an older version and is never refreshed early.
+_ENVELOPE_TAG = b"\xfe"
+_ENVELOPE_HEADER = struct.Struct("<dd")
+# The characters of keys in the legacy urlsafe format (see Key.to_legacy_urlsafe), passed to to_cache_key as strings
+_LEGACY_URLSAFE_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
 
 """
 
@@ -25,6 +51,16 @@ MEMCACHE_MAX_SIZE = 1_000_000
 	else:
 		db.config["memcache_client"] = db.cache.LocalMemcache()
 
+	To keep the most recently used entities in the memory of each instance as well (saving the round-trip to the
+	memcache), wrap the client into a TieredCache:
+	..  code-block:: python
+	db.config["memcache_client"] = db.cache.TieredCache(db.cache.InProcessCache(), Client())
+
+	Keys that haven't been found are cached as well (for MEMCACHE_NEGATIVE_TIMEOUT seconds). To avoid that all
+	instances refetch a frequently read entity at once when it expires, it's refreshed early by a single reader
+	with a probability that grows as its expiry approaches ("probabilistic early expiration"). All timeouts are
+	jittered by up to MEMCACHE_TIMEOUT_JITTER.
+
 """
 
 __all__ = [
@@ -32,24 +68,70 @@ __all__ = [
     "MEMCACHE_NAMESPACE",
     "MEMCACHE_TIMEOUT",
     "MEMCACHE_MAX_SIZE",
+    "MEMCACHE_NEGATIVE_TIMEOUT",
+    "MEMCACHE_TIMEOUT_JITTER",
+    "MEMCACHE_EARLY_REFRESH_BETA",
+    "MEMCACHE_DEFAULT_FETCH_TIME",
+    "to_cache_key",
     "get",
     "put",
+    "put_missing",
     "delete",
-    "LocalMemcache"
+    "LocalMemcache",
+    "InProcessCache",
+    "TieredCache",
 ]
 
 
-def get(keys: Union[str, Key, List[str], List[Key]]) -> Dict[str, dict]:
+def to_cache_key(key: Union[str, Key]) -> str:
+    """
+        Returns the identifier an entry is stored under in the memcache: The :attr:`Key.cache_key` for keys,
+        while strings are used as they are. Strings in the legacy urlsafe format (like str(key)) are translated to
+        the cache key of the key they represent, so that they still refer to its entry.
+    """
+    if isinstance(key, Key):
+        return key.cache_key
+    key = str(key)
+    if _LEGACY_URLSAFE_PATTERN.fullmatch(key):  # Cache keys of complete keys contain ":" or "#", these don't
+        try:
+            legacyKey = Key.from_legacy_urlsafe(key)
+        except Exception:  # Not a legacy urlsafe key after all
+            legacyKey = None
+        if legacyKey is not None and not legacyKey.is_partial:
+            logging.warning(f"The cache was accessed by the legacy urlsafe key {key!r}, use the Key instead")
+            return legacyKey.cache_key
+    return key
+
+
+def jittered_timeout(timeout: int) -> int:
+    """
+        Returns timeout shortened by a random fraction of up to MEMCACHE_TIMEOUT_JITTER (but at least one second).
+    """
+    return max(1, int(timeout * (1 - random.uniform(0, MEMCACHE_TIMEOUT_JITTER))))
+
+
+def _should_refresh_early(expires: float, fetch_time: float, now: float) -> bool:
+    """
+        Decides whether an entry expiring at expires is refreshed now, see MEMCACHE_EARLY_REFRESH_BETA.
+    """
+    return now - fetch_time * MEMCACHE_EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= expires
+
+
+def get(keys: Union[str, Key, List[str], List[Key]], include_missing: bool = False) -> Dict[str, Optional[dict]]:
     """
         Reads data form the memcache.
+        Entries that are about to expire might be skipped (with a probability growing as they approach their
+        expiry), so that the caller refreshes them before everyone misses at once.
+
         :param Union[str, Key, List[str], List[Key]] keys: Unique identifier(s) for one or more entry(s).
-        :return: A dict with the entry(s) that found in the memcache.
+        :param include_missing: Include keys cached as not found (see :func:`put_missing`), mapped to None.
+        :return: A dict with the entry(s) that found in the memcache, indexed by their :func:`to_cache_key`.
     """
     if not check_for_memcache():
         return {}
     if not isinstance(keys, list):
         keys = [keys]
-    keys = [str(key) for key in keys]  # Enforce that all keys are strings
+    keys = [to_cache_key(key) for key in keys]  # Enforce that all keys are strings
     res = {}
     try:
         while keys:
@@ -57,14 +139,50 @@ def get(keys: Union[str, Key, List[str], List[Key]]) -> Dict[str, dict]:
             keys = keys[MEMCACHE_MAX_BATCH_SIZE:]
     except Exception as e:
         logging.error(f"""Failed to get keys form the memcache with {e=}""")
-    return res
+    decoded = {}
+    now = time.time()
+    for key, value in res.items():
+        if isinstance(value, bytes):  # Anything else has been written by an older version (as pickled entity)
+            if value[:1] == _ENVELOPE_TAG:
+                expires, fetch_time = _ENVELOPE_HEADER.unpack_from(value, 1)
+                if MEMCACHE_EARLY_REFRESH_BETA > 0 and _should_refresh_early(expires, fetch_time, now):
+                    continue
+                value = value[1 + _ENVELOPE_HEADER.size:]
+            try:
+                value = codec.decode(value)
+            except Exception as e:
+                logging.error(f"""Failed to decode {key} read from the memcache with {e=}""")
+                continue
+        if value is not None or include_missing:
+            decoded[key] = value
+    return decoded
 
 
-def put(data: Union[Entity, Dict[Key, Entity], List[Entity]]):
+def _set(data: Dict[str, bytes], timeout: int, fetch_time: Optional[float]) -> None:
+    """
+        Writes the given encoded values to the memcache, each batch with its own jittered timeout.
+    """
+    if fetch_time is None:
+        fetch_time = MEMCACHE_DEFAULT_FETCH_TIME
+    keys = list(data.keys())
+    try:
+        while keys:
+            batch_timeout = jittered_timeout(timeout)
+            header = _ENVELOPE_TAG + _ENVELOPE_HEADER.pack(time.time() + batch_timeout, fetch_time)
+            data_batch = {key: header + data[key] for key in keys[:MEMCACHE_MAX_BATCH_SIZE]}
+            conf["memcache_client"].set_multi(data_batch, namespace=MEMCACHE_NAMESPACE, time=batch_timeout)
+            keys = keys[MEMCACHE_MAX_BATCH_SIZE:]
+    except Exception as e:
+        logging.error(f"""Failed to put data to the memcache with {e=}""")
+
+
+def put(data: Union[Entity, Dict[Key, Entity], List[Entity]], fetch_time: Optional[float] = None):
     """
         Writes Data to the memcache.
 
         :param Union[Entity, Dict[Key, Entity], List[Entity]] data: Data to write
+        :param fetch_time: How long (in seconds) it took to fetch the data, defaults to MEMCACHE_DEFAULT_FETCH_TIME.
+            Entries that are expensive to fetch are refreshed earlier.
     """
     if not check_for_memcache():
         return
@@ -74,17 +192,34 @@ def put(data: Union[Entity, Dict[Key, Entity], List[Entity]]):
         data = {data.key: data}
     elif not isinstance(data, dict):
         raise TypeError(f"Invalid type {type(data)}. Expected a db.Entity, list or dict.")
-    # Add only values to cache <= MEMMAX_SIZE (1.000.000)
-    data = {str(key): value for key, value in data.items() if get_size(value) <= MEMCACHE_MAX_SIZE}
+    encoded = {}
+    for key, value in data.items():
+        try:
+            value = codec.encode(value)
+        except TypeError as e:
+            logging.error(f"""Failed to encode {key} for the memcache with {e=}""")
+            continue
+        # Add only values to cache <= MEMMAX_SIZE (1.000.000)
+        if len(value) + 1 + _ENVELOPE_HEADER.size <= MEMCACHE_MAX_SIZE:
+            encoded[to_cache_key(key)] = value
+    _set(encoded, MEMCACHE_TIMEOUT, fetch_time)
 
-    keys = list(data.keys())
-    try:
-        while keys:
-            data_batch = {key: data[key] for key in keys[:MEMCACHE_MAX_BATCH_SIZE]}
-            conf["memcache_client"].set_multi(data_batch, namespace=MEMCACHE_NAMESPACE, time=MEMCACHE_TIMEOUT)
-            keys = keys[MEMCACHE_MAX_BATCH_SIZE:]
-    except Exception as e:
-        logging.error(f"""Failed to put data to the memcache with {e=}""")
+
+def put_missing(keys: Union[Key, List[Key]], fetch_time: Optional[float] = None) -> None:
+    """
+        Remembers that the given keys haven't been found in the datastore for MEMCACHE_NEGATIVE_TIMEOUT seconds.
+        :func:`get` will return them (if include_missing is set) as None, until they're overwritten by
+        :func:`put` or removed by :func:`delete`.
+
+        :param keys: The key(s) that haven't been found
+        :param fetch_time: How long (in seconds) it took to look them up, see :func:`put`
+    """
+    if MEMCACHE_NEGATIVE_TIMEOUT <= 0 or not check_for_memcache():
+        return
+    if not isinstance(keys, list):
+        keys = [keys]
+    missing = codec.encode(None)
+    _set({to_cache_key(key): missing for key in keys}, MEMCACHE_NEGATIVE_TIMEOUT, fetch_time)
 
 
 def delete(keys: Union[str, Key, List[str], List[Key]]) -> None:
@@ -97,7 +232,7 @@ def delete(keys: Union[str, Key, List[str], List[Key]]) -> None:
         return
     if not isinstance(keys, list):
         keys = [keys]
-    keys = [str(key) for key in keys]  # Enforce that all keys are strings
+    keys = [to_cache_key(key) for key in keys]  # Enforce that all keys are strings
     try:
         while keys:
             conf["memcache_client"].delete_multi(keys[:MEMCACHE_MAX_BATCH_SIZE], namespace=MEMCACHE_NAMESPACE)
@@ -167,3 +302,161 @@ class LocalMemcache:
 
     def flush_all(self):
         self._data.clear()
+
+
+class InProcessCache:
+    """
+        A bounded in-process cache, providing the interface of a memcache client.
+
+        Entries are evicted in least-recently-used order as soon as either max_entries or (approximately)
+        max_bytes is exceeded. Expired entries are dropped when they're read, and on each write all entries
+        that have expired are removed as well (found through a heap ordered by expiry time), so memory is
+        released even for keys that are never read again.
+        It's thread-safe and can be used on its own or as the first tier of a :class:`TieredCache`.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 1024 * 1024):
+        """
+            :param max_entries: The maximum number of entries to keep
+            :param max_bytes: The maximum approximated size of all entries kept
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (namespace, key) -> (value, expires, size); ordered from least to most recently used
+        self._data: OrderedDict = OrderedDict()
+        # Heap of (expires, (namespace, key)). Entries deleted or overwritten since are skipped when they're popped
+        self._expiry: List[tuple] = []
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: tuple) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def get_multi(self, keys: List[str], namespace: str = MEMCACHE_NAMESPACE) -> Dict[str, Any]:
+        res = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._data.get((namespace, key))
+                if entry is None:
+                    self.misses += 1
+                elif entry[1] <= now:
+                    self._remove((namespace, key))
+                    self.expirations += 1
+                    self.misses += 1
+                else:
+                    self._data.move_to_end((namespace, key))
+                    res[key] = entry[0]
+                    self.hits += 1
+        return {key: deepcopy(value) for key, value in res.items()}
+
+    def set_multi(self, data: Dict[str, Any], namespace: str = MEMCACHE_NAMESPACE, time: int = MEMCACHE_TIMEOUT):
+        now = time_module.time()
+        expires = now + time if time > 0 else float("inf")
+        data = {key: (deepcopy(value), get_size(value)) for key, value in data.items()}
+        with self._lock:
+            for key, (value, size) in data.items():
+                if (namespace, key) in self._data:
+                    self._remove((namespace, key))
+                if size > self.max_bytes:
+                    continue
+                self._data[(namespace, key)] = (value, expires, size)
+                if expires != float("inf"):
+                    heapq.heappush(self._expiry, (expires, (namespace, key)))
+                self._bytes += size
+            # Drop everything that has expired already
+            while self._expiry and self._expiry[0][0] <= now:
+                keyExpires, key = heapq.heappop(self._expiry)
+                entry = self._data.get(key)
+                if entry is not None and entry[1] == keyExpires:
+                    self._remove(key)
+                    self.expirations += 1
+            if len(self._expiry) > 2 * len(self._data) + 64:
+                # Too many heap entries refer to entries that have been deleted or overwritten; rebuild it
+                self._expiry = [(entry[1], key) for key, entry in self._data.items() if entry[1] != float("inf")]
+                heapq.heapify(self._expiry)
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete_multi(self, keys: List[str] = [], namespace: str = MEMCACHE_NAMESPACE):
+        with self._lock:
+            for key in keys:
+                if (namespace, key) in self._data:
+                    self._remove((namespace, key))
+
+    def flush_all(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry = []
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+            :return: The counters of this cache (hits, misses, evictions, expirations) and its current size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+            }
+
+
+class TieredCache:
+    """
+        Combines a fast local cache (usually an :class:`InProcessCache`) with a shared one (like the memcache
+        client), providing the interface of a memcache client itself.
+
+        Reads are served from the local tier first; entries only found in the shared tier are copied into the
+        local one. Writes and deletes go to both tiers. As other instances can't invalidate our local tier,
+        entries are kept there for at most local_timeout seconds, which bounds how long a write done by another
+        instance can go unnoticed here.
+    """
+
+    def __init__(self, local, shared, local_timeout: int = 60):
+        """
+            :param local: The local (first) tier
+            :param shared: The shared (second) tier
+            :param local_timeout: The maximum number of seconds an entry is kept in the local tier
+        """
+        self.local = local
+        self.shared = shared
+        self.local_timeout = local_timeout
+
+    def _local_time(self, time: int) -> int:
+        return min(time, self.local_timeout) if time > 0 else self.local_timeout
+
+    def get_multi(self, keys: List[str], namespace: str = MEMCACHE_NAMESPACE) -> Dict[str, Any]:
+        res = self.local.get_multi(keys, namespace=namespace)
+        if missing := [key for key in keys if key not in res]:
+            if res_shared := self.shared.get_multi(missing, namespace=namespace):
+                self.local.set_multi(res_shared, namespace=namespace, time=self._local_time(MEMCACHE_TIMEOUT))
+                res |= res_shared
+        return res
+
+    def set_multi(self, data: Dict[str, Any], namespace: str = MEMCACHE_NAMESPACE, time: int = MEMCACHE_TIMEOUT):
+        self.shared.set_multi(data, namespace=namespace, time=time)
+        self.local.set_multi(data, namespace=namespace, time=self._local_time(time))
+
+    def delete_multi(self, keys: List[str] = [], namespace: str = MEMCACHE_NAMESPACE):
+        self.shared.delete_multi(keys, namespace=namespace)
+        self.local.delete_multi(keys, namespace=namespace)
+
+    def flush_all(self):
+        self.shared.flush_all()
+        self.local.flush_all()
+
+    def stats(self) -> Optional[Dict[str, int]]:
+        """
+            :return: The counters of the local tier, if it provides any
+        """
+        return self.local.stats() if hasattr(self.local, "stats") else None
@@ -0,0 +1,318 @@
+# distutils: language = c++
+# cython: language_level=3
+"""
+    A compact binary serialization for entities, keys and all other values that can be stored in the datastore.
+
+    It's used to store entities in the cache: Its output is smaller than a pickled entity, its length can be
+    used as the size of the cached value, and it's independent of the python classes used.
+    Datetimes are normalized to UTC, just like they're returned from the datastore.
+
+    Each encoded value starts with a one-byte tag, followed by its payload. Lengths and counts are stored in
+    one byte if they're smaller than 128, otherwise in four bytes (big endian, with the highest bit set).
+    Numbers are stored as little endian 64-bit integers or doubles.
+"""
+from datetime import datetime, timedelta, timezone
+from viur.datastore.types import Entity, Key
+from libcpp.string cimport string
+from libc.stdint cimport int64_t, uint64_t, uint32_t
+from libc.string cimport memcpy
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AsStringAndSize
+
+cdef extern from "Python.h":
+    const char * PyUnicode_AsUTF8AndSize(object unicode, Py_ssize_t * size) except NULL
+    object PyUnicode_DecodeUTF8(const char * s, Py_ssize_t size, const char * errors)
+
+__all__ = [
+    "encode",
+    "decode",
+]
+
+# Prepended to each encoded value, so the format can be changed later on
+FORMAT_VERSION = b"\x01"
+
+cdef enum:
+    TAG_NONE = 0x4E  # N
+    TAG_TRUE = 0x54  # T
+    TAG_FALSE = 0x46  # F
+    TAG_INT = 0x69  # i, a signed 64-bit integer
+    TAG_BIGINT = 0x49  # I, an integer too large for 64 bits, stored in decimal
+    TAG_FLOAT = 0x64  # d
+    TAG_STR = 0x73  # s
+    TAG_BYTES = 0x62  # b
+    TAG_DATETIME = 0x74  # t, microseconds since the epoch (UTC)
+    TAG_KEY = 0x6B  # k
+    TAG_ENTITY = 0x45  # E
+    TAG_DICT = 0x44  # D
+    TAG_LIST = 0x6C  # l
+    TAG_GEOPOINT = 0x67  # g, a tuple of latitude and longitude
+
+cdef object _EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+cdef object _MICROSECOND = timedelta(microseconds=1)
+cdef object _UTC = timezone.utc
+cdef object _INT64_MIN = -2 ** 63
+cdef object _INT64_MAX = 2 ** 63 - 1
+
+## Encoding
+
+cdef inline void _writeTag(string & out, unsigned char tag):
+    out.push_back(<char> tag)
+
+cdef inline void _writeLength(string & out, Py_ssize_t length):
+    cdef uint32_t value
+    if length < 0x80:
+        out.push_back(<char> length)
+    else:
+        value = <uint32_t> length | 0x80000000u
+        out.push_back(<char> ((value >> 24) & 0xFF))
+        out.push_back(<char> ((value >> 16) & 0xFF))
+        out.push_back(<char> ((value >> 8) & 0xFF))
+        out.push_back(<char> (value & 0xFF))
+
+cdef inline void _writeUInt64(string & out, uint64_t value):
+    cdef int idx
+    for idx in range(8):
+        out.push_back(<char> ((value >> (8 * idx)) & 0xFF))
+
+cdef inline void _writeDouble(string & out, double value):
+    cdef uint64_t raw
+    memcpy(&raw, &value, 8)
+    _writeUInt64(out, raw)
+
+cdef inline void _writeStr(string & out, str value) except *:
+    cdef Py_ssize_t size
+    cdef const char * data = PyUnicode_AsUTF8AndSize(value, &size)
+    _writeLength(out, size)
+    out.append(data, size)
+
+cdef void _writeKey(string & out, object key) except *:
+    path = []
+    while key:
+        path.append(key)
+        key = key.parent
+    _writeLength(out, len(path))
+    for key in reversed(path):
+        _writeStr(out, key.kind)
+        if key.id:
+            _writeTag(out, TAG_INT)
+            _writeUInt64(out, <uint64_t> <int64_t> key.id)
+        elif key.name:
+            _writeTag(out, TAG_STR)
+            _writeStr(out, key.name)
+        else:
+            _writeTag(out, TAG_NONE)
+
+cdef void _encode(string & out, object value) except *:
+    cdef char * data
+    cdef Py_ssize_t size
+    if value is None:
+        _writeTag(out, TAG_NONE)
+    elif value is True:
+        _writeTag(out, TAG_TRUE)
+    elif value is False:
+        _writeTag(out, TAG_FALSE)
+    elif isinstance(value, str):
+        _writeTag(out, TAG_STR)
+        _writeStr(out, value)
+    elif isinstance(value, int):
+        if _INT64_MIN <= value <= _INT64_MAX:
+            _writeTag(out, TAG_INT)
+            _writeUInt64(out, <uint64_t> <int64_t> value)
+        else:
+            _writeTag(out, TAG_BIGINT)
+            _writeStr(out, str(int(value)))
+    elif isinstance(value, float):
+        _writeTag(out, TAG_FLOAT)
+        _writeDouble(out, value)
+    elif isinstance(value, Key):
+        _writeTag(out, TAG_KEY)
+        _writeKey(out, value)
+    elif isinstance(value, datetime):
+        _writeTag(out, TAG_DATETIME)
+        _writeUInt64(out, <uint64_t> <int64_t> ((value.astimezone(_UTC) - _EPOCH) // _MICROSECOND))
+    elif isinstance(value, Entity):
+        _writeTag(out, TAG_ENTITY)
+        _encode(out, value.key)
+        _encode(out, value.version)
+        _writeLength(out, len(value.exclude_from_indexes))
+        for name in value.exclude_from_indexes:
+            _writeStr(out, name)
+        _writeLength(out, len(value))
+        for name, propValue in value.items():
+            _writeStr(out, name)
+            _encode(out, propValue)
+    elif isinstance(value, dict):
+        _writeTag(out, TAG_DICT)
+        _writeLength(out, len(value))
+        for name, propValue in value.items():
+            _writeStr(out, name)
+            _encode(out, propValue)
+    elif isinstance(value, list):
+        _writeTag(out, TAG_LIST)
+        _writeLength(out, len(value))
+        for item in value:
+            _encode(out, item)
+    elif isinstance(value, bytes):
+        _writeTag(out, TAG_BYTES)
+        PyBytes_AsStringAndSize(value, &data, &size)
+        _writeLength(out, size)
+        out.append(data, size)
+    elif isinstance(value, tuple) and len(value) == 2:
+        _writeTag(out, TAG_GEOPOINT)
+        _writeDouble(out, value[0])
+        _writeDouble(out, value[1])
+    else:
+        raise TypeError(f"{value!r} ({type(value)}) is not supported")
+
+def encode(value: object) -> bytes:
+    """
+        Serializes the given value (usually an Entity).
+
+        :param value: The value to encode
+        :return: The encoded representation
+    """
+    cdef string out
+    out.reserve(1024)
+    out.push_back(FORMAT_VERSION[0])
+    _encode(out, value)
+    return PyBytes_FromStringAndSize(out.data(), out.size())
+
+## Decoding
+
+cdef struct _Buffer:
+    const unsigned char * data
+    Py_ssize_t size
+    Py_ssize_t pos
+
+cdef inline int _need(_Buffer * buf, Py_ssize_t count) except -1:
+    if buf.pos + count > buf.size:
+        raise ValueError("Truncated data")
+    return 0
+
+cdef inline unsigned char _readTag(_Buffer * buf) except? 0:
+    _need(buf, 1)
+    buf.pos += 1
+    return buf.data[buf.pos - 1]
+
+cdef inline Py_ssize_t _readLength(_Buffer * buf) except -1:
+    cdef Py_ssize_t length
+    _need(buf, 1)
+    length = buf.data[buf.pos]
+    if length < 0x80:
+        buf.pos += 1
+        return length
+    _need(buf, 4)
+    length = ((<uint32_t> buf.data[buf.pos] & 0x7F) << 24) | (<uint32_t> buf.data[buf.pos + 1] << 16) \
+             | (<uint32_t> buf.data[buf.pos + 2] << 8) | <uint32_t> buf.data[buf.pos + 3]
+    buf.pos += 4
+    return length
+
+cdef inline uint64_t _readUInt64(_Buffer * buf) except? 0:
+    cdef uint64_t value = 0
+    cdef int idx
+    _need(buf, 8)
+    for idx in range(8):
+        value |= (<uint64_t> buf.data[buf.pos + idx]) << (8 * idx)
+    buf.pos += 8
+    return value
+
+cdef inline double _readDouble(_Buffer * buf) except? -1:
+    cdef uint64_t raw = _readUInt64(buf)
+    cdef double value
+    memcpy(&value, &raw, 8)
+    return value
+
+cdef inline str _readStr(_Buffer * buf):
+    cdef Py_ssize_t length = _readLength(buf)
+    _need(buf, length)
+    buf.pos += length
+    return PyUnicode_DecodeUTF8(<const char *> buf.data + buf.pos - length, length, NULL)
+
+cdef object _readKey(_Buffer * buf):
+    cdef Py_ssize_t count = _readLength(buf)
+    cdef unsigned char tag
+    key = None
+    for _ in range(count):
+        kind = _readStr(buf)
+        tag = _readTag(buf)
+        if tag == TAG_INT:
+            key = Key(kind, <int64_t> _readUInt64(buf), parent=key)
+        elif tag == TAG_STR:
+            key = Key(kind, parent=key)
+            key.name = _readStr(buf)  # Assigned directly, as names consisting only of digits are valid as well
+        else:
+            key = Key(kind, parent=key)
+    return key
+
+cdef object _decode(_Buffer * buf):
+    cdef unsigned char tag = _readTag(buf)
+    cdef Py_ssize_t count, idx
+    if tag == TAG_STR:
+        return _readStr(buf)
+    elif tag == TAG_INT:
+        return <int64_t> _readUInt64(buf)
+    elif tag == TAG_NONE:
+        return None
+    elif tag == TAG_TRUE:
+        return True
+    elif tag == TAG_FALSE:
+        return False
+    elif tag == TAG_FLOAT:
+        return _readDouble(buf)
+    elif tag == TAG_DATETIME:
+        return _EPOCH + timedelta(microseconds=<int64_t> _readUInt64(buf))
+    elif tag == TAG_KEY:
+        return _readKey(buf)
+    elif tag == TAG_LIST:
+        count = _readLength(buf)
+        res = []
+        for idx in range(count):
+            res.append(_decode(buf))
+        return res
+    elif tag == TAG_ENTITY:
+        entity = Entity(_decode(buf))
+        entity.version = _decode(buf)
+        count = _readLength(buf)
+        exclude = set()
+        for idx in range(count):
+            exclude.add(_readStr(buf))
+        entity.exclude_from_indexes = exclude
+        count = _readLength(buf)
+        for idx in range(count):
+            name = _readStr(buf)
+            entity[name] = _decode(buf)
+        return entity
+    elif tag == TAG_DICT:
+        count = _readLength(buf)
+        res = {}
+        for idx in range(count):
+            name = _readStr(buf)
+            res[name] = _decode(buf)
+        return res
+    elif tag == TAG_BYTES:
+        count = _readLength(buf)
+        _need(buf, count)
+        buf.pos += count
+        return PyBytes_FromStringAndSize(<const char *> buf.data + buf.pos - count, count)
+    elif tag == TAG_BIGINT:
+        return int(_readStr(buf))
+    elif tag == TAG_GEOPOINT:
+        latitude = _readDouble(buf)
+        longitude = _readDouble(buf)
+        return latitude, longitude
+    raise ValueError(f"Invalid tag {tag:#x} at position {buf.pos - 1}")
+
+def decode(data: bytes) -> object:
+    """
+        Deserializes a value encoded by :func:`encode`.
+
+        :param data: The encoded representation
+        :return: The decoded value
+    """
+    cdef _Buffer buf
+    cdef char * ptr
+    if data[:1] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported format version {data[:1]!r}")
+    PyBytes_AsStringAndSize(data, &ptr, &buf.size)
+    buf.data = <const unsigned char *> ptr
+    buf.pos = 1
+    return _decode(&buf)
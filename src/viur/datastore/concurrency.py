@@ -0,0 +1,82 @@
+"""
+    Helpers to run blocking datastore requests concurrently on a bounded number of threads.
+
+    Each call is executed inside a copy of the callers context, so ContextVars like currentTransaction and
+    currentDbAccessLog are visible inside the worker threads exactly as they are for the caller.
+"""
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Iterable, Iterator, List
+
+__all__ = [
+    "iter_concurrently",
+    "run_concurrently",
+    "submit",
+]
+
+
+def submit(executor: ThreadPoolExecutor, func: Callable, *args, **kwargs) -> Future:
+    """
+        Schedules func(*args, **kwargs) on the given executor, running it inside a copy of the current context.
+
+        :param executor: The executor to run the call on
+        :param func: The callable to run
+        :return: The future for that call
+    """
+    return executor.submit(copy_context().run, func, *args, **kwargs)
+
+
+def run_concurrently(func: Callable, argsList: Iterable[tuple], max_workers: int) -> List[Any]:
+    """
+        Calls func once for each tuple of arguments in argsList, using up to max_workers threads at once.
+
+        The results are returned in the order of argsList, regardless of the order in which the calls finished.
+        If max_workers is 1 (or there is only one call to make), everything is run in the calling thread.
+        If any call raises, all calls that have not been started yet are cancelled and the exception is re-raised.
+
+        :param func: The callable to run
+        :param argsList: The positional arguments for each call
+        :param max_workers: The maximum number of calls in flight at the same time
+        :return: The list of return values
+    """
+    argsList = list(argsList)
+    if max_workers <= 1 or len(argsList) <= 1:
+        return [func(*args) for args in argsList]
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(argsList)))
+    try:
+        futures = [submit(executor, func, *args) for args in argsList]
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_concurrently(func: Callable, argsIterable: Iterable[tuple], max_workers: int) -> Iterator[Any]:
+    """
+        Like run_concurrently, but argsIterable is consumed lazily and the results are yielded one by one (in the
+        order of argsIterable). As at most max_workers calls are in flight (and buffered) at once, this can be used
+        with arbitrarily long iterables.
+
+        If max_workers is 1, everything is run in the calling thread.
+        If any call raises, all calls that have not been started yet are cancelled and the exception is re-raised.
+
+        :param func: The callable to run
+        :param argsIterable: The positional arguments for each call
+        :param max_workers: The maximum number of calls in flight at the same time
+        :return: An iterator over the return values
+    """
+    if max_workers <= 1:
+        for args in argsIterable:
+            yield func(*args)
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = deque()
+    try:
+        for args in argsIterable:
+            if len(futures) >= max_workers:
+                yield futures.popleft().result()
+            futures.append(submit(executor, func, *args))
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
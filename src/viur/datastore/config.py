@@ -25,4 +25,51 @@ conf = {
     },
     # A Client form the Google Memcache Library.
     "memcache_client": None,
+    # How many sub-queries of a multi-query (IN or != filters) are sent to the datastore at the same time.
+    # Set to 1 to run them one after another. Inside transactions, they're always run one after another.
+    "max_concurrent_queries": 8,
+    # How many lookup batches (of up to 300 keys each) a single Get() has in flight at the same time.
+    # Set to 1 to fetch them one after another. Inside transactions, they're always fetched one after another.
+    "max_concurrent_lookups": 4,
+    # If set, Get() (outside of transactions) doesn't request keys another thread is already fetching, but waits
+    # for that lookup and uses its result.
+    "coalesce_lookups": False,
+    # If coalesce_lookups is set, Get() calls fetching less than 300 keys wait this long (in seconds) for other
+    # calls, so that their keys can be fetched together. 0 disables waiting.
+    "coalesce_lookups_window": 0.0,
+    # How many commits (of up to 500 mutations each) a single Put(), Delete() or BulkDelete() has in flight at the
+    # same time. Set to 1 to commit one after another. This doesn't apply inside transactions.
+    "max_concurrent_commits": 4,
+    # The largest batch Query.iter(prefetch=True) will request at once
+    "iter_max_batch_size": 300,
+    # How many entities Query.iter(prefetch=True) may hold in memory at once (the batch being consumed and the
+    # one being prefetched). For multi-queries, this is shared among all sub-queries.
+    "iter_max_buffered_entities": 1000,
+    # Each thread keeps the buffers used to encode requests and parse responses for the next request. Buffers that
+    # grew larger than this (in bytes) while handling a large request are released instead.
+    "max_retained_buffer_size": 4 * 1024 * 1024,
+    # The settings of the connection pool all requests to the datastore are sent with. Call
+    # transport.resetHttpSession() after changing them; transport.httpPoolStats() helps to size the pool.
+    # How many hosts a connection pool is kept for
+    "http_pool_connections": 10,
+    # How many connections to the datastore are kept open for reuse. Should be at least the number of threads
+    # sending requests at the same time (including concurrent lookups, queries and commits).
+    "http_pool_maxsize": 32,
+    # If set, requests wait for a free connection instead of opening one that's discarded afterwards
+    "http_pool_block": False,
+    # Timeouts (in seconds) for establishing a connection and for waiting on the response. None waits forever.
+    "http_connect_timeout": 10.0,
+    "http_read_timeout": 120.0,
+    # Whether connections are kept open for the next request
+    "http_keep_alive": True,
+    # Send requests over HTTP/2 instead. This requires httpx with HTTP/2 support to be installed.
+    "http2": False,
+    # How often a request is retried if the connection fails. Reads (lookups and queries) are also retried if
+    # they time out or the datastore answers with UNAVAILABLE or DEADLINE_EXCEEDED.
+    "http_retries": 2,
+    # How many threads viur.datastore.aio uses for the work it can't do on the event loop (like cache accesses)
+    "aio_max_workers": 32,
+    # A callable receiving the measurements (a viur.datastore.metrics.OperationMetrics) of each call of Get, Put,
+    # Delete, BulkDelete, AllocateIDs, Count, runSingleFilter and RunInTransaction. None disables measuring.
+    "metrics_sink": None,
 }
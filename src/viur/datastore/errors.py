@@ -152,6 +152,16 @@ class NoMutationResultsError(ViurDatastoreError):
     pass
 
 
+class PartialEntityError(ViurDatastoreError):
+    """This error indicates that an entity returned by a projection query should have been written.
+
+    As such entities only contain the projected properties, writing them would delete all others.
+
+    This is an 'internal' error which is not backed by an error code provided by google datastore.
+    """
+    pass
+
+
 """This maps the indicator from error object status field to one of
 our ViurDatastore Exception classes"""
 CANONICAL_ERROR_CODE_MAP = {
@@ -0,0 +1,517 @@
+"""
+    An in-memory stand-in for the datastore rest api, to run code (like the benchmarks) without network access.
+    To use it, install it as the backend of the transport:
+    ..  code-block:: python
+    from viur.datastore import fake, transport
+    transport.setBackend(fake.FakeDatastore(latency=0.01))
+
+    It answers lookup, runQuery, runAggregationQuery, commit, beginTransaction, rollback and allocateIds with the
+    json the datastore would return, including cursors, deferred keys (see max_lookup_results), partial query
+    batches (see query_batch_size) and ABORTED errors for transactions conflicting with other commits.
+
+    It's meant for testing and benchmarking, not as a reference implementation: There are no indexes (each query
+    scans its kind), projections and distinct queries use the first value of list properties, and all entities
+    are stored in a single namespace.
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from base64 import b64decode, urlsafe_b64decode, urlsafe_b64encode
+from collections import Counter
+from datetime import datetime, timezone
+from functools import cmp_to_key
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+__all__ = [
+    "FakeDatastore",
+]
+
+# The order of the value types, as far as values of different types are compared
+_TYPE_ORDER = {
+    "nullValue": 0,
+    "integerValue": 1,
+    "timestampValue": 1,
+    "booleanValue": 2,
+    "blobValue": 3,
+    "stringValue": 4,
+    "doubleValue": 5,
+    "geoPointValue": 6,
+    "keyValue": 7,
+}
+
+_FILTER_OPS = {
+    "EQUAL": lambda a, b: a == b,
+    "LESS_THAN": lambda a, b: a < b,
+    "LESS_THAN_OR_EQUAL": lambda a, b: a <= b,
+    "GREATER_THAN": lambda a, b: a > b,
+    "GREATER_THAN_OR_EQUAL": lambda a, b: a >= b,
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class _RequestError(Exception):
+    """
+        Raised by the handlers of the FakeDatastore to answer with an error.
+    """
+
+    def __init__(self, code: int, status: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+        self.message = message
+
+
+def _normalizeIds(obj: Any) -> None:
+    """
+        Converts all ids of key paths in obj to strings (inplace), as int64 values are returned as strings.
+    """
+    if isinstance(obj, dict):
+        path = obj.get("path")
+        if isinstance(path, list):
+            for element in path:
+                if "id" in element:
+                    element["id"] = str(element["id"])
+        for value in obj.values():
+            _normalizeIds(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            _normalizeIds(value)
+
+
+def _pathId(path: List[dict]) -> tuple:
+    """
+        Returns the hashable identifier of an entity by the path of its key.
+    """
+    return tuple((element["kind"], element.get("id"), element.get("name")) for element in path)
+
+
+def _pathOrder(path: List[dict]) -> tuple:
+    """
+        Returns the sort order of a key: Element by element, by kind, with numeric ids before names.
+    """
+    return tuple((element["kind"], 0, int(element["id"]), "") if "id" in element
+                 else (element["kind"], 1, 0, element.get("name") or "") for element in path)
+
+
+def _isPartial(path: List[dict]) -> bool:
+    return "id" not in path[-1] and "name" not in path[-1]
+
+
+def _mutationKey(mutation: dict) -> dict:
+    """
+        Returns the key written or deleted by a mutation.
+    """
+    if "delete" in mutation:
+        return mutation["delete"]
+    op, = [x for x in ("upsert", "insert", "update") if x in mutation]
+    return mutation[op]["key"]
+
+
+def _timestampMicros(value: str) -> int:
+    """
+        Parses a RFC 3339 timestamp (with fractional seconds of any length) into microseconds since the epoch.
+    """
+    offset = 0
+    if value.endswith("Z"):
+        value = value[:-1]
+    elif value[-6] in "+-":
+        offset = (int(value[-5:-3]) * 60 + int(value[-2:])) * (1 if value[-6] == "+" else -1)
+        value = value[:-6]
+    value, _, fraction = value.partition(".")
+    res = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc) - _EPOCH
+    micros = (res.days * 86400 + res.seconds - offset * 60) * 1_000_000
+    return micros + int((fraction + "000000")[:6])
+
+
+def _sortKey(value: dict) -> tuple:
+    """
+        Returns the position of a (json encoded) value in the index.
+    """
+    for valueType, rank in _TYPE_ORDER.items():
+        if valueType in value:
+            data = value[valueType]
+            break
+    else:
+        raise _RequestError(400, "INVALID_ARGUMENT", "Unsupported value %r" % value)
+    if valueType == "nullValue":
+        return rank,
+    elif valueType == "integerValue":
+        return rank, int(data)
+    elif valueType == "timestampValue":
+        return rank, _timestampMicros(data)
+    elif valueType == "blobValue":
+        return rank, b64decode(data)
+    elif valueType == "doubleValue":
+        return rank, float(data)
+    elif valueType == "geoPointValue":
+        return rank, data.get("latitude", 0.0), data.get("longitude", 0.0)
+    elif valueType == "keyValue":
+        return rank, _pathOrder(data["path"])
+    return rank, data
+
+
+def _indexedValues(entity: dict, name: str) -> List[dict]:
+    """
+        Returns the values of the given property that are indexed (and can be filtered or sorted by).
+    """
+    if name == "__key__":
+        return [{"keyValue": entity["key"]}]
+    properties = entity.get("properties", {})
+    value = properties.get(name)
+    if value is None and "." in name:  # A property of an embedded entity
+        prefix, _, rest = name.partition(".")
+        if "entityValue" in properties.get(prefix, {}):
+            return _indexedValues(properties[prefix]["entityValue"], rest)
+    if value is None:
+        return []
+    values = value["arrayValue"].get("values", []) if "arrayValue" in value else [value]
+    return [x for x in values if not x.get("excludeFromIndexes") and "entityValue" not in x and "arrayValue" not in x]
+
+
+def _encodeCursor(position: Optional[list]) -> str:
+    """
+        Encodes the position after an entity (its sort values, the path of its key and whether the query sorted
+        descending by each value) as cursor.
+    """
+    return urlsafe_b64encode(json.dumps(position).encode("UTF-8")).decode("ASCII")
+
+
+def _decodeCursor(cursor: str) -> Optional[list]:
+    try:
+        return json.loads(urlsafe_b64decode(cursor.encode("ASCII")))
+    except ValueError:
+        raise _RequestError(400, "INVALID_ARGUMENT", "Invalid cursor")
+
+
+def _response(url: str, status_code: int, data: dict) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.url = url
+    resp._content = json.dumps(data).encode("UTF-8")
+    return resp
+
+
+class FakeDatastore:
+    """
+        Answers the requests of the transport from entities kept in memory. It's thread-safe, and requests sent
+        at the same time wait for their (simulated) latency concurrently.
+    """
+
+    def __init__(self, latency: float = 0.0, latency_jitter: float = 0.0, max_lookup_results: Optional[int] = None,
+                 query_batch_size: int = 300):
+        """
+            :param latency: How long (in seconds) each request takes
+            :param latency_jitter: A random delay of up to this many seconds added to each request
+            :param max_lookup_results: Answer at most this many keys of a lookup, deferring the others
+            :param query_batch_size: Return at most this many entities in one batch of a query (reporting the
+                query as NOT_FINISHED if there are more), regardless of its limit
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.max_lookup_results = max_lookup_results
+        self.query_batch_size = query_batch_size
+        self.requests = Counter()  # rest api method -> number of requests received
+        self._lock = threading.Lock()
+        self._entities: Dict[tuple, dict] = {}  # path id -> entity
+        self._versions: Dict[tuple, int] = {}  # path id -> version of the last write or delete
+        self._version = 0
+        self._ids = itertools.count(1)
+        self._transactions: Dict[str, dict] = {}  # transaction -> {"snapshot": version, "read": set of path ids}
+        self._transactionIds = itertools.count(1)
+
+    def post(self, url: str, data: bytes, timeout: Any = None) -> requests.Response:
+        """
+            Answers one request to the rest api, as sent by :func:`viur.datastore.transport.authenticated_request`.
+        """
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return self._answer(url, data)
+
+    async def apost(self, url: str, data: bytes, timeout: Any = None) -> requests.Response:
+        """
+            Awaitable version of post, as used by :mod:`viur.datastore.aio`. The latency is awaited without blocking
+            the event loop.
+        """
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._answer(url, data)
+
+    def clear(self) -> None:
+        """
+            Removes all entities and pending transactions.
+        """
+        with self._lock:
+            self._entities.clear()
+            self._versions.clear()
+            self._transactions.clear()
+
+    ## Helpers
+
+    def _delay(self) -> float:
+        """
+            Returns the (simulated) latency of the next request.
+        """
+        return self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+
+    def _answer(self, url: str, data: bytes) -> requests.Response:
+        """
+            Answers one request right away.
+        """
+        method = url.rsplit(":", 1)[1]
+        handler = getattr(self, "_" + method, None)
+        with self._lock:
+            self.requests[method] += 1
+            try:
+                if handler is None:
+                    raise _RequestError(404, "NOT_FOUND", "Unknown method %s" % method)
+                body = json.loads(data)
+                _normalizeIds(body)
+                return _response(url, 200, handler(body))
+            except _RequestError as e:
+                return _response(url, e.code, {"error": {"code": e.code, "message": e.message, "status": e.status}})
+
+    def _readTransaction(self, readOptions: Optional[dict]) -> Optional[dict]:
+        """
+            Returns the transaction the given readOptions refer to (if any).
+        """
+        if not readOptions or "transaction" not in readOptions:
+            return None
+        txn = self._transactions.get(readOptions["transaction"])
+        if txn is None:
+            raise _RequestError(400, "INVALID_ARGUMENT",
+                                "The referenced transaction has expired or is no longer valid.")
+        return txn
+
+    def _query(self, query: dict) -> List[Tuple[list, dict]]:
+        """
+            Returns the entities matching the filters of the query, sorted by its orders, as (position, entity).
+            The position holds the values sorted by and the path of the key.
+        """
+        kind = query["kind"][0]["name"]
+        filters = query.get("filter")
+        if filters is None:
+            filters = []
+        elif "compositeFilter" in filters:
+            filters = [x["propertyFilter"] for x in filters["compositeFilter"]["filters"]]
+        else:
+            filters = [filters["propertyFilter"]]
+        filters = [(x["property"]["name"], _FILTER_OPS[x["op"]], _sortKey(x["value"])) for x in filters]
+        orders = [(x["property"]["name"], x.get("direction", "ASCENDING") == "DESCENDING")
+                  for x in query.get("order", [])]
+        rows = []
+        for pathId, entity in self._entities.items():
+            if pathId[-1][0] != kind:
+                continue
+            if not all(any(op(_sortKey(value), target) for value in _indexedValues(entity, name))
+                       for name, op, target in filters):
+                continue
+            values = []
+            for name, descending in orders:
+                indexed = _indexedValues(entity, name)
+                if not indexed:  # Entities without that property aren't part of the index
+                    break
+                values.append((max if descending else min)(indexed, key=_sortKey))
+            else:
+                rows.append(([values, entity["key"]["path"]], entity))
+        compare = self._positionComparator(orders)
+        rows.sort(key=cmp_to_key(lambda a, b: compare(a[0], b[0])))
+        return rows
+
+    @staticmethod
+    def _positionComparator(orders: List[Tuple[str, bool]]):
+        """
+            Returns a function comparing two positions (as stored in cursors) of a query with the given orders.
+        """
+
+        def compare(a: list, b: list) -> int:
+            for (_, descending), valueA, valueB in zip(orders, a[0], b[0]):
+                keyA, keyB = _sortKey(valueA), _sortKey(valueB)
+                if keyA != keyB:
+                    return (-1 if keyA < keyB else 1) * (-1 if descending else 1)
+            keyA, keyB = _pathOrder(a[1]), _pathOrder(b[1])
+            return 0 if keyA == keyB else (-1 if keyA < keyB else 1)
+
+        return compare
+
+    def _commitMutations(self, mutations: List[dict]) -> List[dict]:
+        """
+            Applies the given mutations (all of them or none) and returns their results.
+        """
+        results = []
+        pending = {}  # path id -> entity or None
+        for mutation in mutations:
+            op, = [x for x in ("upsert", "insert", "update", "delete") if x in mutation]
+            if op == "delete":
+                pending[_pathId(mutation["delete"]["path"])] = None
+                results.append({})
+                continue
+            entity = mutation[op]
+            result = {}
+            if _isPartial(entity["key"]["path"]):
+                entity["key"]["path"][-1]["id"] = str(next(self._ids))
+                result["key"] = entity["key"]
+            pathId = _pathId(entity["key"]["path"])
+            exists = (pending[pathId] is not None) if pathId in pending else pathId in self._entities
+            if op == "insert" and exists:
+                raise _RequestError(409, "ALREADY_EXISTS", "entity already exists")
+            if op == "update" and not exists:
+                raise _RequestError(404, "NOT_FOUND", "no entity to update")
+            pending[pathId] = entity
+            results.append(result)
+        self._version += 1
+        for pathId, entity in pending.items():
+            self._versions[pathId] = self._version
+            if entity is None:
+                self._entities.pop(pathId, None)
+            else:
+                self._entities[pathId] = entity
+        for result in results:
+            result["version"] = str(self._version)
+        return results
+
+    ## Handlers of the rest api methods
+
+    def _lookup(self, body: dict) -> dict:
+        txn = self._readTransaction(body.get("readOptions"))
+        keys = body["keys"]
+        if self.max_lookup_results is not None:
+            keys, deferred = keys[:self.max_lookup_results], keys[self.max_lookup_results:]
+        else:
+            deferred = []
+        found = []
+        missing = []
+        for key in keys:
+            pathId = _pathId(key["path"])
+            if txn is not None:
+                txn["read"].add(pathId)
+            if pathId in self._entities:
+                found.append({"entity": self._entities[pathId], "version": str(self._versions[pathId])})
+            else:
+                missing.append({"entity": {"key": key}, "version": str(self._version)})
+        res = {}
+        if found:
+            res["found"] = found
+        if missing:
+            res["missing"] = missing
+        if deferred:
+            res["deferred"] = deferred
+        return res
+
+    def _runQuery(self, body: dict) -> dict:
+        txn = self._readTransaction(body.get("readOptions"))
+        query = body["query"]
+        orders = [(x["property"]["name"], x.get("direction", "ASCENDING") == "DESCENDING")
+                  for x in query.get("order", [])]
+        directions = [descending for _, descending in orders]
+        rows = self._query(query)
+        # A cursor points to the gap after an entity. If it's used with the orders reversed, that entity comes
+        # right after the gap.
+        if query.get("startCursor") and (start := _decodeCursor(query["startCursor"])) is not None:
+            compare = self._positionComparator([(None, x) for x in start[2]])
+            reverse = start[2] != directions
+            rows = [row for row in rows if (compare(row[0], start) > 0) != reverse]
+        if query.get("endCursor") and (end := _decodeCursor(query["endCursor"])) is not None:
+            compare = self._positionComparator([(None, x) for x in end[2]])
+            reverse = end[2] != directions
+            rows = [row for row in rows if (compare(row[0], end) <= 0) != reverse]
+        if query.get("distinctOn"):
+            names = [x["name"] for x in query["distinctOn"]]
+            seen = set()
+            distinctRows = []
+            for position, entity in rows:
+                values = [_indexedValues(entity, name) for name in names]
+                if not all(values):
+                    continue
+                distinctKey = tuple(_sortKey(x[0]) for x in values)
+                if distinctKey not in seen:
+                    seen.add(distinctKey)
+                    distinctRows.append((position, entity))
+            rows = distinctRows
+        projection = [x["property"]["name"] for x in query.get("projection", [])]
+        if projection and projection != ["__key__"]:
+            # Like the datastore, skip entities lacking an indexed value for any of the projected properties
+            rows = [row for row in rows
+                    if all(_indexedValues(row[1], name) for name in projection if name != "__key__")]
+        limit = query.get("limit", len(rows))
+        batchSize = min(limit, self.query_batch_size)
+        page = rows[:batchSize]
+        if len(rows) <= batchSize:
+            moreResults = "NO_MORE_RESULTS"
+        elif batchSize == limit:
+            moreResults = "MORE_RESULTS_AFTER_LIMIT"
+        else:
+            moreResults = "NOT_FINISHED"
+        entityResults = []
+        for position, entity in page:
+            pathId = _pathId(entity["key"]["path"])
+            if txn is not None:
+                txn["read"].add(pathId)
+            if projection == ["__key__"]:
+                entity = {"key": entity["key"]}
+            elif projection:
+                entity = {
+                    "key": entity["key"],
+                    "properties": {name: _indexedValues(entity, name)[0] for name in projection if name != "__key__"},
+                }
+            entityResults.append({"entity": entity, "version": str(self._versions[pathId]),
+                                  "cursor": _encodeCursor(position + [directions])})
+        batch = {
+            "entityResultType": "KEY_ONLY" if projection == ["__key__"] else "PROJECTION" if projection else "FULL",
+            "endCursor": entityResults[-1]["cursor"] if entityResults else query.get("startCursor",
+                                                                                     _encodeCursor(None)),
+            "moreResults": moreResults,
+        }
+        if entityResults:
+            batch["entityResults"] = entityResults
+        return {"batch": batch}
+
+    def _runAggregationQuery(self, body: dict) -> dict:
+        self._readTransaction(body.get("readOptions"))
+        aggregationQuery = body.get("aggregation_query") or body["aggregationQuery"]
+        query = aggregationQuery.get("nested_query") or aggregationQuery["nestedQuery"]
+        count = aggregationQuery.get("aggregations", {}).get("count", {})
+        upTo = int(count.get("up_to", count.get("upTo", 2 ** 63 - 1)))
+        total = min(len(self._query(query)), upTo)
+        return {
+            "batch": {
+                "aggregationResults": [{"aggregateProperties": {"property_1": {"integerValue": str(total)}}}],
+                "moreResults": "NO_MORE_RESULTS",
+            }
+        }
+
+    def _beginTransaction(self, body: dict) -> dict:
+        txnId = urlsafe_b64encode(b"txn-%d" % next(self._transactionIds)).decode("ASCII")
+        self._transactions[txnId] = {"snapshot": self._version, "read": set()}
+        return {"transaction": txnId}
+
+    def _rollback(self, body: dict) -> dict:
+        self._transactions.pop(body["transaction"], None)
+        return {}
+
+    def _commit(self, body: dict) -> dict:
+        mutations = body.get("mutations", [])
+        if body.get("mode") == "TRANSACTIONAL":
+            txn = self._transactions.pop(body.get("transaction"), None)
+            if txn is None:
+                raise _RequestError(400, "INVALID_ARGUMENT",
+                                    "The referenced transaction has expired or is no longer valid.")
+            touched = txn["read"] | {_pathId(_mutationKey(mutation)["path"]) for mutation in mutations}
+            if any(self._versions.get(pathId, 0) > txn["snapshot"] for pathId in touched):
+                raise _RequestError(409, "ABORTED", "too much contention on these datastore entities. "
+                                                    "please try again.")
+        results = self._commitMutations(mutations)
+        return {"mutationResults": results, "indexUpdates": len(results)}
+
+    def _allocateIds(self, body: dict) -> dict:
+        keys = body["keys"]
+        for key in keys:
+            key["path"][-1]["id"] = str(next(self._ids))
+        return {"keys": keys}
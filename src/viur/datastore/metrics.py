@@ -0,0 +1,377 @@
+"""
+    Instrumentation of the public transport functions (Get, Put, Delete, BulkDelete, AllocateIDs, Count,
+    runSingleFilter and RunInTransaction, including their awaitable versions). The commits of the writes collected
+    by bufferedWrites are reported as "Commit" when the buffer is flushed.
+
+    If conf["metrics_sink"] is set, each call of one of them is measured and reported to it as an
+    :class:`OperationMetrics` once it returns (or raises). The sink is any callable accepting one argument, for
+    example a :class:`MetricsCollector` summing up counters or an :class:`OpenTelemetrySink` recording spans:
+    ..  code-block:: python
+    from viur.datastore import config, metrics
+
+    collector = metrics.MetricsCollector()
+    config["metrics_sink"] = collector
+    ...
+    for (operation, kind), values in collector.snapshot().items():
+        print(operation, kind, values["calls"], values["network_time"])
+
+    Calls made from inside another instrumented call (like the Get calls of a RunInTransaction callback) are
+    reported on their own. The sink is called on the thread that made the call, so it should return quickly.
+    Unless a sink is set (or a profile is active), the overhead is a lookup in conf and of currentProfile per call
+    and of currentOperation per request.
+
+    To see what a single request cost, profile it with :func:`viur.datastore.utils.startProfiling`, which
+    collects a :class:`RequestProfile` (with or without a sink).
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from viur.datastore.types import QueryDefinition
+
+__all__ = [
+    "currentOperation",
+    "currentProfile",
+    "OperationMetrics",
+    "MetricsCollector",
+    "RequestProfile",
+    "OpenTelemetrySink",
+]
+
+# The measurements of the public transport function currently running (if conf["metrics_sink"] is set or a
+# profile is active)
+currentOperation: ContextVar[Optional["OperationMetrics"]] = ContextVar("Current Datastore Operation", default=None)
+# The profile collecting the costs of the current request (see viur.datastore.utils.startProfiling)
+currentProfile: ContextVar[Optional["RequestProfile"]] = ContextVar("Datastore-Profile", default=None)
+
+
+class OperationMetrics:
+    """
+        The measurements of a single call of a public transport function. The timings are in seconds; they're
+        summed up over all requests sent, which might have been in flight at the same time (so they can add up to
+        more than duration).
+    """
+    COUNTERS = ("encode_time", "network_time", "decode_time", "requests", "retries", "request_bytes",
+                "response_bytes", "entities", "index_entries", "cache_hits", "cache_misses")
+
+    __slots__ = ("operation", "kind", "start_time", "duration", "error", "nested", "query", "rpcs", "_start",
+                 "_lock") + COUNTERS
+
+    def __init__(self, operation: str, kind: Optional[str] = None, nested: bool = False):
+        """
+            :param operation: The name of the function called, like "Get"
+            :param kind: The kind of the (first) key, entity or query it was called with, if any
+            :param nested: Whether it has been called from inside another measured call
+        """
+        self.operation = operation
+        self.kind = kind
+        self.nested = nested
+        self.start_time = time.time()  # As unix timestamp
+        self.duration = 0.0  # Wall time of the whole call
+        self.error = None  # The name of the exception raised, if any
+        self.query = None  # The QueryDefinition run by runSingleFilter or Count
+        self.rpcs: Dict[str, int] = {}  # Rest api method -> number of requests sent
+        self.encode_time = 0.0  # Encoding request bodies
+        self.network_time = 0.0  # Waiting for responses, including failed attempts
+        self.decode_time = 0.0  # Parsing responses and building the entities (or keys) returned
+        self.requests = 0  # Requests sent, including retries
+        self.retries = 0  # Requests sent again after a failed attempt (or transactions run again)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.entities = 0  # Entities (or keys) read or written by the requests sent
+        self.index_entries = 0  # Index entries counted by Count
+        self.cache_hits = 0  # Keys served from the cache (including keys cached as missing)
+        self.cache_misses = 0  # Keys looked up in the cache, but not found there
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, **values: float) -> None:
+        """
+            Adds the given values to the counters of the same name. This is thread-safe, as concurrent lookups or
+            commits of the same call report to the same OperationMetrics.
+        """
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def addRequest(self, method: str, **values: float) -> None:
+        """
+            Counts a request to the given rest api method (like "lookup") and adds the given values to the counters.
+        """
+        with self._lock:
+            self.requests += 1
+            self.rpcs[method] = self.rpcs.get(method, 0) + 1
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+            Records the duration of this call and the exception it raised (if any).
+        """
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = type(error).__name__
+
+    def asDict(self) -> Dict[str, Any]:
+        """
+            Returns all measurements as a dictionary, e.g. for structured logging.
+        """
+        res = {
+            "operation": self.operation,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+            "nested": self.nested,
+            "rpcs": self.rpcs.copy(),
+        }
+        res.update({name: getattr(self, name) for name in self.COUNTERS})
+        return res
+
+    def __repr__(self) -> str:
+        return "<OperationMetrics %s>" % ", ".join("%s=%r" % item for item in self.asDict().items())
+
+
+class MetricsCollector:
+    """
+        A sink summing up the measurements of all calls by operation and kind.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[Tuple[str, Optional[str]], Dict[str, float]] = {}
+
+    def __call__(self, metrics: OperationMetrics) -> None:
+        with self._lock:
+            totals = self._totals.get((metrics.operation, metrics.kind))
+            if totals is None:
+                totals = self._totals[(metrics.operation, metrics.kind)] = dict.fromkeys(
+                    ("calls", "errors", "duration") + OperationMetrics.COUNTERS, 0)
+            totals["calls"] += 1
+            totals["errors"] += 1 if metrics.error else 0
+            totals["duration"] += metrics.duration
+            for name in OperationMetrics.COUNTERS:
+                totals[name] += getattr(metrics, name)
+
+    def snapshot(self) -> Dict[Tuple[str, Optional[str]], Dict[str, float]]:
+        """
+            Returns a copy of the totals collected so far.
+
+            :return: A dictionary of (operation, kind) -> the number of calls and errors and the sums of their
+                durations and all counters of :class:`OperationMetrics`
+        """
+        with self._lock:
+            return {label: totals.copy() for label, totals in self._totals.items()}
+
+    def reset(self) -> None:
+        """
+            Removes all totals collected so far.
+        """
+        with self._lock:
+            self._totals.clear()
+
+
+class RequestProfile:
+    """
+        The totals of all calls made while it's the currentProfile, to see what a request (or any other unit of
+        work) cost in round trips, reads, writes and time, and to find N+1 patterns (the same lookup or query
+        shape run over and over again). Create it with :func:`viur.datastore.utils.startProfiling`.
+    """
+    READ_OPERATIONS = {"Get", "runSingleFilter"}
+    # Inside transactions, Put and Delete don't write anything themselves; RunInTransaction commits their mutations.
+    # Likewise, the mutations collected by bufferedWrites are committed (and counted) by Commit.
+    WRITE_OPERATIONS = {"Put", "Delete", "BulkDelete", "RunInTransaction", "Commit"}
+
+    def __init__(self, slow_queries: int = 5):
+        """
+            :param slow_queries: How many of the slowest queries to keep
+        """
+        self.slow_queries = slow_queries
+        self.calls: Counter = Counter()  # (operation, kind) -> number of calls
+        self.query_shapes: Counter = Counter()  # (kind, filters, orders) -> number of queries run
+        self.rpcs: Counter = Counter()  # Rest api method -> number of requests sent
+        self.errors = 0
+        self.duration = 0.0  # Wall time of all calls not made from inside another one
+        self.network_time = 0.0
+        self.entities_read = 0
+        self.entities_written = 0
+        self.index_entries = 0  # Index entries counted by Count (which is billed per 1000 of them)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._slowest: List[Tuple[float, int, QueryDefinition, int]] = []  # Heap of the slowest queries
+        self._sequence = itertools.count()  # Tie-breaker for queries taking the same time
+        self._lock = threading.Lock()
+
+    def record(self, metrics: OperationMetrics) -> None:
+        """
+            Adds the measurements of a finished call to this profile.
+        """
+        with self._lock:
+            self.calls[(metrics.operation, metrics.kind)] += 1
+            self.rpcs.update(metrics.rpcs)
+            self.errors += 1 if metrics.error else 0
+            if not metrics.nested:
+                self.duration += metrics.duration
+            self.network_time += metrics.network_time
+            if metrics.operation in self.READ_OPERATIONS:
+                self.entities_read += metrics.entities
+            elif metrics.operation in self.WRITE_OPERATIONS:
+                self.entities_written += metrics.entities
+            self.index_entries += metrics.index_entries
+            self.request_bytes += metrics.request_bytes
+            self.response_bytes += metrics.response_bytes
+            self.cache_hits += metrics.cache_hits
+            self.cache_misses += metrics.cache_misses
+            query = metrics.query
+            if query is not None and metrics.operation == "runSingleFilter":
+                self.query_shapes[(query.kind, tuple(query.filters), tuple(x[0] for x in query.orders or ()))] += 1
+                if self.slow_queries > 0:
+                    if len(self._slowest) < self.slow_queries or metrics.duration > self._slowest[0][0]:
+                        # Keep a copy, as the query might be changed and run again afterwards
+                        entry = (metrics.duration, next(self._sequence),
+                                 replace(query, filters=dict(query.filters),
+                                         orders=list(query.orders) if query.orders is not None else None),
+                                 metrics.entities)
+                        if len(self._slowest) < self.slow_queries:
+                            heapq.heappush(self._slowest, entry)
+                        else:
+                            heapq.heapreplace(self._slowest, entry)
+
+    def merge(self, other: "RequestProfile") -> None:
+        """
+            Adds the totals of another profile (like the one of a nested request) to this one.
+        """
+        with other._lock:
+            slowest = list(other._slowest)
+            values = {name: getattr(other, name) for name in (
+                "errors", "duration", "network_time", "entities_read", "entities_written", "index_entries",
+                "request_bytes", "response_bytes", "cache_hits", "cache_misses")}
+            calls, queryShapes, rpcs = other.calls.copy(), other.query_shapes.copy(), other.rpcs.copy()
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.calls.update(calls)
+            self.query_shapes.update(queryShapes)
+            self.rpcs.update(rpcs)
+            for duration, _, query, entities in slowest:
+                entry = (duration, next(self._sequence), query, entities)
+                if len(self._slowest) < self.slow_queries:
+                    heapq.heappush(self._slowest, entry)
+                elif self.slow_queries > 0 and duration > self._slowest[0][0]:
+                    heapq.heapreplace(self._slowest, entry)
+
+    @property
+    def cache_hit_ratio(self) -> Optional[float]:
+        """
+            The share of keys looked up in the cache that have been found there, or None if there were no lookups.
+        """
+        total = self.cache_hits + self.cache_misses
+        return self.cache_hits / total if total else None
+
+    def slowestQueries(self) -> List[Tuple[float, QueryDefinition, int]]:
+        """
+            Returns the slowest queries run, slowest first.
+
+            :return: A list of (duration, QueryDefinition, number of entities returned) tuples
+        """
+        with self._lock:
+            return [(x[0], x[2], x[3]) for x in sorted(self._slowest, reverse=True)]
+
+    def repeatedCalls(self, threshold: int = 5) -> Dict[tuple, int]:
+        """
+            Returns the lookups and queries that have been repeated suspiciously often, which is a typical sign of
+            an N+1 pattern (fetching related entities one by one in a loop instead of in one Get or query).
+
+            :param threshold: Report everything repeated at least this often
+            :return: A dictionary of ("Get", kind), ("Count", kind) or ("query", kind, filters, orders) -> number
+                of calls
+        """
+        with self._lock:
+            res = {(operation, kind): count for (operation, kind), count in self.calls.items()
+                   if operation in ("Get", "Count") and count >= threshold}
+            res.update({("query",) + shape: count for shape, count in self.query_shapes.items()
+                        if count >= threshold})
+        return res
+
+    def summary(self, threshold: int = 5) -> Dict[str, Any]:
+        """
+            Returns the totals of this profile as a dictionary, e.g. to be logged at the end of a request.
+
+            :param threshold: Report lookups and queries repeated at least this often (see :meth:`repeatedCalls`)
+        """
+        with self._lock:
+            res = {
+                "calls": sum(self.calls.values()),
+                "rpcs": dict(self.rpcs),
+                "errors": self.errors,
+                "duration": self.duration,
+                "network_time": self.network_time,
+                "entities_read": self.entities_read,
+                "entities_written": self.entities_written,
+                "index_entries": self.index_entries,
+                "bytes_sent": self.request_bytes,
+                "bytes_received": self.response_bytes,
+                "cache_hit_ratio": self.cache_hit_ratio,
+            }
+        res["slowest_queries"] = [
+            {"duration": duration, "kind": query.kind, "filters": query.filters, "orders": query.orders,
+             "entities": entities} for duration, query, entities in self.slowestQueries()]
+        res["repeated"] = {" ".join(str(x) for x in label): count
+                           for label, count in self.repeatedCalls(threshold).items()}
+        return res
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        ratio = summary["cache_hit_ratio"]
+        lines = [
+            "%s datastore calls (%s errors) in %.1f ms, %s RPCs (%s), %.1f ms waiting for responses" % (
+                summary["calls"], summary["errors"], summary["duration"] * 1000, sum(summary["rpcs"].values()),
+                ", ".join("%s: %s" % x for x in sorted(summary["rpcs"].items())), summary["network_time"] * 1000),
+            "%s entities read, %s written, %s index entries counted, %s bytes sent, %s received, cache hit ratio %s" % (
+                summary["entities_read"], summary["entities_written"], summary["index_entries"],
+                summary["bytes_sent"], summary["bytes_received"], "-" if ratio is None else "%.0f%%" % (ratio * 100)),
+        ]
+        for query in summary["slowest_queries"]:
+            lines.append("Slow query (%.1f ms, %s entities): %s filters %s orders %s" % (
+                query["duration"] * 1000, query["entities"], query["kind"], query["filters"], query["orders"]))
+        for label, count in summary["repeated"].items():
+            lines.append("Repeated %s times: %s" % (count, label))
+        return "\n".join(lines)
+
+
+class OpenTelemetrySink:
+    """
+        A sink recording each call as OpenTelemetry span named "datastore.<operation>", with the measurements as
+        attributes. This requires opentelemetry-api to be installed.
+    """
+
+    def __init__(self, tracer: Any = None):
+        """
+            :param tracer: The tracer to create the spans with. Defaults to the tracer "viur.datastore" of the
+                global tracer provider.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError("OpenTelemetrySink requires opentelemetry-api (pip install opentelemetry-api)") from e
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("viur.datastore")
+
+    def __call__(self, metrics: OperationMetrics) -> None:
+        attributes = {"db.system": "datastore", "db.operation": metrics.operation}
+        if metrics.kind is not None:
+            attributes["viur.datastore.kind"] = metrics.kind
+        attributes.update({"viur.datastore.%s" % name: getattr(metrics, name) for name in OperationMetrics.COUNTERS})
+        startTime = int(metrics.start_time * 1e9)
+        span = self.tracer.start_span("datastore.%s" % metrics.operation, kind=self._trace.SpanKind.CLIENT,
+                                      start_time=startTime, attributes=attributes)
+        if metrics.error:
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, metrics.error))
+        span.end(end_time=startTime + int(metrics.duration * 1e9))
@@ -1,19 +1,23 @@
 from __future__ import annotations
 
+import heapq
 import logging
 import typing as t
 from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from functools import partial
+from datetime import datetime, timedelta, timezone
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from viur.datastore.transport import Count, Get, runSingleFilter
 
+from viur.datastore.concurrency import run_concurrently, submit
 from viur.datastore.config import conf
 from viur.datastore.types import (
     DATASTORE_BASE_TYPES,
     Entity,
     KEY_SPECIAL_PROPERTY,
+    Key,
     QueryDefinition,
     SkelListRef,
     SortOrder,
@@ -59,6 +63,132 @@ def _entryMatchesQuery(entry: Entity, singleFilter: dict) -> bool:
     return True
 
 
+# The rank of each python type in the sort order used by the datastore when comparing values of different types.
+# Integers and timestamps share their rank (and are compared to each other, see _sortValue).
+_TYPE_SORT_RANKS = {
+    type(None): 0,
+    int: 1,
+    datetime: 1,
+    bool: 3,
+    bytes: 4,
+    str: 5,
+    float: 6,
+    tuple: 7,  # GeoPoints
+    Key: 8,
+}
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class _Descending:
+    """
+        Wraps a sort value so that it compares in reverse order.
+    """
+    __slots__ = ["value"]
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __eq__(self, other: _Descending) -> bool:
+        return self.value == other.value
+
+    def __lt__(self, other: _Descending) -> bool:
+        return other.value < self.value
+
+
+def _keySortValue(key: Key) -> Tuple[Tuple[str, int, Union[int, str]], ...]:
+    """
+        Returns a comparable representation of a key, sorting like the datastore does (by its path from the root,
+        ids before names).
+    """
+    path = []
+    while key:
+        path.append((key.kind or "", 0, key.id) if key.id else (key.kind or "", 1, key.name or ""))
+        key = key.parent
+    return tuple(reversed(path))
+
+
+def _sortValue(value: Any) -> Tuple[int, Any]:
+    """
+        Returns a comparable (type rank, value) tuple for a single property value, as values of different types
+        cannot be compared to each other in python.
+    """
+    rank = _TYPE_SORT_RANKS.get(type(value))
+    if rank is None:
+        for typ, typRank in _TYPE_SORT_RANKS.items():
+            if isinstance(value, typ):
+                rank = typRank
+                break
+        else:  # Entities and the like; the datastore doesn't sort by these
+            return 9, 0
+    if rank == 0:
+        return 0, 0
+    if rank == 8:
+        return 8, _keySortValue(value)
+    if isinstance(value, datetime):  # Compared to integers as microseconds since the epoch, like the datastore does
+        return 1, (value.astimezone(timezone.utc) - _EPOCH) // _MICROSECOND
+    return rank, value
+
+
+def _sortKeyFunc(orders: Optional[List[Tuple[str, SortOrder]]]) -> Callable[[Entity], tuple]:
+    """
+        Builds a function returning a comparable sort key for an entity, that orders entities exactly like
+        the datastore returns them for the given orders: Multi-valued properties are represented by their smallest
+        (or largest if fetched in descending order) value and ties are broken by the entity's key.
+
+        :param orders: The orders of the query the entities are fetched by
+        :return: The key function
+    """
+    orderFuncs = []
+    for field, direction in orders or ():
+        fetchAscending = direction in (SortOrder.Ascending, SortOrder.InvertedDescending)
+        # Inverted orders are fetched in the opposite direction and flipped by runSingleFilter afterwards
+        descending = direction in (SortOrder.Descending, SortOrder.InvertedDescending)
+        path = tuple(field.split("."))
+        orderFuncs.append((field, path, fetchAscending, descending))
+
+    def sortKey(entity: Entity) -> tuple:
+        res = []
+        for field, path, fetchAscending, descending in orderFuncs:
+            if field == KEY_SPECIAL_PROPERTY:
+                val = (8, _keySortValue(entity.key))
+            else:
+                if field in entity:
+                    val = entity[field]
+                else:  # Descend into embedded entities
+                    val = entity
+                    for part in path:
+                        val = val.get(part) if isinstance(val, dict) else None
+                if isinstance(val, list):
+                    values = [_sortValue(x) for x in val]
+                    val = (min(values) if fetchAscending else max(values)) if values else (0, 0)
+                else:
+                    val = _sortValue(val)
+            res.append(_Descending(val) if descending else val)
+        res.append(_keySortValue(entity.key))
+        return tuple(res)
+
+    return sortKey
+
+
+def _ordersWithInequality(filters: Dict[str, DATASTORE_BASE_TYPES],
+                          orders: Optional[List[Tuple[str, SortOrder]]]) -> List[Tuple[str, SortOrder]]:
+    """
+        Returns the orders the datastore actually sorts by: If there's an inequality filter on a property not
+        sorted by first, the results are implicitly sorted by that property first.
+    """
+    orders = list(orders or [])
+    for filterStr in filters:
+        field, _, op = filterStr.rpartition(" ")
+        if "<" in op or ">" in op:
+            if not orders or orders[0][0] != field:
+                orders.insert(0, (field, SortOrder.Ascending))
+            break
+    return orders
+
+
 class Query(object):
     """
         Base Class for querying the datastore. It's API is similar to the google.cloud.datastore.query API,
@@ -398,6 +528,45 @@ class Query(object):
                 query.distinct = keyList
         return self
 
+    def projection(self, keyList: List[str]) -> 'Query':
+        """
+            Only fetch the properties listed in keyList instead of the whole entities.
+            The entities returned are partial and cannot be written back using Put. Lists yield one entity for
+            each of their values.
+
+            :param keyList: The properties to fetch. Must be indexed.
+            :returns: Returns the query itself for chaining.
+        """
+        if isinstance(self.queries, QueryDefinition):
+            self.queries.projection = keyList
+        elif isinstance(self.queries, list):
+            for query in self.queries:
+                query.projection = keyList
+        return self
+
+    def keysOnly(self) -> 'Query':
+        """
+            Only fetch the keys of the entities matching this query. The entities returned have no properties.
+
+            :returns: Returns the query itself for chaining.
+        """
+        return self.projection([KEY_SPECIAL_PROPERTY])
+
+    def lazy(self, enabled: bool = True) -> 'Query':
+        """
+            Return the entities fetched by this query as :class:`LazyEntity`, which only decode the properties
+            that are actually accessed. Useful for wide kinds when only a few properties of each entity are used.
+
+            :param enabled: Whether the entities should be decoded lazily.
+            :returns: Returns the query itself for chaining.
+        """
+        if isinstance(self.queries, QueryDefinition):
+            self.queries.lazy = enabled
+        elif isinstance(self.queries, list):
+            for query in self.queries:
+                query.lazy = enabled
+        return self
+
     def getCursor(self) -> Optional[str]:
         """
             Get a valid cursor from the last run of this query.
@@ -452,23 +621,44 @@ class Query(object):
         """
         return runSingleFilter(query, limit)
 
-    def _mergeMultiQueryResults(self, inputRes: List[List[Entity]]) -> List[Entity]:
+    def _runSingleFilterQueryAndFixKind(self, query: QueryDefinition, limit: int) -> List[Entity]:
+        """
+            Runs a single query definition of a multi-query and resolves its results to the requested kind.
+            This may run in a worker thread, so the results of the already finished queries can be processed
+            while others are still in flight.
+            :param query: The querydefinition to run against the datastore
+            :param limit: How many results should at most be returned
+            :return: The first *limit* entities that matches this query
+        """
+        return self._fixKind(self._runSingleFilterQuery(query, limit))
+
+    def _mergeMultiQueryResults(self, inputRes: List[List[Entity]], limit: Optional[int] = None) -> List[Entity]:
         """
-            Merge the lists of entries into a single list; removing duplicates and restoring sort-order
+            Merge the lists of entries into a single list; removing duplicates and restoring sort-order.
+            As each list is already sorted by the datastore, they're merged with a k-way merge, computing sort keys
+            only for the entries consumed. It stops as soon as *limit* entries have been collected, so the result
+            never holds more than *limit* entries.
             :param inputRes: Nested Lists of Entries returned by each individual query run
+            :param limit: If set, the maximum amount of entries to return
             :return: Sorted & deduplicated list of entries
         """
+        sortKey = _sortKeyFunc(_ordersWithInequality(self.queries[0].filters, self.queries[0].orders))
+        runs = []
+        for subList in inputRes:
+            if subList and subList[0].key.kind != self.queries[0].kind:
+                # _fixKind replaced the results by their parents, which aren't sorted by the orders of this query
+                subList = sorted(subList, key=sortKey)
+            runs.append(subList)
         seenKeys = set()
         res = []
-        for subList in inputRes:
-            for entry in subList:
-                key = entry.key
-                if key in seenKeys:
-                    continue
-                seenKeys.add(key)
-                res.append(entry)
-        # Fixme: What about filters that mix different inequality filters - we'll now simply ignore any implicit sortorder
-        return self._resortResult(res, {}, self.queries[0].orders)
+        for entry in heapq.merge(*runs, key=sortKey):
+            if entry.key in seenKeys:
+                continue
+            seenKeys.add(entry.key)
+            res.append(entry)
+            if limit and len(res) >= limit > 0:
+                break
+        return res
 
     def _resortResult(self, entities: List[Entity], filters: Dict[str, DATASTORE_BASE_TYPES],
                       orders: List[Tuple[str, 'SortOrder']]) -> List[Entity]:
@@ -482,53 +672,11 @@ class Query(object):
             :param orders: The sort-orders to apply
             :return: The sorted list
         """
-
-        def getVal(src: Entity, fieldVars: Union[str, Tuple[str]], direction: SortOrder) -> Any:
-            # Descent into the target until we reach the property we're looking for
-            if isinstance(fieldVars, tuple):
-                for fv in fieldVars:
-                    if not fv in src:
-                        return None
-                    src = src[fv]
-            else:
-                if not fieldVars in src:
-                    return (str(type(None)), 0)
-                src = src[fieldVars]
-            # Lists are handled differently, here the smallest or largest value determines it's position in the result
-            if isinstance(src, list) and len(src):
-                try:
-                    src.sort()
-                except TypeError:
-                    # It's a list of dicts or the like for which no useful sort-order is specified
-                    pass
-                if direction == SortOrder.Ascending:
-                    src = src[0]
-                else:
-                    src = src[-1]
-            # We must return this tuple because inter-type comparison isn't possible in Python3 anymore
-            return str(type(src)), src if src is not None else 0
-
-        # Check if we have an inequality filter which implies an sortorder
-        ineqFilter = None
-        for k, _ in filters.items():
-            end = k[-2:]
-            if "<" in end or ">" in end:
-                ineqFilter = k.split(" ")[0]
-                break
-        if ineqFilter and (not orders or not orders[0][0] == ineqFilter):
-            orders = [(ineqFilter, SortOrder.Ascending)] + (orders or [])
-
-        for orderField, direction in orders[::-1]:
-            if orderField == KEY_SPECIAL_PROPERTY:
-                pass  # FIXME !!
-            # entities.sort(key=lambda x: x.key, reverse=direction == SortOrder.Descending)
-            else:
-                try:
-                    entities.sort(key=partial(getVal, fieldVars=orderField, direction=direction),
-                                  reverse=direction == SortOrder.Descending)
-                except TypeError:
-                    # We hit some incomparable types
-                    pass
+        try:
+            entities.sort(key=_sortKeyFunc(_ordersWithInequality(filters, orders)))
+        except TypeError:
+            # We hit some incomparable types
+            pass
         return entities
 
     def _fixKind(self, resultList: List[Entity]) -> List[Entity]:
@@ -536,10 +684,20 @@ class Query(object):
             Jump to parentKind if necessary (used in relations)
         """
         resultList = list(resultList)
+        parentKeys = self._parentKeys(resultList)
+        if parentKeys is not None:
+            return list(Get(parentKeys))
+        return resultList
+
+    def _parentKeys(self, resultList: List[Entity]) -> Optional[List[Key]]:
+        """
+            Internal helper for _fixKind, returning the (deduplicated) parents to jump to, or None if the results
+            are of the requested kind already.
+        """
         if resultList and resultList[0].key.kind != self.origKind and resultList[0].key.parent and \
             resultList[0].key.parent.kind == self.origKind:
-            return list(Get(list(dict.fromkeys([x.key.parent for x in resultList]))))
-        return resultList
+            return list(dict.fromkeys([x.key.parent for x in resultList]))
+        return None
 
     def run(self, limit: int = -1) -> List[Entity]:
         """
@@ -578,26 +736,47 @@ class Query(object):
                     res = [x for x in res if any([_entryMatchesQuery(x, y.filters) for y in self.queries])]
         elif isinstance(self.queries, list):
             # We have more than one query to run
-            if self._calculateInternalMultiQueryLimit:
-                limit = self._calculateInternalMultiQueryLimit(self, limit if limit != -1 else self.queries[0].limit)
-            res = []
-            # We run all queries first (preventing multiple round-trips to the server)
-            for singleQuery in self.queries:
-                res.append(self._runSingleFilterQuery(singleQuery, limit if limit != -1 else singleQuery.limit))
-            # Wait for the actual results to arrive and convert the protobuffs to Entries
-            res = [self._fixKind(x) for x in res]
-            if self._customMultiQueryMerge:
-                # We have a custom merge function, use that
-                res = self._customMultiQueryMerge(self, res, limit if limit != -1 else self.queries[0].limit)
-            else:
-                # We must merge (and sort) the results ourself
-                res = self._mergeMultiQueryResults(res)
+            requestedLimit, limit = self._multiQueryLimits(limit)
+            # We send all queries at once, so we'll only have to wait for the slowest one to return
+            res = run_concurrently(
+                self._runSingleFilterQueryAndFixKind,
+                [(singleQuery, limit if limit != -1 else singleQuery.limit) for singleQuery in self.queries],
+                max_workers=1 if IsInTransaction() else conf["max_concurrent_queries"],
+            )
+            res = self._mergeMultiQuery(res, requestedLimit, limit)
         else:  # We have just one single query
             res = self._fixKind(self._runSingleFilterQuery(self.queries, limit if limit != -1 else self.queries.limit))
         if res:
             self._lastEntry = res[-1]
         return res
 
+    def _multiQueryLimits(self, limit: int) -> Tuple[int, int]:
+        """
+            Internal helper for running multi-queries.
+            :param limit: The limit passed to run
+            :return: The number of entities requested and the limit to run each sub-query with (or -1 to use the
+                limits of the sub-queries)
+        """
+        requestedLimit = limit if limit != -1 else self.queries[0].limit
+        if self._calculateInternalMultiQueryLimit:
+            limit = self._calculateInternalMultiQueryLimit(self, limit if limit != -1 else self.queries[0].limit)
+        return requestedLimit, limit
+
+    def _mergeMultiQuery(self, res: List[List[Entity]], requestedLimit: int, limit: int) -> List[Entity]:
+        """
+            Internal helper merging the results of the sub-queries of a multi-query, using the custom merge function
+            if one has been set.
+            :param res: The results of each sub-query
+            :param requestedLimit: The number of entities requested, see _multiQueryLimits
+            :param limit: The limit the sub-queries have been run with, see _multiQueryLimits
+            :return: The merged results
+        """
+        if self._customMultiQueryMerge:
+            # We have a custom merge function, use that
+            return self._customMultiQueryMerge(self, res, limit if limit != -1 else self.queries[0].limit)
+        # We must merge (and sort) the results ourself
+        return self._mergeMultiQueryResults(res, requestedLimit)
+
     def count(self, up_to: int = 2 ** 63 - 1) -> int:
         """
             The count operation cost one entity read for up to 1,000 index entries matched
@@ -655,7 +834,7 @@ class Query(object):
         res.get_orders = lambda: self.get_orders()
         return res
 
-    def iter(self) -> t.Iterator[Entity]:
+    def iter(self, prefetch: bool = False) -> t.Iterator[Entity]:
         """
             Run this query and return an iterator for the results.
 
@@ -663,22 +842,98 @@ class Query(object):
             over a large result-set, as it hasn't have to be pulled in advance
             from the data store.
 
+            Multi-queries are supported as well; the results of their sub-queries are merged while iterating,
+            preserving the sort order and skipping duplicates. As the merged results are sorted by their sort key
+            (which ends with the entity's key), duplicates follow each other and only the previous result has to be
+            remembered. Multi-queries with a custom merge function (see _customMultiQueryMerge) can't be iterated,
+            as it needs all results at once.
+
             This function intentionally ignores a limit set by :func:`server.db.Query.limit`.
 
+            :param prefetch: If set, the next batch is fetched in the background while the current one is
+                consumed, and the batch size doubles with each batch up to conf["iter_max_batch_size"]. At most
+                conf["iter_max_buffered_entities"] entities are held in memory at the same time. Use this for
+                long-running jobs iterating over many entities.
+
             :warning: If iterating over a large result set, make sure the query supports cursors. \
             Otherwise, it might not return all results as the AppEngine doesn't maintain the view \
             for a query for more than ~30 seconds.
         """
         if self.queries is None:  # Noting to pull here
-            raise StopIteration()
-        elif isinstance(self.queries, list):
-            raise ValueError("No iter on Multiqueries")
-        while True:
-            qryRes = self._runSingleFilterQuery(self.queries, 20)
+            return
+        if isinstance(self.queries, list) and self._customMultiQueryMerge:
+            raise ValueError("No iter on Multiqueries with a custom merge function")
+        queries = self.queries if isinstance(self.queries, list) else [self.queries]
+        executor = None
+        if prefetch:
+            executor = ThreadPoolExecutor(max_workers=max(1, min(len(queries), conf["max_concurrent_queries"])))
+        try:
+            maxBuffered = max(1, conf["iter_max_buffered_entities"] // len(queries))
+            streams = [self._iterSingleFilterQuery(query, executor, maxBuffered) for query in queries]
+            if len(streams) == 1:
+                yield from streams[0]
+                return
+            sortKey = _sortKeyFunc(_ordersWithInequality(queries[0].filters, queries[0].orders))
+            # Each entry is decorated with its sort key; the index of its stream breaks ties between duplicates
+            decorated = [((sortKey(entry), idx, entry) for entry in stream) for idx, stream in enumerate(streams)]
+            lastSortKey = None
+            for entrySortKey, _, entry in heapq.merge(*decorated):
+                if entrySortKey == lastSortKey:  # The same entity, returned by another sub-query
+                    continue
+                lastSortKey = entrySortKey
+                yield entry
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def iterKeys(self, prefetch: bool = True) -> t.Iterator[Key]:
+        """
+            Run this query as keys-only query and return an iterator for the keys of its results.
+
+            As only the keys are transferred and decoded, this is the fastest way to collect the keys of large
+            result sets, or to delete them using :func:`viur.datastore.BulkDelete`::
+
+                BulkDelete(Query("kind").filter("expired <", now).iterKeys())
+
+            This query itself is not modified. For multi-queries, each key is yielded once, but the order of the keys
+            is only kept if ordered by key.
+
+            :param prefetch: Fetch the next batch in the background, see :func:`iter`. Enabled by default, as batches
+                of keys are small.
+        """
+        for entity in self.clone().keysOnly().iter(prefetch=prefetch):
+            yield entity.key
+
+    def _iterSingleFilterQuery(self, query: QueryDefinition, executor: Optional[ThreadPoolExecutor],
+                               maxBuffered: int) -> t.Iterator[Entity]:
+        """
+            Internal helper that iterates over all results of a single query definition, batch by batch.
+
+            :param query: The querydefinition to iterate over. Its cursors are advanced while iterating.
+            :param executor: If set, the next batch is fetched on that executor while the current one is consumed,
+                doubling the batch size each time. Otherwise, batches of 20 entities are fetched when needed.
+            :param maxBuffered: Upper bound for the entities of the current and the prefetched batch together
+        """
+        if executor is None:
+            while True:
+                qryRes = self._runSingleFilterQuery(query, 20)
+                yield from qryRes
+                if not query.currentCursor:  # We reached the end of that query
+                    break
+                query.startCursor = query.currentCursor
+            return
+        # The batch being consumed and the one being prefetched must fit into maxBuffered together
+        maxBatchSize = max(1, min(conf["iter_max_batch_size"], maxBuffered // 2))
+        batchSize = min(20, maxBatchSize)
+        future = submit(executor, self._runSingleFilterQuery, query, batchSize)
+        while future is not None:
+            qryRes = future.result()
+            future = None
+            if query.currentCursor:
+                query.startCursor = query.currentCursor
+                batchSize = min(batchSize * 2, maxBatchSize)
+                future = submit(executor, self._runSingleFilterQuery, query, batchSize)
             yield from qryRes
-            if not self.queries.currentCursor:  # We reached the end of that query
-                break
-            self.queries.startCursor = self.queries.currentCursor
 
     def getEntry(self) -> Union[None, Entity]:
         """
@@ -1,28 +1,51 @@
 # distutils: sources = src/viur/datastore/simdjson.cpp
 # distutils: language = c++
 # cython: language_level=3
-from copy import copy
-from viur.datastore import cache
+from viur.datastore import cache, codec
 import google.auth
 import requests
 from libcpp cimport bool as boolean_type
-from viur.datastore.types import currentTransaction, Entity, Key, QueryDefinition, currentDbAccessLog
+from viur.datastore.types import currentTransaction, currentWriteBuffer, Entity, Key, LazyEntity, QueryDefinition, \
+    currentDbAccessLog, projectID
+from viur.datastore.concurrency import iter_concurrently, run_concurrently
 from viur.datastore.config import conf
 from viur.datastore.errors import *
+from viur.datastore.metrics import currentOperation, currentProfile, OperationMetrics
 from cython.operator cimport preincrement, dereference
-from libc.stdint cimport int64_t, uint64_t
-from datetime import datetime, timezone
-from cpython.bytes cimport PyBytes_AsStringAndSize
+from libc.stdint cimport int64_t, uint64_t, uint32_t
+from libc.math cimport INFINITY
+from libc.string cimport memcmp
+from libcpp.string cimport string
+from libcpp.vector cimport vector
+from cpython.datetime cimport import_datetime, datetime_new
+from datetime import datetime, timedelta, timezone
+from cpython.bytes cimport PyBytes_AsStringAndSize, PyBytes_FromStringAndSize
+from cpython.mem cimport PyMem_Free
 import json
+import random
+import threading
+from concurrent.futures import Future
+from functools import wraps
 from base64 import b64decode, b64encode
-from typing import Union, List, Any
-from requests.exceptions import ConnectionError as RequestsConnectionError
+from binascii import b2a_base64
+from typing import Union, List, Any, Dict, Iterable, Callable, Optional, Generator, Tuple
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
 import logging
-from time import sleep
+from time import perf_counter, sleep
 ## Start of CPP-Imports required for the simdjson->python bridge
 
 cdef extern from "Python.h":
     object PyUnicode_FromStringAndSize(const char *u, Py_ssize_t size)
+    int PyDict_SetItem(object p, object key, object val) except -1
+    const char * PyUnicode_AsUTF8AndSize(object unicode, Py_ssize_t * size) except NULL
+    int PyUnicode_KIND(object unicode)
+    void * PyUnicode_DATA(object unicode)
+    Py_ssize_t PyUnicode_GET_LENGTH(object unicode)
+    boolean_type PyUnicode_IS_ASCII(object unicode)
+    uint32_t PyUnicode_READ(int kind, void * data, Py_ssize_t index)
+    char * PyOS_double_to_string(double val, char format_code, int precision, int flags, int * type) except NULL
+    enum: Py_DTSF_ADD_DOT_0
 
 cdef extern from "string_view" namespace "std":
     cppclass stringView "std::string_view":
@@ -30,6 +53,9 @@ cdef extern from "string_view" namespace "std":
         int length()
         int compare(char *)
 
+cdef extern from "simdjson.h" namespace "simdjson":
+    const size_t SIMDJSON_PADDING
+
 cdef extern from "simdjson.h" namespace "simdjson::error_code":
     cdef enum simdjsonErrorCode "simdjson::error_code":
         SUCCESS,
@@ -89,39 +115,374 @@ cdef extern from "simdjson.h" namespace "simdjson::dom":
         simdjsonElement at_key(const char *) except +  # Raises if key not found
         simdjsonResult at_pointer(const char *)  # Same as at_key - sets result error code if key not found
 
+    cdef cppclass simdjsonDocument "simdjson::dom::document":
+        simdjsonDocument()
+        simdjsonElement root()
+
     cdef cppclass simdjsonParser "simdjson::dom::parser":
         simdjsonParser()
+        size_t capacity()
+        simdjsonDocument doc  # The document holding the result of the last parse() call
         simdjsonElement parse(const char * buf, size_t len, boolean_type realloc_if_needed) except +
 
+cdef extern from "<utility>" namespace "std":
+    void swapDocuments "std::swap"(simdjsonDocument & a, simdjsonDocument & b)
+
 ## End of C-Imports
 
 
-credentials, projectID = google.auth.default(scopes=["https://www.googleapis.com/auth/datastore"])
-_http_internal = google.auth.transport.requests.AuthorizedSession(
-    credentials,
-    refresh_timeout=300,
-)
+# The maximum number of keys the datastore accepts in a single lookup request
+LOOKUP_MAX_BATCH_SIZE = 300
+# Initial and maximum delay (in seconds) before deferred keys of a lookup are requested again
+LOOKUP_DEFERRED_BACKOFF = 0.05
+LOOKUP_DEFERRED_MAX_BACKOFF = 2.0
+# How often deferred keys are requested again before giving up (about 11 seconds with the delays above)
+LOOKUP_DEFERRED_MAX_RETRIES = 10
+# The maximum number of mutations the datastore accepts in a single commit
+COMMIT_MAX_MUTATIONS = 500
+# The maximum size (in bytes) of the mutations sent in a single commit. The datastore accepts requests of up to
+# 10 MiB, this leaves room for the rest of the request.
+COMMIT_MAX_BYTES = 9 * 1024 * 1024
+# Upper bound for the (randomly jittered) delay before the first and any further retry of a failed request
+HTTP_RETRY_BACKOFF = 0.1
+HTTP_RETRY_MAX_BACKOFF = 5.0
+# Responses of idempotent requests with these status codes (UNAVAILABLE, DEADLINE_EXCEEDED) are retried
+HTTP_RETRY_STATUS_CODES = {503, 504}
+# The base url of the datastore rest api
+API_ENDPOINT = "https://datastore.googleapis.com/v1"
+
+cdef object _INT64_MIN = -2 ** 63
+cdef object _INT64_MAX = 2 ** 63 - 1
+
+import_datetime()
+cdef object _UTC = timezone.utc
+
+# The session (or backend, see setBackend()) all requests are sent with. Unless set, it's created from the http_*
+# settings in conf on the first request, see resetHttpSession().
+_http_internal = None
+_httpBackend = None  # The backend set with setBackend(), if any
+_httpSessionGeneration = 0  # Incremented whenever the session is replaced, so that viur.datastore.aio follows
+_httpSessionLock = threading.Lock()
+_httpStatsLock = threading.Lock()
+_httpRequests = 0
+_httpRetries = 0
+_httpInFlight = 0
+_httpMaxInFlight = 0
+
+class _Http2Session:
+    """
+        A minimal replacement for the AuthorizedSession, sending requests over HTTP/2 using httpx
+        (see conf["http2"]). It multiplexes all requests to a host over a few connections.
+    """
+
+    def __init__(self, credentials):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError('conf["http2"] requires httpx with HTTP/2 support (pip install "httpx[http2]")') from e
+        self._httpx = httpx
+        self._credentials = credentials
+        self._authRequest = google.auth.transport.requests.Request()
+        self._authLock = threading.Lock()
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=conf["http_pool_maxsize"],
+                max_keepalive_connections=conf["http_pool_maxsize"] if conf["http_keep_alive"] else 0,
+            ),
+        )
+
+    def post(self, url: str, data: bytes, timeout: tuple):
+        """
+            Sends one authenticated POST request. The credentials are refreshed (once) if the request is rejected
+            as unauthenticated. Errors are raised as the corresponding exceptions of requests.
+        """
+        for refreshed in (False, True):
+            headers = {"Content-Type": "application/json"}
+            with self._authLock:
+                if refreshed:
+                    self._credentials.refresh(self._authRequest)
+                self._credentials.before_request(self._authRequest, "POST", url, headers)
+            try:
+                resp = self._client.post(url, content=data, headers=headers,
+                                         timeout=self._httpx.Timeout(timeout[1], connect=timeout[0]))
+            except self._httpx.TimeoutException as e:
+                raise RequestsTimeout(str(e)) from e
+            except self._httpx.TransportError as e:
+                raise RequestsConnectionError(str(e)) from e
+            if resp.status_code != 401:
+                break
+        return resp
+
+    def close(self):
+        self._client.close()
+
+def _apiUrl(method: str) -> str:
+    """
+        Internal helper that returns the url of the given method of the datastore rest api for the current project.
+    """
+    return "%s/projects/%s:%s" % (API_ENDPOINT, projectID, method)
+
+def _createHttpSession():
+    """
+        Internal helper that creates the session used for all requests from the http_* settings in conf.
+    """
+    credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/datastore"])
+    if conf["http2"]:
+        return _Http2Session(credentials)
+    session = google.auth.transport.requests.AuthorizedSession(
+        credentials,
+        refresh_timeout=300,
+    )
+    session.mount("https://", HTTPAdapter(
+        pool_connections=conf["http_pool_connections"],
+        pool_maxsize=conf["http_pool_maxsize"],
+        pool_block=conf["http_pool_block"],
+    ))
+    if not conf["http_keep_alive"]:
+        session.headers["Connection"] = "close"
+    return session
+
+def _getHttpSession():
+    """
+        Internal helper returning the session used for all requests, creating it on the first call.
+    """
+    global _http_internal
+    session = _http_internal
+    if session is None:
+        with _httpSessionLock:
+            if _http_internal is None:
+                _http_internal = _createHttpSession()
+            session = _http_internal
+    return session
+
+def setBackend(backend: Any) -> None:
+    """
+        Replaces the session all requests are sent with, for example by a
+        :class:`viur.datastore.fake.FakeDatastore` to run without network access.
+
+        A backend must provide post(url: str, data: bytes, timeout: tuple) and return an object like
+        requests.Response (with status_code, content, url and json()). The rest api method called is the part of
+        the url after the last colon. Backends can provide an awaitable apost() with the same signature as well,
+        which :mod:`viur.datastore.aio` uses instead of running post() on its thread pool.
+
+        :param backend: The backend to use, or None to go back to a session created from the http_* settings in conf
+    """
+    global _http_internal, _httpBackend, _httpSessionGeneration
+    with _httpSessionLock:
+        _http_internal = _httpBackend = backend
+        _httpSessionGeneration += 1
+
+def resetHttpSession() -> None:
+    """
+        Closes the session used for all requests, so that a new one is created from the http_* settings in conf on
+        the next request. Call this after changing them.
+    """
+    global _http_internal, _httpBackend, _httpSessionGeneration
+    with _httpSessionLock:
+        session, _http_internal, _httpBackend = _http_internal, None, None
+        _httpSessionGeneration += 1
+    if session is not None:
+        session.close()
+
+def httpPoolStats() -> Dict[str, int]:
+    """
+        Returns counters about the requests sent (across all threads) and the connection pool used, so that
+        conf["http_pool_maxsize"] can be sized for the number of workers.
+
+        :return: A dictionary with the number of requests sent and retried, how many are in flight right now and
+            the most that have been in flight at the same time. For the default (HTTP/1.1) session, also the
+            number of connections opened and of idle connections kept in the pool.
+    """
+    with _httpStatsLock:
+        res = {
+            "requests": _httpRequests,
+            "retries": _httpRetries,
+            "in_flight": _httpInFlight,
+            "max_in_flight": _httpMaxInFlight,
+        }
+    session = _http_internal
+    if isinstance(session, requests.Session):
+        poolManager = session.get_adapter(API_ENDPOINT).poolmanager
+        pools = [poolManager.pools[key] for key in poolManager.pools.keys()]
+        res["connections_created"] = sum(pool.num_connections for pool in pools)
+        res["idle_connections"] = sum(1 for pool in pools for conn in list(pool.pool.queue) if conn is not None)
+    return res
+
+def _retryDelay(attempt: int) -> float:
+    """
+        Returns the delay before the given retry: A random value up to an exponentially growing bound, so that
+        clients failing at the same time don't retry at the same time as well.
+    """
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF * 2 ** (attempt - 1), HTTP_RETRY_MAX_BACKOFF))
+
+def _kindOfKeys(keys: Any, *args, **kwargs) -> Optional[str]:
+    """
+        Internal helper returning the kind of the (first) key or entity given, to label the metrics of a call.
+    """
+    if isinstance(keys, list):
+        keys = keys[0] if keys else None
+    if isinstance(keys, Entity):
+        keys = keys.key
+    return keys.kind if isinstance(keys, Key) else None
+
+def _instrumented(operation: str, kindOf: Callable[..., Optional[str]]) -> Callable:
+    """
+        Decorator measuring each call of a public function and reporting it to conf["metrics_sink"] and the
+        currentProfile, if set. While the call runs, its OperationMetrics is set as currentOperation, so that the
+        requests sent (even by other threads, see :mod:`viur.datastore.concurrency`) can add to it.
+
+        :param operation: The name the calls are reported with
+        :param kindOf: Returns the kind to label a call with, given its arguments
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            state = _startOperation(operation, kindOf, args, kwargs)
+            if state is None:
+                return func(*args, **kwargs)
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                _finishOperation(state, error)
+        return wrapper
+    return decorator
+
+def _startOperation(operation: str, kindOf: Callable[..., Optional[str]], args: tuple, kwargs: dict) -> Optional[tuple]:
+    """
+        Internal helper that starts measuring a call (see _instrumented), setting its OperationMetrics as
+        currentOperation. It's used directly by callers that can't be decorated, like the coroutines in
+        :mod:`viur.datastore.aio`.
+
+        :return: The state to pass to _finishOperation, or None if neither a sink nor a profile is set
+    """
+    sink = conf["metrics_sink"]
+    profile = currentProfile.get()
+    if sink is None and profile is None:
+        return None
+    metrics = OperationMetrics(operation, kindOf(*args, **kwargs), currentOperation.get() is not None)
+    return metrics, currentOperation.set(metrics), sink, profile
+
+def _finishOperation(state: tuple, error: Optional[BaseException]) -> None:
+    """
+        Internal helper that finishes measuring a call started by _startOperation and reports it.
+
+        :param state: The state returned by _startOperation
+        :param error: The exception the call failed with, if any
+    """
+    metrics, token, sink, profile = state
+    currentOperation.reset(token)
+    metrics.finish(error)
+    if profile is not None:
+        try:
+            profile.record(metrics)
+        except Exception:
+            logging.exception("Recording metrics in the current profile failed")
+    if sink is not None:
+        try:
+            sink(metrics)
+        except Exception:
+            logging.exception("Reporting metrics to conf[\"metrics_sink\"] failed")
 
-def authenticated_request(url: str, data: bytes) -> requests.Response:
+def authenticated_request(url: str, data: bytes, idempotent: bool = False) -> requests.Response:
     """
         Runs one http request to the datastore rest api, authenticated with the current projects service account.
-        Will retry up to three times in case the connection cannot be established the first time.
+        Will retry up to conf["http_retries"] times (with jittered exponential backoff) in case the connection
+        cannot be established. Idempotent requests are also retried if they time out or the datastore answers
+        with UNAVAILABLE or DEADLINE_EXCEEDED.
 
         :param url: The url to post the data to
         :param data:: The data to include in the post request
+        :param idempotent: Whether the request can safely be sent again, even if it might have been processed
         :return: The Response object
     """
-    for i in range(0, 3):
+    metrics = currentOperation.get()
+    session = _getHttpSession()
+    timeout = (conf["http_connect_timeout"], conf["http_read_timeout"])
+    retries = conf["http_retries"]
+    for attempt in range(0, retries + 1):
+        if attempt:
+            sleep(_retryDelay(attempt))
+        start = _requestStarted(attempt)
         try:
-            return _http_internal.post(
+            resp = session.post(
                 url=url,
                 data=data,
+                timeout=timeout,
             )
         except RequestsConnectionError:
             logging.debug("Retrying http post request to datastore")
-            if i == 2:
+            if attempt == retries:
+                raise
+            continue
+        except RequestsTimeout:
+            if not idempotent or attempt == retries:
                 raise
+            logging.debug("Retrying timed out http post request to datastore")
+            continue
+        finally:
+            _requestFinished(metrics, url, data, start, attempt)
+        if metrics is not None:
+            metrics.add(response_bytes=len(resp.content))
+        if idempotent and resp.status_code in HTTP_RETRY_STATUS_CODES and attempt < retries:
+            logging.debug(f"Retrying http post request to datastore after status {resp.status_code}")
             continue
+        return resp
+
+def _requestStarted(attempt: int) -> float:
+    """
+        Internal helper counting a request that's about to be sent (see httpPoolStats()). It's shared with the
+        requests sent by :mod:`viur.datastore.aio`.
+
+        :param attempt: How often this request has been sent before
+        :return: The time the request has been started at
+    """
+    global _httpRequests, _httpRetries, _httpInFlight, _httpMaxInFlight
+    with _httpStatsLock:
+        _httpRequests += 1
+        _httpRetries += 1 if attempt else 0
+        _httpInFlight += 1
+        _httpMaxInFlight = max(_httpMaxInFlight, _httpInFlight)
+    return perf_counter()
+
+def _requestFinished(metrics: Optional[OperationMetrics], url: str, data: bytes, start: float, attempt: int) -> None:
+    """
+        Internal helper counting a request started by _requestStarted as finished (whether it succeeded or not)
+        and adding it to the metrics of the current call, if any.
+    """
+    global _httpInFlight
+    with _httpStatsLock:
+        _httpInFlight -= 1
+    if metrics is not None:
+        metrics.addRequest(url.rsplit(":", 1)[1], network_time=perf_counter() - start,
+                           retries=1 if attempt else 0, request_bytes=len(data))
+
+# The requests of each batch (a lookup, a query, a commit, ...) are sent by generators called steps: They yield
+# (method, data, idempotent) for each request, receive its response in return and yield a delay (in seconds)
+# whenever they have to wait. As they don't send anything themselves, the same steps are driven with blocking
+# requests by _drive() and by the event loop in viur.datastore.aio.
+
+def _drive(steps: Generator) -> Any:
+    """
+        Internal helper running the given steps, sending their requests with authenticated_request.
+
+        :return: The value returned by the steps
+    """
+    try:
+        step = next(steps)
+        while True:
+            if isinstance(step, tuple):
+                method, data, idempotent = step
+                step = steps.send(authenticated_request(_apiUrl(method), data, idempotent))
+            else:
+                sleep(step)
+                step = steps.send(None)
+    except StopIteration as e:
+        return e.value
 
 def keyToPath(key: Key) -> List[dict]:
     """
@@ -236,6 +597,649 @@ def pythonPropToJson(v) -> dict:
         }
     assert False, "%s (%s) is not supported" % (v, type(v))
 
+## Direct JSON encoder
+#
+# Writes the request bodies for the rest API without building the intermediate dictionaries returned by
+# pythonPropToJson/keyToPath. The output is byte-for-byte identical to json.dumps() of these dictionaries
+# (including its default separators and ensure_ascii escaping), so pythonPropToJson remains the reference
+# implementation.
+
+cdef const char * _HEX_DIGITS = "0123456789abcdef"
+
+cdef class _JsonBuffer:
+    """
+        A growable byte buffer, reused by all requests encoded in the same thread.
+    """
+    cdef string data
+    cdef boolean_type inUse
+
+cdef object _jsonBufferLocal = threading.local()
+
+cdef _JsonBuffer _acquireJsonBuffer():
+    """
+        Returns the (empty) buffer of the current thread, or a temporary one if that is already in use.
+    """
+    cdef _JsonBuffer buffer = getattr(_jsonBufferLocal, "buffer", None)
+    if buffer is None:
+        buffer = _JsonBuffer()
+        _jsonBufferLocal.buffer = buffer
+    elif buffer.inUse:
+        buffer = _JsonBuffer()
+    buffer.inUse = True
+    buffer.data.clear()
+    return buffer
+
+cdef bytes _releaseJsonBuffer(_JsonBuffer buffer):
+    """
+        Returns the contents of the buffer as bytes and marks it as available again.
+    """
+    cdef string empty
+    res = PyBytes_FromStringAndSize(buffer.data.data(), buffer.data.size())
+    buffer.inUse = False
+    if buffer.data.capacity() > conf["max_retained_buffer_size"]:
+        buffer.data.swap(empty)
+    return res
+
+cdef inline void _writeUnicodeEscape(string & out, uint32_t c):
+    out.append(b"\\u")
+    out.push_back(_HEX_DIGITS[(c >> 12) & 0xF])
+    out.push_back(_HEX_DIGITS[(c >> 8) & 0xF])
+    out.push_back(_HEX_DIGITS[(c >> 4) & 0xF])
+    out.push_back(_HEX_DIGITS[c & 0xF])
+
+cdef void _writeJsonStr(string & out, str value) except *:
+    """
+        Writes value as a quoted json string, escaped like json.encoder.encode_basestring_ascii does.
+    """
+    cdef int kind = PyUnicode_KIND(value)
+    cdef void * data = PyUnicode_DATA(value)
+    cdef Py_ssize_t length = PyUnicode_GET_LENGTH(value)
+    cdef Py_ssize_t idx, start = 0
+    cdef uint32_t c
+    out.push_back(b'"')
+    if PyUnicode_IS_ASCII(value):
+        # Copy runs of characters that don't need to be escaped at once
+        for idx in range(length):
+            c = (<const unsigned char *> data)[idx]
+            if c < 0x20 or c == 0x22 or c == 0x5C or c == 0x7F:
+                out.append(<const char *> data + start, idx - start)
+                start = idx + 1
+                _writeEscapedChar(out, c)
+        out.append(<const char *> data + start, length - start)
+    else:
+        for idx in range(length):
+            c = PyUnicode_READ(kind, data, idx)
+            if 0x20 <= c < 0x7F and c != 0x22 and c != 0x5C:
+                out.push_back(<char> c)
+            else:
+                _writeEscapedChar(out, c)
+    out.push_back(b'"')
+
+cdef void _writeEscapedChar(string & out, uint32_t c):
+    if c == 0x22:
+        out.append(b'\\"')
+    elif c == 0x5C:
+        out.append(b"\\\\")
+    elif c == 0x0A:
+        out.append(b"\\n")
+    elif c == 0x0D:
+        out.append(b"\\r")
+    elif c == 0x09:
+        out.append(b"\\t")
+    elif c == 0x08:
+        out.append(b"\\b")
+    elif c == 0x0C:
+        out.append(b"\\f")
+    elif c > 0xFFFF:  # Encoded as surrogate pair
+        c -= 0x10000
+        _writeUnicodeEscape(out, 0xD800 | ((c >> 10) & 0x3FF))
+        _writeUnicodeEscape(out, 0xDC00 | (c & 0x3FF))
+    else:
+        _writeUnicodeEscape(out, c)
+
+cdef inline void _writeAscii(string & out, str value) except *:
+    cdef Py_ssize_t size
+    cdef const char * data = PyUnicode_AsUTF8AndSize(value, &size)
+    out.append(data, size)
+
+cdef void _writeJsonInt(string & out, object value) except *:
+    """
+        Writes an integer as json number (or as the digits of a json string in case of integerValues)
+    """
+    cdef char digits[24]
+    cdef int pos = 24
+    cdef int64_t signedValue
+    cdef uint64_t absValue
+    if type(value) is int and _INT64_MIN <= value <= _INT64_MAX:
+        signedValue = value
+        absValue = <uint64_t> (-(signedValue + 1)) + 1 if signedValue < 0 else <uint64_t> signedValue
+        while True:
+            pos -= 1
+            digits[pos] = <char> (48 + absValue % 10)
+            absValue //= 10
+            if absValue == 0:
+                break
+        if signedValue < 0:
+            pos -= 1
+            digits[pos] = b"-"
+        out.append(digits + pos, 24 - pos)
+    else:
+        _writeAscii(out, int.__repr__(value))
+
+cdef void _writeJsonFloat(string & out, double value) except *:
+    cdef char * reprStr
+    if value != value:
+        out.append(b"NaN")
+    elif value == INFINITY:
+        out.append(b"Infinity")
+    elif value == -INFINITY:
+        out.append(b"-Infinity")
+    else:
+        reprStr = PyOS_double_to_string(value, b"r", 0, Py_DTSF_ADD_DOT_0, NULL)
+        try:
+            out.append(reprStr)
+        finally:
+            PyMem_Free(reprStr)
+
+cdef void _writeJson(string & out, object value) except *:
+    """
+        Writes a plain python structure (dicts, lists, strings, numbers, booleans and None) as json.dumps would.
+    """
+    if isinstance(value, str):
+        _writeJsonStr(out, value)
+    elif value is None:
+        out.append(b"null")
+    elif value is True:
+        out.append(b"true")
+    elif value is False:
+        out.append(b"false")
+    elif isinstance(value, int):
+        _writeJsonInt(out, value)
+    elif isinstance(value, float):
+        _writeJsonFloat(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.push_back(b"[")
+        for idx, item in enumerate(value):
+            if idx:
+                out.append(b", ")
+            _writeJson(out, item)
+        out.push_back(b"]")
+    elif isinstance(value, dict):
+        out.push_back(b"{")
+        for idx, (dictKey, dictValue) in enumerate(value.items()):
+            if idx:
+                out.append(b", ")
+            _writeJsonKey(out, dictKey)
+            out.append(b": ")
+            _writeJson(out, dictValue)
+        out.push_back(b"}")
+    else:
+        raise TypeError(f"Object of type {value.__class__.__name__} is not JSON serializable")
+
+cdef void _writeJsonKey(string & out, object value) except *:
+    """
+        Writes the key of a json object. Like json.dumps, we accept a few other types besides strings.
+    """
+    if isinstance(value, str):
+        _writeJsonStr(out, value)
+        return
+    out.push_back(b'"')
+    if value is True:
+        out.append(b"true")
+    elif value is False:
+        out.append(b"false")
+    elif value is None:
+        out.append(b"null")
+    elif isinstance(value, int):
+        _writeJsonInt(out, value)
+    elif isinstance(value, float):
+        _writeJsonFloat(out, value)
+    else:
+        raise TypeError(f"keys must be str, int, float, bool or None, not {value.__class__.__name__}")
+    out.push_back(b'"')
+
+cdef void _writeKey(string & out, object key) except *:
+    """
+        Writes the json representation of a Key (the content of its keyValue).
+    """
+    path = []
+    while key:
+        path.append(key)
+        key = key.parent
+    out.append(b'{"partitionId": {"project_id": ')
+    _writeJsonStr(out, projectID)
+    out.append(b'}, "path": [')
+    for idx in range(len(path) - 1, -1, -1):
+        key = path[idx]
+        out.append(b'{"kind": ')
+        _writeJson(out, key.kind)
+        if key.id:
+            out.append(b', "id": ')
+            _writeJson(out, key.id)
+        elif key.name:
+            out.append(b', "name": ')
+            _writeJson(out, key.name)
+        out.push_back(b"}")
+        if idx:
+            out.append(b", ")
+    out.append(b"]}")
+
+cdef void _writeEntity(string & out, object entity) except *:
+    """
+        Writes the json representation of an Entity (the content of its entityValue).
+    """
+    excludedProperties = set(entity.exclude_from_indexes)
+    out.append(b'{"key": ')
+    if entity.key:
+        _writeKey(out, entity.key)
+    else:
+        out.append(b"null")
+    out.append(b', "properties": {')
+    for idx, (dictKey, dictValue) in enumerate(entity.items()):
+        if idx:
+            out.append(b", ")
+        _writeJsonKey(out, dictKey)
+        out.append(b": ")
+        if isinstance(dictValue, list) and dictKey in excludedProperties:
+            # Lists cannot be not indexed (but each of its value can be). So we have to forward our not-indexed
+            # flag to our children. See https://github.com/googleapis/google-cloud-node/issues/2615.
+            out.append(b'{"arrayValue": {"values": [')
+            for listIdx, value in enumerate(dictValue):
+                if listIdx:
+                    out.append(b", ")
+                _writeValue(out, value, True)
+            out.append(b"]}}")
+        else:
+            _writeValue(out, dictValue, dictKey in excludedProperties)
+    out.append(b"}}")
+
+cdef void _writeValue(string & out, object v, boolean_type excludeFromIndexes) except *:
+    """
+        Writes the json representation of pythonPropToJson(v), optionally flagged with excludeFromIndexes.
+    """
+    cdef char * data
+    cdef Py_ssize_t size
+    if v is True or v is False:
+        out.append(b'{"booleanValue": true' if v else b'{"booleanValue": false')
+    elif v is None:
+        out.append(b'{"nullValue": null')
+    elif isinstance(v, int):
+        out.append(b'{"integerValue": ')
+        if type(v) is int:
+            out.push_back(b'"')
+            _writeJsonInt(out, v)
+            out.push_back(b'"')
+        else:
+            _writeJsonStr(out, str(v))
+    elif isinstance(v, float):
+        out.append(b'{"doubleValue": ')
+        _writeJsonFloat(out, v)
+    elif isinstance(v, str):
+        out.append(b'{"stringValue": ')
+        _writeJsonStr(out, v)
+    elif isinstance(v, Key):
+        out.append(b'{"keyValue": ')
+        _writeKey(out, v)
+    elif isinstance(v, datetime):
+        out.append(b'{"timestampValue": ')
+        _writeJsonStr(out, v.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+    elif isinstance(v, Entity):
+        out.append(b'{"entityValue": ')
+        _writeEntity(out, v)
+    elif isinstance(v, dict):
+        # We hande dicts separately as they don't have keys nor can keys be excluded from being indexed
+        out.append(b'{"entityValue": {"key": null, "properties": {')
+        for idx, (dictKey, dictValue) in enumerate(v.items()):
+            if idx:
+                out.append(b", ")
+            _writeJsonKey(out, dictKey)
+            out.append(b": ")
+            _writeValue(out, dictValue, False)
+        out.append(b"}}")
+    elif isinstance(v, list):
+        out.append(b'{"arrayValue": {"values": [')
+        for idx, value in enumerate(v):
+            if idx:
+                out.append(b", ")
+            _writeValue(out, value, False)
+        out.append(b"]}")
+    elif isinstance(v, bytes):
+        out.append(b'{"blobValue": "')
+        PyBytes_AsStringAndSize(b2a_base64(v, newline=False), &data, &size)
+        out.append(data, size)
+        out.push_back(b'"')
+    else:
+        assert False, "%s (%s) is not supported" % (v, type(v))
+    if excludeFromIndexes:
+        out.append(b', "excludeFromIndexes": true')
+    out.push_back(b"}")
+
+cdef void _writeFilter(string & out, dict filters) except *:
+    """
+        Writes the filter of a query for the given filters of a QueryDefinition.
+    """
+    filterList = []
+    for k, v in filters.items():
+        key, op = k.split(" ")
+        if op == "=":
+            op = "EQUAL"
+        elif op == "<":
+            op = "LESS_THAN"
+        elif op == "<=":
+            op = "LESS_THAN_OR_EQUAL"
+        elif op == ">":
+            op = "GREATER_THAN"
+        elif op == ">=":
+            op = "GREATER_THAN_OR_EQUAL"
+        else:
+            raise ValueError("Invalid op %s" % op)
+        if not isinstance(v, list):
+            # An entity can have a list of values for a single property, so it's possible to enforce
+            # more an one constraint for a a single property (e.g. x==5 and x==7 can be true), so
+            # enforce we always have a list here
+            v = [v]
+        for singleValue in v:
+            filterList.append((key, op, singleValue))
+    if len(filterList) != 1:
+        out.append(b'{"compositeFilter": {"op": "AND", "filters": [')
+    for idx, (key, op, singleValue) in enumerate(filterList):
+        if idx:
+            out.append(b", ")
+        out.append(b'{"propertyFilter": {"property": {"name": ')
+        _writeJson(out, key)
+        out.append(b'}, "op": ')
+        _writeJsonStr(out, op)
+        out.append(b', "value": ')
+        _writeValue(out, singleValue, False)
+        out.append(b"}}")
+    if len(filterList) != 1:
+        out.append(b"]}}")
+
+def encodeValue(v) -> bytes:
+    """
+        Returns the json encoded representation of a python value as expected by the rest API.
+        Same as json.dumps(pythonPropToJson(v)).encode("UTF-8").
+
+        :param v: The python object to convert
+        :return: The json representation of that object
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        _writeValue(buffer.data, v, False)
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeUpsertMutation(entity: Entity) -> bytes:
+    """
+        Returns the json encoded upsert mutation for the given entity, to be passed to :func:`encodeCommitRequest`.
+
+        :param entity: The entity to write. Must not be partial (returned by a projection query).
+        :return: The json representation of that mutation
+    """
+    cdef _JsonBuffer buffer
+    if entity.projection is not None:
+        raise PartialEntityError("%s has been returned by a projection query and cannot be written" % entity.key)
+    buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"upsert": ')
+        _writeEntity(buffer.data, entity)
+        buffer.data.push_back(b"}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeDeleteMutation(key: Key) -> bytes:
+    """
+        Returns the json encoded delete mutation for the given key, to be passed to :func:`encodeCommitRequest`.
+
+        :param key: The key of the entity to delete
+        :return: The json representation of that mutation
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"delete": ')
+        _writeKey(buffer.data, key)
+        buffer.data.push_back(b"}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeCommitRequest(mode: str, mutations: List[bytes], transaction: str = None) -> bytes:
+    """
+        Returns the body of a commit request.
+
+        :param mode: Either "TRANSACTIONAL" or "NON_TRANSACTIONAL"
+        :param mutations: The encoded mutations as returned by :func:`encodeUpsertMutation` and
+            :func:`encodeDeleteMutation`
+        :param transaction: The transaction to commit (if mode is "TRANSACTIONAL")
+        :return: The json encoded request
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"mode": ')
+        _writeJsonStr(buffer.data, mode)
+        if transaction is not None:
+            buffer.data.append(b', "transaction": ')
+            _writeJsonStr(buffer.data, transaction)
+        buffer.data.append(b', "mutations": [')
+        for idx, mutation in enumerate(mutations):
+            if idx:
+                buffer.data.append(b", ")
+            buffer.data.append(<const char *> mutation, len(mutation))
+        buffer.data.append(b"]}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeLookupRequest(keys: List[Key], readOptions: dict) -> bytes:
+    """
+        Returns the body of a lookup request for the given keys.
+
+        :param keys: The keys to fetch
+        :param readOptions: The readOptions to send along with the lookup
+        :return: The json encoded request
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"readOptions": ')
+        _writeJson(buffer.data, readOptions)
+        buffer.data.append(b', "keys": [')
+        for idx, key in enumerate(keys):
+            if idx:
+                buffer.data.append(b", ")
+            _writeKey(buffer.data, key)
+        buffer.data.append(b"]}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeAllocateIdsRequest(keys: List[Key]) -> bytes:
+    """
+        Returns the body of an allocateIds request for the given (partial) keys.
+
+        :param keys: The keys to allocate ids for
+        :return: The json encoded request
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"keys": [')
+        for idx, key in enumerate(keys):
+            if idx:
+                buffer.data.append(b", ")
+            _writeKey(buffer.data, key)
+        buffer.data.append(b"]}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeRunQueryRequest(queryDefinition: QueryDefinition, limit: int, readOptions: dict,
+                          startCursor: str = None) -> bytes:
+    """
+        Returns the body of a runQuery request for the given query.
+
+        :param queryDefinition: The query to run
+        :param limit: How many entities to return at maximum
+        :param readOptions: The readOptions to send along with the query
+        :param startCursor: The cursor to start from (if not given, the startCursor of the queryDefinition is used)
+        :return: The json encoded request
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    startCursor = startCursor or queryDefinition.startCursor
+    try:
+        buffer.data.append(b'{"partitionId": {"project_id": ')
+        _writeJsonStr(buffer.data, projectID)
+        buffer.data.append(b'}, "readOptions": ')
+        _writeJson(buffer.data, readOptions)
+        buffer.data.append(b', "query": {"kind": [{"name": ')
+        _writeJson(buffer.data, queryDefinition.kind)
+        buffer.data.append(b'}], "limit": ')
+        _writeJson(buffer.data, limit)
+        if queryDefinition.filters:
+            buffer.data.append(b', "filter": ')
+            _writeFilter(buffer.data, queryDefinition.filters)
+        if queryDefinition.orders:
+            buffer.data.append(b', "order": [')
+            for idx, sortOrder in enumerate(queryDefinition.orders):
+                if idx:
+                    buffer.data.append(b", ")
+                buffer.data.append(b'{"property": {"name": ')
+                _writeJson(buffer.data, sortOrder[0])
+                buffer.data.append(b'}, "direction": "ASCENDING"}' if sortOrder[1].value in [1, 4]
+                                   else b'}, "direction": "DESCENDING"}')
+            buffer.data.push_back(b"]")
+        if queryDefinition.distinct:
+            buffer.data.append(b', "distinctOn": [')
+            for idx, distinctKey in enumerate(queryDefinition.distinct):
+                if idx:
+                    buffer.data.append(b", ")
+                buffer.data.append(b'{"name": ')
+                _writeJson(buffer.data, distinctKey)
+                buffer.data.push_back(b"}")
+            buffer.data.push_back(b"]")
+        if queryDefinition.projection:
+            buffer.data.append(b', "projection": [')
+            for idx, projectedKey in enumerate(queryDefinition.projection):
+                if idx:
+                    buffer.data.append(b", ")
+                buffer.data.append(b'{"property": {"name": ')
+                _writeJson(buffer.data, projectedKey)
+                buffer.data.append(b"}}")
+            buffer.data.push_back(b"]")
+        if startCursor:
+            buffer.data.append(b', "startCursor": ')
+            _writeJson(buffer.data, startCursor)
+        if queryDefinition.endCursor:
+            buffer.data.append(b', "endCursor": ')
+            _writeJson(buffer.data, queryDefinition.endCursor)
+        buffer.data.append(b"}}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+def encodeCountRequest(kind: str, up_to: int, queryDefinition: QueryDefinition = None) -> bytes:
+    """
+        Returns the body of a runAggregationQuery request counting the entities of kind matching queryDefinition.
+
+        :param kind: The kind to count
+        :param up_to: The maximum number of entities to count
+        :param queryDefinition: The query whose filters are applied (optional)
+        :return: The json encoded request
+    """
+    cdef _JsonBuffer buffer = _acquireJsonBuffer()
+    try:
+        buffer.data.append(b'{"partitionId": {"project_id": ')
+        _writeJsonStr(buffer.data, projectID)
+        buffer.data.append(b'}, "aggregation_query": {"aggregations": {"count": {"up_to": ')
+        _writeJson(buffer.data, up_to)
+        buffer.data.append(b'}}, "nested_query": {"kind": [{"name": ')
+        _writeJson(buffer.data, kind)
+        buffer.data.append(b"}]")
+        if queryDefinition and queryDefinition.filters:
+            buffer.data.append(b', "filter": ')
+            _writeFilter(buffer.data, queryDefinition.filters)
+        buffer.data.append(b"}}}")
+    finally:
+        res = _releaseJsonBuffer(buffer)
+    return res
+
+## Parser pool
+#
+# Creating a simdjson parser for each response means allocating (and growing) its internal buffers each time,
+# and parsing an unpadded buffer means another allocation to copy it. Instead, each thread keeps its parsers
+# (together with a padded input buffer) for the next response.
+
+cdef Py_ssize_t _parsersCreated = 0
+cdef Py_ssize_t _parsersReused = 0
+cdef Py_ssize_t _parsersReleased = 0
+cdef Py_ssize_t _parserBytesAllocated = 0
+
+cdef class _ParserSlot:
+    """
+        A simdjson parser and the padded buffer holding the data it parses. The elements returned by parse()
+        are only valid until this slot parses the next response.
+    """
+    cdef simdjsonParser parser
+    cdef string input
+
+    cdef simdjsonElement parse(self, bytes data) except *:
+        global _parserBytesAllocated
+        cdef char * data_ptr
+        cdef Py_ssize_t pysize
+        cdef size_t oldCapacity = self.parser.capacity() + self.input.capacity()
+        cdef simdjsonElement element
+        assert PyBytes_AsStringAndSize(data, &data_ptr, &pysize) != -1
+        self.input.assign(data_ptr, pysize)
+        self.input.resize(pysize + SIMDJSON_PADDING)
+        element = self.parser.parse(self.input.data(), pysize, False)
+        if self.parser.capacity() + self.input.capacity() > oldCapacity:
+            _parserBytesAllocated += self.parser.capacity() + self.input.capacity() - oldCapacity
+        return element
+
+cdef object _parserLocal = threading.local()
+
+cdef _ParserSlot _acquireParser():
+    """
+        Returns a parser that's not in use by the current thread, reusing a previously released one if possible.
+    """
+    global _parsersCreated, _parsersReused
+    freeSlots = getattr(_parserLocal, "freeSlots", None)
+    if freeSlots:
+        _parsersReused += 1
+        return freeSlots.pop()
+    _parsersCreated += 1
+    return _ParserSlot()
+
+cdef void _releaseParser(_ParserSlot slot) except *:
+    """
+        Hands a parser acquired by _acquireParser back to the pool of the current thread. Elements parsed by
+        that parser must not be used afterwards.
+        Parsers that are not released (because the request raised an exception) are simply garbage collected.
+    """
+    global _parsersReleased
+    if slot.parser.capacity() + slot.input.capacity() > conf["max_retained_buffer_size"]:
+        _parsersReleased += 1
+        return
+    freeSlots = getattr(_parserLocal, "freeSlots", None)
+    if freeSlots is None:
+        freeSlots = _parserLocal.freeSlots = []
+    freeSlots.append(slot)
+
+def parserPoolStats() -> Dict[str, int]:
+    """
+        Returns counters about the reuse of parsers (across all threads).
+
+        :return: A dictionary with the number of parsers created and reused, how many have been released
+            because they grew larger than conf["max_retained_buffer_size"], and the total capacity (in bytes)
+            parsers and their input buffers had to allocate.
+    """
+    return {
+        "created": _parsersCreated,
+        "reused": _parsersReused,
+        "released": _parsersReleased,
+        "allocated_capacity": _parserBytesAllocated,
+    }
+
 cdef inline object toPyStr(stringView strView):
     """
         Converts a cpp stringview to a python str object
@@ -247,6 +1251,98 @@ cdef inline object toPyStr(stringView strView):
         strView.length()
     )
 
+cdef inline int _readDigits(const char * data, Py_ssize_t pos, int count):
+    """
+        Reads count decimal digits starting at data[pos]. Returns -1 if any of them is not a digit.
+    """
+    cdef int res = 0, idx
+    for idx in range(count):
+        if not b"0" <= data[pos + idx] <= b"9":
+            return -1
+        res = res * 10 + (data[pos + idx] - 48)
+    return res
+
+cdef object _parseTimestamp(const char * data, Py_ssize_t length):
+    """
+        Parses a RFC 3339 timestamp (like 2023-05-15T12:30:15.123456Z) as returned by the datastore.
+        Fractional seconds of any length (truncated to microseconds) and offsets other than "Z" are supported.
+
+        :return: The corresponding datetime in UTC
+    """
+    cdef int year, month, day, hour, minute, second, microsecond = 0, fractionDigits = 0
+    cdef int offset = 0, offsetHours, offsetMinutes
+    cdef Py_ssize_t pos = 19
+    if (length < 20 or data[4] != b"-" or data[7] != b"-" or not (data[10] == b"T" or data[10] == b"t"
+                                                                  or data[10] == b" ")
+            or data[13] != b":" or data[16] != b":"):
+        raise ValueError("Invalid timestamp %r" % data[:length])
+    year = _readDigits(data, 0, 4)
+    month = _readDigits(data, 5, 2)
+    day = _readDigits(data, 8, 2)
+    hour = _readDigits(data, 11, 2)
+    minute = _readDigits(data, 14, 2)
+    second = _readDigits(data, 17, 2)
+    if data[pos] == b".":
+        pos += 1
+        while pos < length and b"0" <= data[pos] <= b"9":
+            if fractionDigits < 6:
+                microsecond = microsecond * 10 + (data[pos] - 48)
+            fractionDigits += 1
+            pos += 1
+        if not fractionDigits:
+            raise ValueError("Invalid timestamp %r" % data[:length])
+        while fractionDigits < 6:
+            microsecond *= 10
+            fractionDigits += 1
+    if pos == length - 1 and (data[pos] == b"Z" or data[pos] == b"z"):
+        pass
+    elif pos == length - 6 and (data[pos] == b"+" or data[pos] == b"-") and data[pos + 3] == b":":
+        offsetHours = _readDigits(data, pos + 1, 2)
+        offsetMinutes = _readDigits(data, pos + 4, 2)
+        if offsetHours < 0 or offsetMinutes < 0:
+            raise ValueError("Invalid timestamp %r" % data[:length])
+        offset = offsetHours * 60 + offsetMinutes
+        if data[pos] == b"-":
+            offset = -offset
+    else:
+        raise ValueError("Invalid timestamp %r" % data[:length])
+    if year < 0 or month < 0 or day < 0 or hour < 0 or minute < 0 or second < 0:
+        raise ValueError("Invalid timestamp %r" % data[:length])
+    res = datetime_new(year, month, day, hour, minute, second, microsecond, _UTC)
+    if offset:
+        res -= timedelta(minutes=offset)
+    return res
+
+def parseTimestamp(value: str) -> datetime:
+    """
+        Parses a RFC 3339 timestamp (like 2023-05-15T12:30:15.123456Z), as used by the rest API.
+
+        :param value: The timestamp to parse
+        :return: The corresponding datetime in UTC
+    """
+    cdef Py_ssize_t size
+    cdef const char * data = PyUnicode_AsUTF8AndSize(value, &size)
+    return _parseTimestamp(data, size)
+
+cdef inline object _parseInteger(stringView strView):
+    """
+        Parses the decimal representation of an integer (as used for integerValues and ids).
+    """
+    cdef const char * data = strView.data()
+    cdef Py_ssize_t length = strView.length(), pos = 0
+    cdef int64_t res = 0
+    cdef boolean_type negative = length > 0 and data[0] == b"-"
+    if negative:
+        pos = 1
+    if length - pos < 1 or length - pos > 18:  # Empty or might not fit in 64 bits
+        return int(toPyStr(strView))
+    while pos < length:
+        if not b"0" <= data[pos] <= b"9":
+            return int(toPyStr(strView))  # Let python raise the appropriate error
+        res = res * 10 + (data[pos] - 48)
+        pos += 1
+    return -res if negative else res
+
 cdef inline object parseKey(simdjsonElement v):
     """
         Parses a simdJsonObject representing a key to a datastore.Key instance.
@@ -256,141 +1352,335 @@ cdef inline object parseKey(simdjsonElement v):
     """
     cdef simdjsonArray arr
     cdef simdjsonArray.iterator arrayIt, arrayItEnd
-    pathArgs = []
+    cdef simdjsonObject pathElement
+    cdef simdjsonObject.iterator objIter, objIterEnd
+    cdef stringView strView
+    key = None
     arr = v.at_key("path").get_array()
     arrayIt = arr.begin()
     arrayItEnd = arr.end()
     while arrayIt != arrayItEnd:
-        element = dereference(arrayIt)
-        if element.at_pointer("/id").error() == SUCCESS:
-            pathArgs.append(
-                (toPyStr(element.at_key("kind").get_string()), int(toPyStr(element.at_key("id").get_string())))
-            )
-        elif element.at_pointer("/name").error() == SUCCESS:
-            pathArgs.append(
-                (toPyStr(element.at_key("kind").get_string()), toPyStr(element.at_key("name").get_string()))
-            )
+        kind = keyId = keyName = None
+        pathElement = dereference(arrayIt).get_object()
+        objIter = pathElement.begin()
+        objIterEnd = pathElement.end()
+        while objIter != objIterEnd:
+            strView = objIter.key()
+            if strView.compare("kind") == 0:
+                kind = toPyStr(objIter.value().get_string())
+            elif strView.compare("id") == 0:
+                if objIter.value().type() == STRING:
+                    keyId = _parseInteger(objIter.value().get_string())
+                else:  # As written by keyToPath
+                    keyId = objIter.value().get_int64()
+            elif strView.compare("name") == 0:
+                keyName = toPyStr(objIter.value().get_string())
+            preincrement(objIter)
+        if keyId is not None:
+            key = Key(kind, keyId, parent=key)
+        elif keyName is not None:
+            key = Key(kind, keyName, parent=key)
         else:
             # We read an incomplete/null key from the datastore. This is likely a bug.
             # Can happen if you manually created a key like datastore.Key("kind", 0).
             logging.error("We read an incomplete/null key from the datastore. This is likely a bug!")
-            pathArgs.append((toPyStr(element.at_key("kind").get_string()), 0))
+            key = Key(kind, 0, parent=key)
         preincrement(arrayIt)
-    key = None
-    for pathElem in pathArgs:
-        key = Key(*pathElem, parent=key)
     return key
 
-cdef inline object toEntityStructure(simdjsonElement v, boolean_type isInitial = False):
+cdef class _PropertyNames:
     """
-        Parses a simdJsonElement into the corresponding python datatypes.
-        :param v: The simdJsonElement to parse
-        :param isInitial: If true, we'll return a dictionary of key->entity instead of a list of entities
-        :return: The corresponding python datatype.
+        Interns the property names of the entities decoded from one response, so that entities share their
+        name strings. As the properties of entities of the same kind usually appear in the same order, the name
+        last seen at the same position is tried first, which avoids creating a new string in most cases.
+        Names of embedded entities are handled by a separate instance (see nested()), as they have
+        different positions.
+    """
+    cdef list slots
+    cdef dict interned
+    cdef _PropertyNames nestedNames
+
+    def __cinit__(self):
+        self.slots = []
+        self.interned = {}
+
+    cdef inline str get(self, Py_ssize_t position, stringView name):
+        cdef Py_ssize_t size
+        cdef const char * data
+        cdef str res
+        if position < len(self.slots):
+            res = <str> self.slots[position]
+            data = PyUnicode_AsUTF8AndSize(res, &size)
+            if size == name.length() and memcmp(data, name.data(), size) == 0:
+                return res
+        res = toPyStr(name)
+        res = self.interned.setdefault(res, res)
+        if position < len(self.slots):
+            self.slots[position] = res
+        elif position == len(self.slots):
+            self.slots.append(res)
+        return res
+
+    cdef inline _PropertyNames nested(self):
+        if self.nestedNames is None:
+            self.nestedNames = _PropertyNames()
+        return self.nestedNames
 
-        TODO: While working for now, this should probably refactored to return the parsed value and it's index flag
-            to avoid additional loops over objects.
+cdef object _decodeEntity(simdjsonElement v, _PropertyNames names):
     """
-    cdef simdjsonElementType et = v.type()
+        Parses the representation of an entity (key and properties) into an Entity.
+
+        :param v: The simdJsonElement containing the entity
+        :param names: The cache of property names to use
+        :return: The corresponding Entity
+    """
+    cdef simdjsonObject outerObject, properties
+    cdef simdjsonObject.iterator objIter, objIterEnd, propIter, propIterEnd
+    cdef stringView strView
+    cdef boolean_type excluded
+    cdef Py_ssize_t position
+    e = Entity()
+    excludeList = set()
+    outerObject = v.get_object()
+    objIter = outerObject.begin()
+    objIterEnd = outerObject.end()
+    while objIter != objIterEnd:
+        strView = objIter.key()
+        if strView.compare("key") == 0:
+            if objIter.value().type() != NULL_VALUE:
+                e.key = parseKey(objIter.value())
+        elif strView.compare("properties") == 0:
+            properties = objIter.value().get_object()
+            propIter = properties.begin()
+            propIterEnd = properties.end()
+            position = 0
+            while propIter != propIterEnd:
+                name = names.get(position, propIter.key())
+                PyDict_SetItem(e, name, _decodeValue(propIter.value(), &excluded, names))
+                if excluded:
+                    excludeList.add(name)
+                position += 1
+                preincrement(propIter)
+        preincrement(objIter)
+    e.exclude_from_indexes = excludeList
+    return e
+
+cdef object _decodeValue(simdjsonElement v, boolean_type * excluded, _PropertyNames names):
+    """
+        Parses a value object (see https://cloud.google.com/datastore/docs/reference/data/rest/v1/projects/runQuery#Value)
+        into the corresponding python datatype, visiting each of its nodes once.
+
+        :param v: The simdJsonElement containing the value
+        :param excluded: Set to whether this value is excluded from indexing. Lists cannot be not indexed (but each of
+            its value can be), so a list counts as excluded if all of its values are.
+        :param names: The cache of property names to use for embedded entities
+        :return: The corresponding python value
+    """
+    cdef simdjsonObject valueObject = v.get_object()
+    cdef simdjsonObject.iterator objIter = valueObject.begin(), objIterEnd = valueObject.end()
+    cdef simdjsonArray arr
     cdef simdjsonArray.iterator arrayIt, arrayItEnd
-    cdef simdjsonObject.iterator objIterStart, objIterStartInner, objIterEnd, objIterEndInner
-    cdef simdjsonElement element
-    cdef simdjsonObject outerObject, innerObject
-    cdef stringView strView, bytesView
     cdef simdjsonResult tmpResult
-    if et == OBJECT:
-        outerObject = v.get_object()
-        objIterStart = outerObject.begin()
-        objIterEnd = outerObject.end()
-        while objIterStart != objIterEnd:
-            strView = objIterStart.key()
-            if strView.compare("entity") == 0 or strView.compare("entityValue") == 0:
-                e = Entity()
-                excludeList = set()
-                tmpResult = objIterStart.value().at_pointer("/key")
-                if tmpResult.error() == SUCCESS:
-                    e.key = parseKey(tmpResult.value())
-                tmpResult = objIterStart.value().at_pointer("/properties")
-                if tmpResult.error() == SUCCESS:
-                    innerObject = tmpResult.value().get_object()
-                    objIterStartInner = innerObject.begin()
-                    objIterEndInner = innerObject.end()
-                    while objIterStartInner != objIterEndInner:
-                        e[toPyStr(objIterStartInner.key())] = toEntityStructure(objIterStartInner.value())
-                        if objIterStartInner.value().at_pointer("/arrayValue/values").error() == SUCCESS:
-                            # We have to collect the non-indexed flag from the children of lists
-                            arr = objIterStartInner.value().at_pointer("/arrayValue/values").value().get_array()
-                            arrayIt = arr.begin()
-                            arrayItEnd = arr.end()
-                            allExcluded = True
-                            while arrayIt != arrayItEnd:
-                                element = dereference(arrayIt)
-                                tmpResult = element.at_pointer("/excludeFromIndexes")
-                                if tmpResult.error() != SUCCESS or not tmpResult.value().get_bool():
-                                    allExcluded = False
-                                    break
-                                preincrement(arrayIt)
-                            if allExcluded:
-                                excludeList.add(toPyStr(objIterStartInner.key()))
-                        else:
-                            # For *all* other datatypes, we can simply check the dict it's defined in
-                            tmpResult = objIterStartInner.value().at_pointer("/excludeFromIndexes")
-                            if tmpResult.error() == SUCCESS and tmpResult.value().get_bool():
-                                excludeList.add(toPyStr(objIterStartInner.key()))
-                        preincrement(objIterStartInner)
-                e.exclude_from_indexes = excludeList
-                return e
-            elif (strView.compare("nullValue") == 0):
-                return None
-            elif (strView.compare("stringValue") == 0):
-                return toPyStr(objIterStart.value().get_string())
-            elif (strView.compare("doubleValue") == 0):
-                return objIterStart.value().get_double()
-            elif (strView.compare("integerValue") == 0):
-                return int(toPyStr(objIterStart.value().get_string()))
-            elif (strView.compare("arrayValue") == 0):
-                tmpResult = objIterStart.value().at_pointer("/values")
-                if tmpResult.error() == SUCCESS:
-                    return toEntityStructure(tmpResult.value())
-                else:
-                    return []
-            elif (strView.compare("booleanValue") == 0):
-                return objIterStart.value().get_bool()
-            elif (strView.compare("timestampValue") == 0):
-                dateStr = toPyStr(objIterStart.value().get_string())[:-1]  # Strip "Z" at the end
-                if "." in dateStr:  # With milli-seconds
-                    return datetime.strptime(dateStr, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
-                else:
-                    return datetime.strptime(dateStr, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
-            elif (strView.compare("blobValue") == 0):
-                return b64decode(toPyStr(objIterStart.value().get_string()))
-            elif (strView.compare("keyValue") == 0):
-                return parseKey(objIterStart.value())
-            elif (strView.compare("geoPointValue") == 0):
-                return objIterStart.value().at_key("latitude").get_double(), \
-                    objIterStart.value().at_key("longitude").get_double()
-            elif (strView.compare("excludeFromIndexes") == 0 or strView.compare("version") == 0):
-                pass
-            else:
-                raise ValueError("Invalid key in entity json: %s" % toPyStr(strView))
-    elif et == ARRAY:
-        arr = v.get_array()
-        arrayIt = arr.begin()
-        arrayItEnd = arr.end()
-        if isInitial:
-            res = {}
-        else:
+    cdef stringView strView
+    cdef boolean_type hasValues = False, allExcluded = True, childExcluded
+    excluded[0] = False
+    res = None
+    while objIter != objIterEnd:
+        strView = objIter.key()
+        if strView.compare("stringValue") == 0:
+            res = toPyStr(objIter.value().get_string())
+        elif strView.compare("integerValue") == 0:
+            res = _parseInteger(objIter.value().get_string())
+        elif strView.compare("timestampValue") == 0:
+            strView = objIter.value().get_string()
+            res = _parseTimestamp(strView.data(), strView.length())
+        elif strView.compare("booleanValue") == 0:
+            res = objIter.value().get_bool()
+        elif strView.compare("doubleValue") == 0:
+            res = objIter.value().get_double()
+        elif strView.compare("nullValue") == 0:
+            res = None
+        elif strView.compare("excludeFromIndexes") == 0:
+            excluded[0] = objIter.value().get_bool()
+        elif strView.compare("arrayValue") == 0:
             res = []
-        while arrayIt != arrayItEnd:
-            element = dereference(arrayIt)
-            entity = toEntityStructure(element)
-            if isInitial:
-                res[entity.key] = entity
-            else:
-                res.append(entity)
-            preincrement(arrayIt)
+            tmpResult = objIter.value().at_pointer("/values")
+            if tmpResult.error() == SUCCESS:
+                hasValues = True
+                arr = tmpResult.value().get_array()
+                arrayIt = arr.begin()
+                arrayItEnd = arr.end()
+                while arrayIt != arrayItEnd:
+                    res.append(_decodeValue(dereference(arrayIt), &childExcluded, names))
+                    allExcluded = allExcluded and childExcluded
+                    preincrement(arrayIt)
+        elif strView.compare("entityValue") == 0:
+            res = _decodeEntity(objIter.value(), names.nested())
+        elif strView.compare("keyValue") == 0:
+            res = parseKey(objIter.value())
+        elif strView.compare("blobValue") == 0:
+            res = b64decode(toPyStr(objIter.value().get_string()))
+        elif strView.compare("geoPointValue") == 0:
+            res = objIter.value().at_key("latitude").get_double(), objIter.value().at_key("longitude").get_double()
+        elif strView.compare("meaning") != 0 and strView.compare("version") != 0:
+            raise ValueError("Invalid key in entity json: %s" % toPyStr(strView))
+        preincrement(objIter)
+    if hasValues:
+        excluded[0] = allExcluded
+    return res
+
+cdef inline object toEntityStructure(simdjsonElement v, boolean_type isInitial = False):
+    """
+        Parses a list of entity results (as returned by lookups and queries) into Entities.
+        :param v: The simdJsonElement containing the list of entity results
+        :param isInitial: If true, we'll return a dictionary of key->entity instead of a list of entities
+        :return: The list (or dictionary) of Entities
+    """
+    cdef simdjsonArray arr = v.get_array()
+    cdef simdjsonArray.iterator arrayIt = arr.begin(), arrayItEnd = arr.end()
+    cdef simdjsonObject entityResult
+    cdef simdjsonObject.iterator objIter, objIterEnd
+    cdef _PropertyNames names = _PropertyNames()
+    if isInitial:
+        res = {}
+    else:
+        res = []
+    while arrayIt != arrayItEnd:
+        entityResult = dereference(arrayIt).get_object()
+        objIter = entityResult.begin()
+        objIterEnd = entityResult.end()
+        while objIter != objIterEnd:
+            if objIter.key().compare("entity") == 0:
+                entity = _decodeEntity(objIter.value(), names)
+                if isInitial:
+                    res[entity.key] = entity
+                else:
+                    res.append(entity)
+            preincrement(objIter)
+        preincrement(arrayIt)
+    return res
+
+## Lazy entities
+#
+# Queries with QueryDefinition.lazy set don't decode their results. Instead, the parsed document (the simdjson tape
+# and its strings, but not the parser's internal buffers or the response) is taken out of the parser and each
+# LazyEntity decodes single properties from it when they're accessed.
+
+cdef class _LazyDocument:
+    """
+        A parsed response, taken out of the parser that parsed it. It's kept alive by the entities referencing it.
+    """
+    cdef simdjsonDocument doc
+    cdef _PropertyNames names
+
+    def __cinit__(self):
+        self.names = _PropertyNames()
+
+    @staticmethod
+    cdef _LazyDocument take(_ParserSlot parser):
+        """
+            Takes the document produced by the last parse() call of the given parser. The parser will allocate a
+            new document when it parses the next response.
+        """
+        cdef _LazyDocument res = _LazyDocument()
+        swapDocuments(parser.parser.doc, res.doc)
         return res
 
+cdef class _LazyProperties:
+    """
+        The source of one LazyEntity: The values of the properties of that entity inside a _LazyDocument, in the
+        order of the response, and a dictionary mapping each property name to its position in that order.
+    """
+    cdef _LazyDocument document
+    cdef vector[simdjsonElement] values
+    cdef readonly dict names
+
+    def decode(self, str name) -> tuple:
+        """
+            Decodes a single property.
+
+            :param name: The name of the property
+            :return: The python value of that property and whether it's excluded from indexing
+        """
+        cdef Py_ssize_t position = self.names[name]
+        cdef boolean_type excluded
+        value = _decodeValue(self.values[position], &excluded, self.document.names)
+        return value, excluded
+
+cdef list _toLazyEntities(simdjsonElement v, _LazyDocument document):
+    """
+        Like toEntityStructure, but returns LazyEntities that decode their properties from document on first access.
+        Only the keys, the property names and the positions of their values are read upfront. Entities sharing the
+        same property names (in the same order) share the dictionary mapping these names to their positions, too.
+
+        :param v: The simdJsonElement containing the list of entity results. Must belong to document.
+        :param document: The document the entities should decode their properties from
+        :return: The list of LazyEntities
+    """
+    cdef simdjsonArray arr = v.get_array()
+    cdef simdjsonArray.iterator arrayIt = arr.begin(), arrayItEnd = arr.end()
+    cdef simdjsonObject outerObject, properties
+    cdef simdjsonObject.iterator objIter, objIterEnd, propIter, propIterEnd
+    cdef simdjsonResult tmpResult
+    cdef stringView strView
+    cdef _LazyProperties source
+    cdef Py_ssize_t position
+    cdef tuple layout = None
+    cdef dict layoutNames = None
+    res = []
+    while arrayIt != arrayItEnd:
+        tmpResult = dereference(arrayIt).at_pointer("/entity")
+        if tmpResult.error() == SUCCESS:
+            key = None
+            source = None
+            outerObject = tmpResult.value().get_object()
+            objIter = outerObject.begin()
+            objIterEnd = outerObject.end()
+            while objIter != objIterEnd:
+                strView = objIter.key()
+                if strView.compare("key") == 0:
+                    if objIter.value().type() != NULL_VALUE:
+                        key = parseKey(objIter.value())
+                elif strView.compare("properties") == 0:
+                    properties = objIter.value().get_object()
+                    propIter = properties.begin()
+                    propIterEnd = properties.end()
+                    source = _LazyProperties()
+                    names = []
+                    position = 0
+                    while propIter != propIterEnd:
+                        names.append(document.names.get(position, propIter.key()))
+                        source.values.push_back(propIter.value())
+                        position += 1
+                        preincrement(propIter)
+                    if names:
+                        names = tuple(names)
+                        if names != layout:
+                            layout = names
+                            layoutNames = {name: position for position, name in enumerate(names)}
+                        source.document = document
+                        source.names = layoutNames
+                    else:
+                        source = None
+                preincrement(objIter)
+            res.append(LazyEntity(key, source))
+        preincrement(arrayIt)
+    return res
+
+def decodeValue(data: bytes) -> Any:
+    """
+        Parses the json representation of a value as used by the rest API (like {"stringValue": "abc"}).
+        The counterpart of encodeValue.
+
+        :param data: The json encoded value
+        :return: The corresponding python object
+    """
+    cdef _ParserSlot parser = _acquireParser()
+    cdef boolean_type excluded
+    res = _decodeValue(parser.parse(data), &excluded, _PropertyNames())
+    _releaseParser(parser)
+    return res
+
 cdef inline object toPythonStructure(simdjsonElement v):
     # Convert json (sub-)tree to python objects
     cdef simdjsonElementType et = v.type()
@@ -434,6 +1724,13 @@ cdef inline object toPythonStructure(simdjsonElement v):
     else:
         raise ValueError("Unknown type")
 
+def _kindOfQuery(queryDefinition: QueryDefinition, *args, **kwargs) -> Optional[str]:
+    """
+        Internal helper returning the kind of the query given, to label the metrics of a call.
+    """
+    return queryDefinition.kind
+
+@_instrumented("runSingleFilter", _kindOfQuery)
 def runSingleFilter(queryDefinition: QueryDefinition, limit: int) -> List[Entity]:
     """
         Runs a single Query as defined by queryDefinition. The limit of the queryDefinition is ignored and must
@@ -443,10 +1740,13 @@ def runSingleFilter(queryDefinition: QueryDefinition, limit: int) -> List[Entity
         :param limit:  How many entities to return at maximum
         :return: The list of entities fetched from the datastore
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element
+    return _drive(_runQuerySteps(queryDefinition, limit))
+
+def _runQuerySteps(queryDefinition: QueryDefinition, limit: int) -> Generator:
+    """
+        The steps of runSingleFilter: Fetches the batches of the query until limit entities have been received
+        or the query is finished.
+    """
     res = []
     internalStartCursor = None  # Will be set if we need to fetch more than one batch
     flipResults = False  # If set, we'll reverse the list returned (Sortorder was Inverted*)
@@ -455,106 +1755,32 @@ def runSingleFilter(queryDefinition: QueryDefinition, limit: int) -> List[Entity
         readOptions = {"transaction": currentTxn["key"]}
     else:
         readOptions = {"readConsistency": "STRONG"}
+    if queryDefinition.orders:
+        flipResults = queryDefinition.orders[0][1].value > 2  # Either InvertedAscending or InvertedDescending
+    metrics = currentOperation.get()
+    if metrics is not None:
+        metrics.query = queryDefinition
     while True:  # We might need to fetch more than one batch
-        postData = {
-            "partitionId": {
-                "project_id": projectID,
-            },
-            "readOptions": readOptions,
-            "query": {
-                "kind": [
-                    {
-                        "name": queryDefinition.kind,
-                    }
-                ],
-                "limit": limit - len(res)
-            },
-        }
-        if queryDefinition.filters:
-            filterList = []
-            for k, v in queryDefinition.filters.items():
-                key, op = k.split(" ")
-                if op == "=":
-                    op = "EQUAL"
-                elif op == "<":
-                    op = "LESS_THAN"
-                elif op == "<=":
-                    op = "LESS_THAN_OR_EQUAL"
-                elif op == ">":
-                    op = "GREATER_THAN"
-                elif op == ">=":
-                    op = "GREATER_THAN_OR_EQUAL"
-                else:
-                    raise ValueError("Invalid op %s" % op)
-                if not isinstance(v, list):
-                    # An entity can have a list of values for a single property, so it's possible to enforce
-                    # more an one constraint for a a single property (e.g. x==5 and x==7 can be true), so
-                    # enforce we always have a list here
-                    v = [v]
-                for singleValue in v:
-                    filterList.append({
-                        "propertyFilter": {
-                            "property": {
-                                "name": key,
-                            },
-                            "op": op,
-                            "value": pythonPropToJson(singleValue)
-                        }
-                    })
-            if len(filterList) == 1:  # Special, single filter
-                postData["query"]["filter"] = filterList[0]
-            else:
-                postData["query"]["filter"] = {
-                    "compositeFilter": {
-                        "op": "AND",
-                        "filters": filterList
-                    }
-                }
-        if queryDefinition.orders:
-            postData["query"]["order"] = [
-                {
-                    "property": {"name": sortOrder[0]},
-                    "direction": "ASCENDING" if sortOrder[1].value in [1, 4] else "DESCENDING"
-                } for sortOrder in queryDefinition.orders
-            ]
-            flipResults = queryDefinition.orders[0][1].value > 2  # Either InvertedAscending or InvertedDescending
-        if queryDefinition.distinct:
-            postData["query"]["distinctOn"] = [
-                {
-                    "name": distinctKey
-                } for distinctKey in queryDefinition.distinct
-            ]
-        if queryDefinition.startCursor or internalStartCursor:
-            postData["query"]["startCursor"] = internalStartCursor or queryDefinition.startCursor
-        if queryDefinition.endCursor:
-            postData["query"]["endCursor"] = queryDefinition.endCursor
-        resp = authenticated_request(
-            url="https://datastore.googleapis.com/v1/projects/%s:runQuery" % projectID,
-            data=json.dumps(postData).encode("UTF-8"),
-        )
-
-        is_viur_datastore_request_ok(resp)
-        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-        element = parser.parse(data_ptr, pysize, 1)
-        if element.at_pointer("/batch").error() != SUCCESS:
-            logging.error("INVALID RESPONSE RECEIVED")
-            logging.error(json.loads(resp.content))
-        #	res.update(toEntityStructure(element.at_key("batch"), isInitial=True))
-        element = element.at_key("batch")
-        if element.at_pointer("/entityResults").error() == SUCCESS:
-            res.extend(toEntityStructure(element.at_key("entityResults"), isInitial=False))
+        start = perf_counter()
+        data = encodeRunQueryRequest(queryDefinition, limit - len(res), readOptions, internalStartCursor)
+        if metrics is not None:
+            metrics.add(encode_time=perf_counter() - start)
+        resp = yield "runQuery", data, True
+        batch, moreResults, endCursor = _decodeQueryBatch(resp, queryDefinition, metrics)
+        if batch is not None:
+            res.extend(batch)
         else:  # No results received
-            if toPyStr(element.at_key("moreResults").get_string()) == "NOT_FINISHED":
+            if moreResults == "NOT_FINISHED":
                 logging.warning("Query not finished. Maybe some entries are missing.")
                 logging.warning("Queried %s with filter %s and orders %s. - Please create a matching index" % (
                     queryDefinition.kind, queryDefinition.filters, queryDefinition.orders))
             else:
                 break
-        if toPyStr(element.at_key("moreResults").get_string()) == "NO_MORE_RESULTS":
+        if moreResults == "NO_MORE_RESULTS":
             internalStartCursor = None
         else:
-            internalStartCursor = toPyStr(element.at_key("endCursor").get_string())
-        if toPyStr(element.at_key("moreResults").get_string()) != "NOT_FINISHED" or len(res) == limit:
+            internalStartCursor = endCursor
+        if moreResults != "NOT_FINISHED" or len(res) == limit:
             break
     queryDefinition.currentCursor = internalStartCursor
     if conf["traceQueries"]:
@@ -567,20 +1793,269 @@ def runSingleFilter(queryDefinition: QueryDefinition, limit: int) -> List[Entity
         return res[::-1]
     return res
 
+cdef tuple _decodeQueryBatch(object resp, object queryDefinition, object metrics):
+    """
+        Internal helper decoding one batch of a query.
+
+        :return: The entities of this batch (or None if there are none), its moreResults and endCursor
+    """
+    cdef _ParserSlot parser
+    cdef _LazyDocument document = None
+    cdef simdjsonElement element
+    is_viur_datastore_request_ok(resp)
+    start = perf_counter()
+    parser = _acquireParser()
+    element = parser.parse(resp.content)
+    if queryDefinition.lazy:
+        # The entities keep referencing this document, so it must not be overwritten by the next response
+        document = _LazyDocument.take(parser)
+        element = document.doc.root()
+    if element.at_pointer("/batch").error() != SUCCESS:
+        logging.error("INVALID RESPONSE RECEIVED")
+        logging.error(json.loads(resp.content))
+    element = element.at_key("batch")
+    batch = None
+    if element.at_pointer("/entityResults").error() == SUCCESS:
+        if document is not None:
+            batch = _toLazyEntities(element.at_key("entityResults"), document)
+        else:
+            batch = toEntityStructure(element.at_key("entityResults"), isInitial=False)
+        if queryDefinition.projection:
+            projection = tuple(queryDefinition.projection)
+            for entity in batch:
+                entity.projection = projection
+        if metrics is not None:
+            metrics.add(decode_time=perf_counter() - start, entities=len(batch))
+    moreResults = toPyStr(element.at_key("moreResults").get_string())
+    endCursor = None
+    if element.at_pointer("/endCursor").error() == SUCCESS:
+        endCursor = toPyStr(element.at_key("endCursor").get_string())
+    _releaseParser(parser)
+    return batch, moreResults, endCursor
+
+def _lookupBatch(keys: List[Key], readOptions: dict) -> Dict[Key, Entity]:
+    """
+        Internal helper that fetches one batch of (at most 300) keys from the datastore.
+        Keys the datastore deferred are requested again (with exponential backoff) until all of them have been
+        answered, at most LOOKUP_DEFERRED_MAX_RETRIES times.
+
+        :param keys: The keys to fetch
+        :param readOptions: The readOptions to send along with the lookup
+        :return: A dictionary of key -> entity for all keys that have been found
+        :raises: :exc:`DeadlineExceededError` if keys are still deferred after all retries
+    """
+    return _drive(_lookupSteps(keys, readOptions))
+
+def _lookupSteps(keys: List[Key], readOptions: dict) -> Generator:
+    """
+        The steps of _lookupBatch.
+    """
+    res = {}
+    retry = 0
+    metrics = currentOperation.get()
+    while keys:
+        start = perf_counter()
+        data = encodeLookupRequest(keys, readOptions)
+        if metrics is not None:
+            metrics.add(encode_time=perf_counter() - start)
+        resp = yield "lookup", data, True
+        found, keys = _decodeLookupResponse(resp, metrics)
+        res.update(found)
+        if keys:
+            if retry == LOOKUP_DEFERRED_MAX_RETRIES:
+                raise DeadlineExceededError("%s keys are still deferred after %s retries" % (len(keys), retry))
+            yield min(LOOKUP_DEFERRED_BACKOFF * 2 ** retry, LOOKUP_DEFERRED_MAX_BACKOFF)
+            retry += 1
+    return res
+
+cdef tuple _decodeLookupResponse(object resp, object metrics):
+    """
+        Internal helper decoding the response to a lookup.
+
+        :return: A dictionary of key -> entity for all keys found and the list of keys deferred
+    """
+    cdef _ParserSlot parser
+    cdef simdjsonElement element
+    cdef simdjsonArray arrayElem
+    cdef simdjsonArray.iterator arrayIt
+    is_viur_datastore_request_ok(resp)
+    start = perf_counter()
+    parser = _acquireParser()
+    element = parser.parse(resp.content)
+    found = {}
+    if element.at_pointer("/found").error() == SUCCESS:
+        found = toEntityStructure(element.at_key("found"), isInitial=True)
+    deferred = []
+    if element.at_pointer("/deferred").error() == SUCCESS:
+        arrayElem = element.at_key("deferred").get_array()
+        arrayIt = arrayElem.begin()
+        while arrayIt != arrayElem.end():
+            deferred.append(parseKey(dereference(arrayIt)))
+            preincrement(arrayIt)
+    _releaseParser(parser)
+    if metrics is not None:
+        metrics.add(decode_time=perf_counter() - start, entities=len(found))
+    return found, deferred
+
+def _fetchKeys(keys: List[Key], readOptions: dict, max_workers: int) -> Dict[Key, Entity]:
+    """
+        Internal helper that fetches the given keys in batches of 300, with up to max_workers batches in flight.
+
+        :param keys: The keys to fetch (without duplicates)
+        :param readOptions: The readOptions to send along with the lookups
+        :param max_workers: How many lookups to run at the same time
+        :return: A dictionary of key -> entity for all keys that have been found
+    """
+    res = {}
+    batches = [keys[idx:idx + LOOKUP_MAX_BATCH_SIZE] for idx in range(0, len(keys), LOOKUP_MAX_BATCH_SIZE)]
+    for batch_res in run_concurrently(_lookupBatch, [(batch, readOptions) for batch in batches], max_workers):
+        res.update(batch_res)
+    return res
+
+class _LookupCoalescer:
+    """
+        Single-flight for lookups outside of transactions (see conf["coalesce_lookups"]): Keys that are already
+        being fetched for another thread aren't requested again; their result is shared instead. If
+        conf["coalesce_lookups_window"] is set, lookups of less than 300 keys wait that long for other lookups to
+        be combined with.
+
+        Each entity is returned as the object fetched to the thread that requested its key first, all other threads
+        receive their own copy. These copies are decoded from the entity as encoded before any thread got its
+        result, so they're unaffected by changes the first thread makes to its entity.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inFlight = {}  # Key -> Future resolving to (its Entity or None, the encoded Entity for other threads)
+        self._shared = set()  # Keys in _inFlight other threads are waiting for as well
+        self._queued = []  # Keys waiting for the current window to end
+        self._collecting = False  # Whether a thread is waiting for the current window to end
+
+    def lookup(self, keys: List[Key], readOptions: dict) -> Dict[Key, Entity]:
+        """
+            Fetches the given keys, joining lookups already in flight.
+
+            :param keys: The keys to fetch (without duplicates)
+            :param readOptions: The readOptions to send along with the lookups
+            :return: A dictionary of key -> entity for all keys that have been found
+        """
+        window = conf["coalesce_lookups_window"]
+        futures = {}
+        ownKeys = set()
+        toFetch = []
+        isCollector = False
+        with self._lock:
+            for key in keys:
+                future = self._inFlight.get(key)
+                if future is None:
+                    future = self._inFlight[key] = Future()
+                    ownKeys.add(key)
+                    toFetch.append(key)
+                else:
+                    self._shared.add(key)
+                futures[key] = future
+            if toFetch and window > 0 and len(toFetch) < LOOKUP_MAX_BATCH_SIZE:
+                self._queued.extend(toFetch)
+                toFetch = []
+                if not self._collecting:
+                    self._collecting = isCollector = True
+        if isCollector:
+            try:
+                sleep(window)
+            except BaseException:
+                # Other threads are waiting for the keys queued, so they must be fetched nevertheless
+                self._fetch(self._takeQueued(), readOptions)
+                raise
+            toFetch = self._takeQueued()
+        if toFetch:
+            self._fetch(toFetch, readOptions)
+        res = {}
+        for key, future in futures.items():
+            entity, encoded = future.result()
+            if entity is not None:
+                res[key] = entity if key in ownKeys else codec.decode(encoded)
+        return res
+
+    def _takeQueued(self) -> List[Key]:
+        """
+            Ends the current window, returning the keys queued during it.
+        """
+        with self._lock:
+            res = self._queued
+            self._queued = []
+            self._collecting = False
+        return res
+
+    def _fetch(self, keys: List[Key], readOptions: dict) -> None:
+        """
+            Fetches the given keys and resolves their futures. Must be called for all keys taken from _queued or
+            registered in _inFlight.
+        """
+        futures = None
+        try:
+            res = _fetchKeys(keys, readOptions, conf["max_concurrent_lookups"])
+            with self._lock:
+                futures = [self._inFlight.pop(key) for key in keys]
+                shared = [key in self._shared for key in keys]
+                self._shared.difference_update(keys)
+            results = []
+            for key, isShared in zip(keys, shared):
+                entity = res.get(key)
+                results.append((entity, codec.encode(entity) if isShared and entity is not None else None))
+        except BaseException as e:
+            if futures is None:
+                with self._lock:
+                    futures = [self._inFlight.pop(key) for key in keys]
+                    self._shared.difference_update(keys)
+            for future in futures:
+                future.set_exception(e)
+            raise
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+_lookupCoalescer = _LookupCoalescer()
+
+@_instrumented("Get", _kindOfKeys)
 def Get(keys: Union[Key, List[Key]]) -> Union[None, Entity, List[Entity]]:
     """
         Fetches the entities determined by keys from the datastore. Returns or inserts None if a key is not found.
+        Keys not served from the cache are fetched in batches of 300, of which up to
+        conf["max_concurrent_lookups"] are requested at the same time. If conf["coalesce_lookups"] is set, keys
+        another thread is already fetching (outside of transactions) are not requested again.
+        Keys that haven't been found are cached as missing for a short time (see cache.MEMCACHE_NEGATIVE_TIMEOUT).
+        Inside transactions, keys that have already been read, written or deleted in this transaction are served
+        from its entity map (see :func:`RunInTransaction`).
+
         :param keys: A Key or a List of Keys to fetch
         :return: The entity or None for the given key, a list of Entities/None if a list has been supplied
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element
     isMulti = True
     if isinstance(keys, Key):
         keys = [keys]
         isMulti = False
+    res, missing_keys, readOptions = _startGet(keys)
+    if missing_keys:
+        fetchStart = perf_counter()
+        currentTxn = currentTransaction.get()
+        if conf["coalesce_lookups"] and not currentTxn:
+            res_from_db = _lookupCoalescer.lookup(missing_keys, readOptions)
+        else:
+            res_from_db = _fetchKeys(missing_keys, readOptions, 1 if currentTxn else conf["max_concurrent_lookups"])
+        _finishGet(missing_keys, res_from_db, perf_counter() - fetchStart, res)
+    if not isMulti:
+        return res.get(keys[0])
+    else:
+        return [res.get(key) for key in keys]  # Sort by order of incoming keys
+
+def _startGet(keys: List[Key]) -> Tuple[Dict[Key, Optional[Entity]], List[Key], dict]:
+    """
+        Internal helper running the first part of Get: Validates the keys and serves them from the current
+        transaction's entity map and the cache, as far as possible.
+
+        :param keys: The keys requested
+        :return: The entities (or None for keys known to be missing) found so far, the keys that have to be fetched
+            from the datastore and the readOptions to fetch them with
+    """
     if any(key.is_partial or key.kind is None for key in keys):
         raise InvalidArgumentError("Keys must not be partial or kind-less")
     accessLog = currentDbAccessLog.get()
@@ -588,84 +2063,103 @@ def Get(keys: Union[Key, List[Key]]) -> Union[None, Entity, List[Entity]]:
         accessLog.update(set(keys))
 
     currentTxn = currentTransaction.get()
+    res_from_txn = {}
     if currentTxn:
         readOptions = {"transaction": currentTxn["key"]}
+        txnEntities = currentTxn["entities"]
+        # Each call gets its own copy, just as if it had been read from the datastore
+        res_from_txn = {key: (codec.decode(txnEntities[key]) if txnEntities[key] is not None else None)
+                        for key in dict.fromkeys(keys) if key in txnEntities}
     else:
         readOptions = {"readConsistency": "STRONG"}
-    res = {}
     res_from_cache = {}
-    res_from_db = {}
-    untouched_keys = copy(keys)
-    while keys:
-        keys_for_request = keys[:300]
-
-        if conf["memcache_client"] is not None:
-            res_from_cache = cache.get(keys_for_request)
-            # Convert the keys back to "class" representation
-            res_from_cache = {Key.from_legacy_urlsafe(key): value
-                              for key, value in res_from_cache.items()}
-
-        missing_keys = [key for key in keys_for_request if key not in res_from_cache.keys()]
-        if not missing_keys:
-            # We had all keys in the memcache we can fetch the next batch now.
-            keys = keys[300:]
-            continue
-        requested_keys = [
-            {
-                "partitionId": {
-                    "project_id": projectID,
-                },
-                "path": keyToPath(x)
-            }
-            for x in missing_keys]
-        postData = {
-            "readOptions": readOptions,
-            "keys": requested_keys,
-        }
-        resp = authenticated_request(
-            url="https://datastore.googleapis.com/v1/projects/%s:lookup" % projectID,
-            data=json.dumps(postData).encode("UTF-8"),
-        )
+    if conf["memcache_client"] is not None and len(res_from_txn) < len(keys):
+        cache_keys = {key.cache_key: key for key in keys if key not in res_from_txn}
+        # Map the results back to the keys requested. Keys cached as missing are mapped to None.
+        res_from_cache = {cache_keys[cache_key]: value
+                          for cache_key, value in cache.get(list(cache_keys), include_missing=True).items()}
+        metrics = currentOperation.get()
+        if metrics is not None:
+            metrics.add(cache_hits=len(res_from_cache), cache_misses=len(cache_keys) - len(res_from_cache))
+        if currentTxn:
+            for key, value in res_from_cache.items():
+                txnEntities[key] = codec.encode(value) if value is not None else None
+    missing_keys = [key for key in dict.fromkeys(keys) if key not in res_from_cache and key not in res_from_txn]
+    return res_from_cache | res_from_txn, missing_keys, readOptions
+
+def _finishGet(missing_keys: List[Key], res_from_db: Dict[Key, Entity], fetchTime: float,
+               res: Dict[Key, Optional[Entity]]) -> None:
+    """
+        Internal helper running the last part of Get: Caches the entities fetched from the datastore (and the keys
+        that haven't been found), adds them to the current transaction's entity map and to res.
 
-        if is_viur_datastore_request_ok(resp):
-            assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-            element = parser.parse(data_ptr, pysize, 1)
-            if (element.at_pointer("/found").error() == SUCCESS):
-                res_from_db.update(toEntityStructure(element.at_key("found"), isInitial=True))
+        :param missing_keys: The keys that have been fetched
+        :param res_from_db: The entities found
+        :param fetchTime: How long fetching them took
+        :param res: The entities found so far, as returned by _startGet
+    """
+    if conf["memcache_client"] is not None:
+        # Cache only the entities form db, and the keys that haven't been found
+        if res_from_db:
+            cache.put(res_from_db, fetch_time=fetchTime)
+        if len(res_from_db) < len(missing_keys):
+            cache.put_missing([key for key in missing_keys if key not in res_from_db], fetch_time=fetchTime)
+    currentTxn = currentTransaction.get()
+    if currentTxn:
+        for key in missing_keys:
+            currentTxn["entities"][key] = codec.encode(res_from_db[key]) if key in res_from_db else None
+    res.update(res_from_db)
 
-            if (element.at_pointer("/deferred").error() == SUCCESS):
-                deferred_keys = toPythonStructure(element.at_key("deferred"))
-                missing_keys_paths = [keyToPath(key) for key in missing_keys]
-                keys = keys[300:]
-                for i, deferred_key in enumerate(deferred_keys):
-                    if deferred_key in missing_keys_paths:
-                        keys.insert(0, missing_keys[i])
+def _deleteBatch(keys: List[Key]) -> None:
+    """
+        Internal helper that deletes one batch of keys in a non-transactional commit and removes them from the cache.
 
-            else:
-                keys = keys[300:]
-    res = res_from_db | res_from_cache
+        :param keys: The keys to delete
+    """
+    _drive(_deleteSteps(keys))
     if conf["memcache_client"] is not None:
-        # Cache only the entities form db.
-        cache.put({str(key): value for key, value in res_from_db.items()})
+        cache.delete(keys)
 
-    if not isMulti:
-        return res.get(untouched_keys[0])
-    else:
-        return [res.get(key) for key in untouched_keys]  # Sort by order of incoming keys
+def _deleteSteps(keys: List[Key]) -> Generator:
+    """
+        The steps of _deleteBatch (except for updating the cache).
+    """
+    metrics = currentOperation.get()
+    start = perf_counter()
+    mutations = [encodeDeleteMutation(x) for x in keys]
+    if metrics is not None:
+        metrics.add(encode_time=perf_counter() - start)
+    yield from _commitSteps(keys, mutations)
 
+@_instrumented("Delete", _kindOfKeys)
 def Delete(keys: Union[Key, List[Key], Entity, List[Entity]]) -> None:
     """
         Deletes the entities stored under the given key(s).
         If a key is not found, it's silently ignored.
-        A maximum of 300 Keys can be deleted at once.
+        Outside of transactions, the keys are deleted in commits of up to 500 keys, of which up to
+        conf["max_concurrent_commits"] are in flight at the same time. If one of them fails, the others might have
+        been committed nevertheless. Inside :func:`viur.datastore.utils.bufferedWrites`, the deletes are only
+        added to the current WriteBuffer.
 
         :param keys: A Key or a List of Keys
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element
-    cdef simdjsonArray arrayElem
+    keys = _deletedKeys(keys)
+    if not keys:  # We got an empty list (probably a query that returned no results), noting to do here
+        return
+    currentTxn = currentTransaction.get()
+    if currentTxn:
+        _deleteInTxn(currentTxn, keys)
+        return
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Committed later, together with other writes
+        writeBuffer.add(keys, [encodeDeleteMutation(x) for x in keys])
+        return
+    run_concurrently(_deleteBatch, _keyBatches(keys, COMMIT_MAX_MUTATIONS), max_workers=conf["max_concurrent_commits"])
+
+def _deletedKeys(keys: Union[Key, List[Key], Entity, List[Entity]]) -> List[Key]:
+    """
+        Internal helper that converts the argument of Delete to a list of keys and adds them to the data access log.
+    """
     if isinstance(keys, Key):
         keys = [keys]
     elif isinstance(keys, Entity):
@@ -674,190 +2168,393 @@ def Delete(keys: Union[Key, List[Key], Entity, List[Entity]]) -> None:
     accessLog = currentDbAccessLog.get()
     if isinstance(accessLog, set):
         accessLog.update(set(keys))
-    if not keys:  # We got an empty list (probably a query that returned no results), noting to do here
-        return
-    postData = {
-        "mode": "NON_TRANSACTIONAL",  #"TRANSACTIONAL", #
-        "mutations": [
-            {
-                "delete": pythonPropToJson(x)["keyValue"]
-            }
-            for x in keys
-        ]
-    }
-    currentTxn = currentTransaction.get()
-    if currentTxn:
-        currentTxn["mutations"].extend(postData["mutations"])
-        # Insert placeholders into affectedEntities as we receive a mutation-result for each key deleted
-        currentTxn["affectedEntities"].extend([None] * len(keys))
-        return
-    resp = authenticated_request(
-        url="https://datastore.googleapis.com/v1/projects/%s:commit" % projectID,
-        data=json.dumps(postData).encode("UTF-8"),
-    )
-    if is_viur_datastore_request_ok(resp):
-        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-        element = parser.parse(data_ptr, pysize, 1)
-        if (element.at_pointer("/mutationResults").error() != SUCCESS):
-            logging.error(resp.content)
-            raise NoMutationResultsError("No mutation results received")
-        arrayElem = element.at_key("mutationResults").get_array()
-        if arrayElem.size() != abs(len(keys)):
-            logging.error(resp.content)
-            raise ValueError("Invalid number of mutation-results received")
+    return keys
+
+def _deleteInTxn(currentTxn: dict, keys: List[Key]) -> None:
+    """
+        Internal helper that queues the deletion of the given keys in the given transaction.
+    """
+    currentTxn["mutations"].extend([encodeDeleteMutation(x) for x in keys])
+    # Insert placeholders into affectedEntities as we receive a mutation-result for each key deleted
+    currentTxn["affectedEntities"].extend([None] * len(keys))
+    currentTxn["deletedKeys"].extend(keys)
+    for key in keys:
+        currentTxn["entities"][key] = None
+
+def _keyBatches(keys: Iterable[Union[Key, Entity]], batchSize: int):
+    """
+        Internal helper that consumes keys (or entities) lazily, yielding argument tuples for _deleteBatch.
+    """
+    batch = []
+    for key in keys:
+        batch.append(key.key if isinstance(key, Entity) else key)
+        if len(batch) == batchSize:
+            yield (batch,)
+            batch = []
+    if batch:
+        yield (batch,)
+
+@_instrumented("BulkDelete", _kindOfKeys)
+def BulkDelete(keys: Iterable[Union[Key, Entity]]) -> int:
+    """
+        Deletes the entities stored under the given keys (or entities), consuming the iterable lazily. This is meant
+        for purging large numbers of entities, like BulkDelete(query.iterKeys()).
+        The keys are deleted in commits of up to 500 keys, of which up to conf["max_concurrent_commits"] are in
+        flight at the same time. Each commit removes its keys from the cache.
+        Inside a transaction, the keys are just added to the transaction (like Delete does).
+
+        :param keys: An iterable of Keys or Entities
+        :return: The number of keys deleted
+    """
+    if currentTransaction.get():
+        keys = list(keys)
+        Delete(keys)
+        return len(keys)
+    accessLog = currentDbAccessLog.get()
+    count = 0
+
+    def logBatches():
+        nonlocal count
+        for args in _keyBatches(keys, COMMIT_MAX_MUTATIONS):
+            if isinstance(accessLog, set):
+                accessLog.update(args[0])
+            count += len(args[0])
+            yield args
+
+    for _ in iter_concurrently(_deleteBatch, logBatches(), max_workers=conf["max_concurrent_commits"]):
+        pass
+    return count
+
+def _commitBatches(items: list, mutations: List[bytes]) -> List[tuple]:
+    """
+        Internal helper that splits items and their encoded mutations into batches that fit into a single commit:
+        At most COMMIT_MAX_MUTATIONS mutations of together at most COMMIT_MAX_BYTES bytes (unless a single mutation
+        is larger than that).
+
+        :param items: The entities (or keys) the mutations belong to
+        :param mutations: The encoded mutations, one for each item
+        :return: A list of (items, mutations) tuples in input order
+    """
+    res = []
+    start = 0
+    size = 0
+    for idx, mutation in enumerate(mutations):
+        if idx > start and (idx - start == COMMIT_MAX_MUTATIONS or size + len(mutation) > COMMIT_MAX_BYTES):
+            res.append((items[start:idx], mutations[start:idx]))
+            start = idx
+            size = 0
+        size += len(mutation)
+    if start < len(mutations):
+        res.append((items[start:], mutations[start:]))
+    return res
+
+def _commitBatch(items: list, mutations: List[bytes], cacheEntities: bool = True) -> None:
+    """
+        Internal helper that commits one batch of mutations non-transactionally. The entities written get the keys
+        assigned by the datastore and their new versions set.
+
+        :param items: The Entity for each upsert mutation or the Key for each delete mutation
+        :param mutations: The encoded mutations
+        :param cacheEntities: If set, the entities written are put into the cache. Otherwise (as they might have been
+            changed since their mutations have been encoded), the keys of all items are removed from the cache.
+    """
+    _drive(_commitSteps(items, mutations))
     if conf["memcache_client"] is not None:
-        cache.delete([str(key) for key in keys])
+        _cacheCommitted(items, cacheEntities)
+
+def _commitSteps(items: list, mutations: List[bytes], transaction: Optional[str] = None) -> Generator:
+    """
+        The steps of a commit: Sends the given mutations (inside the given transaction, if any) and sets the keys
+        assigned by the datastore and the new versions on the entities written.
+
+        :param items: The Entity for each upsert mutation, the Key (or None) for each delete mutation
+        :param mutations: The encoded mutations
+        :param transaction: The transaction to commit, if any
+    """
+    metrics = currentOperation.get()
+    start = perf_counter()
+    data = encodeCommitRequest("TRANSACTIONAL" if transaction else "NON_TRANSACTIONAL", mutations, transaction)
+    if metrics is not None:
+        metrics.add(encode_time=perf_counter() - start, entities=len(items))
+    resp = yield "commit", data, False
+    _decodeMutationResults(resp, items, metrics)
+
+cdef void _decodeMutationResults(object resp, list items, object metrics) except *:
+    """
+        Internal helper decoding the response to a commit, setting the keys assigned and the new versions on the
+        entities in items.
+    """
+    cdef _ParserSlot parser
+    cdef simdjsonElement element, innerArrayElem
+    cdef simdjsonArray arrayElem
+    cdef simdjsonArray.iterator arrayIt
+    is_viur_datastore_request_ok(resp)
+    start = perf_counter()
+    parser = _acquireParser()
+    element = parser.parse(resp.content)
+    if (element.at_pointer("/mutationResults").error() != SUCCESS):
+        logging.error(resp.content)
+        raise NoMutationResultsError("No mutation-results received")
+    arrayElem = element.at_key("mutationResults").get_array()
+    if arrayElem.size() != abs(len(items)):
+        logging.error(resp.content)
+        raise NoMutationResultsError("Invalid number of mutation-results received")
+    arrayIt = arrayElem.begin()
+    idx = 0
+    while arrayIt != arrayElem.end():
+        innerArrayElem = dereference(arrayIt)
+        item = items[idx]
+        if innerArrayElem.at_pointer("/key").error() == SUCCESS:  # We got a new key assigned
+            if not isinstance(item, Entity):
+                logging.error(f"{resp.content=}")
+                raise ViurDatastoreError("Received an unexpected key-update")
+            item.key = parseKey(innerArrayElem.at_key("key"))
+        if isinstance(item, Entity):
+            item.version = toPyStr(innerArrayElem.at_key("version").get_string())
+        preincrement(arrayIt)
+        idx += 1
+    _releaseParser(parser)
+    if metrics is not None:
+        metrics.add(decode_time=perf_counter() - start)
+
+def _cacheCommitted(items: list, cacheEntities: bool) -> None:
+    """
+        Internal helper that updates the cache after a non-transactional commit, see _commitBatch.
+    """
+    if cacheEntities:
+        # iter over all entities and write them to the cache
+        cache.put([x for x in items if isinstance(x, Entity)])
+    else:
+        cache.delete([x.key if isinstance(x, Entity) else x for x in items])
 
+class WriteBuffer:
+    """
+        Collects the mutations of non-transactional Put and Delete calls while it's active (see
+        :func:`viur.datastore.utils.bufferedWrites`), so that they can be committed together.
+
+        Mutations are deduplicated by key, the last Put or Delete of a key wins. As each key is written only once,
+        flushing leaves the datastore in the same state as committing each call in order would have. Entities are
+        encoded when Put is called, later changes to them are not written. Entities with partial keys get their
+        keys (and all entities their versions) when the buffer is flushed.
+        Buffered writes are not visible to Get or queries until then.
+    """
+
+    def __init__(self, max_mutations: int = COMMIT_MAX_MUTATIONS):
+        """
+            :param max_mutations: Flush as soon as this many mutations (or COMMIT_MAX_BYTES) have been collected
+        """
+        self.max_mutations = max_mutations
+        self._pending = {}  # Key (or id() of an entity with a partial key) -> (Entity or Key, mutation)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, items: list, mutations: List[bytes]) -> None:
+        """
+            Adds the given mutations to this buffer, replacing earlier mutations for the same keys. Flushes the buffer
+            if it's full afterwards.
+
+            :param items: The Entity for each upsert mutation or the Key for each delete mutation
+            :param mutations: The encoded mutations
+        """
+        if self._add(items, mutations):
+            self.flush()
+
+    def _add(self, items: list, mutations: List[bytes]) -> bool:
+        """
+            Adds the given mutations to this buffer (like add) without flushing it.
+
+            :return: Whether the buffer is full and has to be flushed
+        """
+        with self._lock:
+            for item, mutation in zip(items, mutations):
+                key = item.key if isinstance(item, Entity) else item
+                identifier = id(item) if key.is_partial else key
+                old = self._pending.pop(identifier, None)  # Re-insert to keep the order of the last writes
+                if old is not None:
+                    self._size -= len(old[1])
+                self._pending[identifier] = (item, mutation)
+                self._size += len(mutation)
+            return len(self._pending) >= self.max_mutations or self._size >= COMMIT_MAX_BYTES
+
+    def flush(self) -> None:
+        """
+            Commits all mutations collected so far, using up to conf["max_concurrent_commits"] commits at the same time.
+        """
+        items, mutations = self._take()
+        if items:
+            _commitBuffered(items, mutations)
+
+    def _take(self) -> Tuple[list, List[bytes]]:
+        """
+            Empties this buffer.
+
+            :return: The items and mutations collected so far, to be committed by the caller
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+            self._size = 0
+        return [x[0] for x in pending], [x[1] for x in pending]
+
+@_instrumented("Commit", _kindOfKeys)
+def _commitBuffered(items: list, mutations: List[bytes]) -> None:
+    """
+        Internal helper that commits the mutations flushed from a WriteBuffer. It's measured as an operation of its
+        own, as buffered writes are usually flushed outside of the Put and Delete calls that collected them.
+
+        :param items: The Entity for each upsert mutation or the Key for each delete mutation
+        :param mutations: The encoded mutations
+    """
+    run_concurrently(
+        _commitBatch,
+        [(batchItems, batchMutations, False) for batchItems, batchMutations in _commitBatches(items, mutations)],
+        max_workers=conf["max_concurrent_commits"],
+    )
+
+@_instrumented("Put", _kindOfKeys)
 def Put(entities: Union[Entity, List[Entity]]) -> Union[Entity, List[Entity]]:
     """
         Writes the given entities into the datastore. The entities can be from different kinds. If an entity has an
         complete key, and there's already an entity stored under the given key, it's overwritten.
+        Outside of transactions, the entities are written in commits of up to 500 entities (and 9 MiB), of which up
+        to conf["max_concurrent_commits"] are in flight at the same time. If one of them fails, the others might have
+        been committed nevertheless. Inside :func:`viur.datastore.utils.bufferedWrites`, the entities are only
+        added to the current WriteBuffer.
 
         :param entities: The entities to store
         :return: The Entity or List of Entities as supplied, with partial keys replaced by full ones (unless called
             inside a transaction, in which case we return None as no Keys have been determined yet)
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element, innerArrayElem
-    cdef simdjsonArray arrayElem
-    cdef simdjsonArray.iterator arrayIt
     if isinstance(entities, Entity):
         entities = [entities]
+    mutations = _encodePut(entities)
+    currentTxn = currentTransaction.get()
+    if currentTxn:  # We're currently inside a transaction, just queue the changes
+        _putInTxn(currentTxn, entities, mutations)
+        return
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Committed later, together with other writes
+        writeBuffer.add(entities, mutations)
+        return entities
+    run_concurrently(_commitBatch, _commitBatches(entities, mutations), max_workers=conf["max_concurrent_commits"])
+    return entities
+
+def _encodePut(entities: List[Entity]) -> List[bytes]:
+    """
+        Internal helper that adds the entities given to Put to the data access log and encodes their mutations.
+    """
     accessLog = currentDbAccessLog.get()
     if isinstance(accessLog, set):
         accessLog.update(set([x.key for x in entities if not x.key.is_partial]))
+    start = perf_counter()
+    mutations = [encodeUpsertMutation(x) for x in entities]
+    metrics = currentOperation.get()
+    if metrics is not None:
+        metrics.add(encode_time=perf_counter() - start)
+    return mutations
+
+def _putInTxn(currentTxn: dict, entities: List[Entity], mutations: List[bytes]) -> None:
+    """
+        Internal helper that queues the given mutations in the given transaction.
+    """
+    currentTxn["mutations"].extend(mutations)
+    currentTxn["affectedEntities"].extend(entities)
+    for entity in entities:  # Make the state written visible to later Get calls in this transaction
+        if not entity.key.is_partial:
+            currentTxn["entities"][entity.key] = codec.encode(entity)
+
+def _beginTxn(allowOverriding: bool = False) -> dict:
+    """
+        Internal helper that starts a new transaction.
+
+        :param allowOverriding: Allow starting a transaction while another one is active, retrying the previous one
+        :return: The state of the new transaction, which has to be set as currentTransaction
+    """
+    return _drive(_beginTxnSteps(allowOverriding))
+
+def _beginTxnSteps(allowOverriding: bool = False) -> Generator:
+    """
+        The steps of _beginTxn.
+    """
+    oldTxn = currentTransaction.get()
+    if oldTxn:
+        if not allowOverriding:
+            raise RecursionError("Cannot call runInTransaction while inside a transaction!")
+        txnOptions = {
+            "previousTransaction": oldTxn["key"]
+        }
+    else:
+        txnOptions = {}
     postData = {
-        "mode": "NON_TRANSACTIONAL",  # Always NON_TRANSACTIONAL; if we're inside a transaction we'll abort below
-        "mutations": [
-            {
-                "upsert": pythonPropToJson(x)["entityValue"]
-            }
-            for x in entities
-        ]
+        "transactionOptions": {
+            "readWrite": txnOptions
+        }
     }
-    currentTxn = currentTransaction.get()
-    if currentTxn:  # We're currently inside a transaction, just queue the changes
-        currentTxn["mutations"].extend(postData["mutations"])
-        currentTxn["affectedEntities"].extend(entities)
-        return
-    resp = authenticated_request(
-        url="https://datastore.googleapis.com/v1/projects/%s:commit" % projectID,
-        data=json.dumps(postData).encode("UTF-8"),
-    )
+    resp = yield "beginTransaction", json.dumps(postData).encode("UTF-8"), False
+    is_viur_datastore_request_ok(resp)
+    txnKey = json.loads(resp.content)["transaction"]
+    return {"key": txnKey, "mutations": [], "affectedEntities": [], "deletedKeys": [], "entities": {}}
 
-    if is_viur_datastore_request_ok(resp):
-        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-        element = parser.parse(data_ptr, pysize, 1)
-        if (element.at_pointer("/mutationResults").error() != SUCCESS):
-            logging.error(resp.content)
-            raise ValueError("No mutation-results received")
-        arrayElem = element.at_key("mutationResults").get_array()
-        if arrayElem.size() != abs(len(entities)):
-            logging.error(resp.content)
-            raise NoMutationResultsError("Invalid number of mutation-results received")
-        arrayIt = arrayElem.begin()
-        idx = 0
-        while arrayIt != arrayElem.end():
-            innerArrayElem = dereference(arrayIt)
-            if innerArrayElem.at_pointer("/key").error() == SUCCESS:  # We got a new key assigned
-                entities[idx].key = parseKey(innerArrayElem.at_key("key"))
-            entities[idx].version = toPyStr(innerArrayElem.at_key("version").get_string())
-            preincrement(arrayIt)
-            idx += 1
-        if conf["memcache_client"] is not None:
-            # iter over all entities and write them to the cache
-            cache.put(entities)
-    return entities
+def _commitTxn(currentTxn: dict) -> None:
+    """
+        Internal helper that commits the mutations queued in the given transaction (or frees it if there are none)
+        and publishes its changes to the cache.
 
+        :param currentTxn: The state of the transaction, as returned by _beginTxn
+    """
+    _drive(_commitTxnSteps(currentTxn))
+    if currentTxn["mutations"] and conf["memcache_client"] is not None:
+        _publishTxn(currentTxn)
+
+def _commitTxnSteps(currentTxn: dict) -> Generator:
+    """
+        The steps of _commitTxn (except for publishing its changes to the cache).
+    """
+    if not currentTxn["mutations"]:  # No changes have been made - free txn
+        yield from _rollbackTxnSteps(currentTxn["key"])
+        return
+    yield from _commitSteps(currentTxn["affectedEntities"], currentTxn["mutations"], currentTxn["key"])
+
+@_instrumented("RunInTransaction", lambda *args, **kwargs: None)
 def RunInTransaction(callback: callable, *args, **kwargs) -> Any:
     """
         Runs the given function inside a AID transaction.
 
+        While it's running, the transaction keeps a map of all entities read, written or deleted by key. Get calls
+        for these keys are served from that map, so repeated reads don't cause further lookups and writes are
+        visible to later reads in the same transaction (unlike the datastore itself, which reads the state at the
+        start of the transaction). Queries are not affected. Once committed, the final state of all keys written
+        is published to the cache.
+
         :param callback: The function to run inside a transaction
         :param args: Args to pass to the function
         :param kwargs: Kwargs to pass to the function
         :return: The return-value of the callback function
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element, innerArrayElem
-    cdef simdjsonArray arrayElem
-    cdef simdjsonArray.iterator arrayIt
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # Buffered writes must not overwrite the writes of this transaction later on
+        writeBuffer.flush()
+    allowOverriding = kwargs.pop("__allowOverriding__", None)
+    metrics = currentOperation.get()
     for exponential_backoff in range(1, 4):
+        if metrics is not None and exponential_backoff > 1:
+            metrics.add(retries=1)
         try:
-            oldTxn = currentTransaction.get()
-            allowOverriding = kwargs.pop("__allowOverriding__", None)
-            if oldTxn:
-                if not allowOverriding:
-                    raise RecursionError("Cannot call runInTransaction while inside a transaction!")
-                txnOptions = {
-                    "previousTransaction": oldTxn["key"]
-                }
-            else:
-                txnOptions = {}
-            postData = {
-                "transactionOptions": {
-                    "readWrite": txnOptions
-                }
-            }
-            resp = authenticated_request(
-                url="https://datastore.googleapis.com/v1/projects/%s:beginTransaction" % projectID,
-                data=json.dumps(postData).encode("UTF-8"),
-            )
-            if is_viur_datastore_request_ok(resp):
-                txnKey = json.loads(resp.content)["transaction"]
+            currentTxn = _beginTxn(allowOverriding)
+            try:
+                currentTransaction.set(currentTxn)
                 try:
-                    currentTxn = {"key": txnKey, "mutations": [], "affectedEntities": []}
-                    currentTransaction.set(currentTxn)
-                    try:
-                        res = callback(*args, **kwargs)
-                    except:
-                        _rollbackTxn(txnKey)
-                        raise
-                    if currentTxn["mutations"]:
-                        # Commit TXN
-                        postData = {
-                            "mode": "TRANSACTIONAL",  #
-                            "transaction": txnKey,
-                            "mutations": currentTxn["mutations"]
-                        }
-                        resp = authenticated_request(
-                            url="https://datastore.googleapis.com/v1/projects/%s:commit" % projectID,
-                            data=json.dumps(postData).encode("UTF-8"),
-                        )
-
-                        is_viur_datastore_request_ok(resp)
-                        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-                        element = parser.parse(data_ptr, pysize, 1)
-                        if (element.at_pointer("/mutationResults").error() != SUCCESS):
-                            logging.error(resp.content)
-                            raise NoMutationResultsError("No mutation-results received")
-                        arrayElem = element.at_key("mutationResults").get_array()
-                        if arrayElem.size() != abs(len(currentTxn["affectedEntities"])):
-                            logging.error(resp.content)
-                            raise ViurDatastoreError("Invalid number of mutation-results received")
-                        arrayIt = arrayElem.begin()
-                        idx = 0
-                        while arrayIt != arrayElem.end():
-                            innerArrayElem = dereference(arrayIt)
-                            if innerArrayElem.at_pointer("/key").error() == SUCCESS:  # We got a new key assigned
-                                affectedEntity = currentTxn["affectedEntities"][idx]
-                                if not affectedEntity:
-                                    logging.error(f"{resp.content=}")
-                                    raise ViurDatastoreError("Received an unexpected key-update")
-                                affectedEntity.key = parseKey(innerArrayElem.at_key("key"))
-                                affectedEntity.version = toPyStr(innerArrayElem.at_key("version").get_string())
-                            preincrement(arrayIt)
-                            idx += 1
-                        return res
-                    else:  # No changes have been made - free txn
-                        _rollbackTxn(txnKey)
-                        return res
-                finally:  # Ensure, currentTransaction is always set back to none
-                    currentTransaction.set(None)
+                    res = callback(*args, **kwargs)
+                except:
+                    _rollbackTxn(currentTxn["key"])
+                    raise
+                _commitTxn(currentTxn)
+                return res
+            finally:  # Ensure, currentTransaction is always set back to none
+                currentTransaction.set(None)
         except (CollisionError, AbortedError) as err:  # Got a collision or is aborted; retry the entire transaction
             sleep_time = 2 ** exponential_backoff
             logging.error(f"We got an error in a transaction we try again in {sleep_time} seconds")
@@ -865,6 +2562,34 @@ def RunInTransaction(callback: callable, *args, **kwargs) -> Any:
     raise CollisionError(
         "All retries are exhausted for this transaction")  # If we made it here, all tries are exhausted
 
+def _publishTxn(txn: dict) -> None:
+    """
+        Internal helper that writes the final state of all keys written in a committed transaction to the cache.
+        Entities that got their key assigned on commit aren't in the transaction's entity map; they're just
+        removed from the cache.
+
+        :param txn: The transaction that has been committed
+    """
+    txnEntities = txn["entities"]
+    versions = {x.key: x.version for x in txn["affectedEntities"] if x}
+    toPut = {}
+    toDelete = []
+    missing = []
+    for key in dict.fromkeys(list(versions) + txn["deletedKeys"]):
+        if key not in txnEntities:
+            toDelete.append(key)
+        elif txnEntities[key] is None:
+            missing.append(key)
+        else:
+            entity = toPut[key] = codec.decode(txnEntities[key])
+            entity.version = versions.get(key)
+    if toPut:
+        cache.put(toPut)
+    if missing:
+        cache.put_missing(missing)
+    if toDelete:
+        cache.delete(toDelete)
+
 def _rollbackTxn(txnKey: str):
     """
         Internal helper that aborts the given transaction. It's important to abort pending transactions (instead
@@ -873,14 +2598,18 @@ def _rollbackTxn(txnKey: str):
 
         :param txnKey: The ID of the transaction that should be aborted
     """
+    _drive(_rollbackTxnSteps(txnKey))
+
+def _rollbackTxnSteps(txnKey: str) -> Generator:
+    """
+        The steps of _rollbackTxn.
+    """
     postData = {
         "transaction": txnKey
     }
-    resp = authenticated_request(
-        url="https://datastore.googleapis.com/v1/projects/%s:rollback" % projectID,
-        data=json.dumps(postData).encode("UTF-8"),
-    )
+    yield "rollback", json.dumps(postData).encode("UTF-8"), False
 
+@_instrumented("AllocateIDs", _kindOfKeys)
 def AllocateIDs(keys: Union[Key, List[Key]]) -> Union[Key, List[Key]]:
     """
         Allocates numeric IDs for the keys given.
@@ -889,53 +2618,58 @@ def AllocateIDs(keys: Union[Key, List[Key]]) -> Union[Key, List[Key]]:
         .. warning: This function does not support transactions! Even if called inside transactions, the keys will
             be allocated immediately, even if the transaction aborts.
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element
+    return _drive(_allocateIdsSteps(keys))
+
+def _allocateIdsSteps(keys: Union[Key, List[Key]]) -> Generator:
+    """
+        The steps of AllocateIDs.
+    """
     isMulti = True
     if isinstance(keys, Key):
         keys = [keys]
         isMulti = False
-    keyList = [
-        {
-            "partitionId": {
-                "project_id": projectID,
-            },
-            "path": keyToPath(x)
-        }
-        for x in keys]
+    resp = yield "allocateIds", encodeAllocateIdsRequest(keys[:300]), False
+    res = _decodeAllocatedKeys(resp)
+    if not isMulti:
+        return res[0]
+    else:
+        return res
 
-    requestedKeys = keyList[:300]
-    postData = {
-        "keys": requestedKeys,
-    }
-    resp = authenticated_request(
-        url="https://datastore.googleapis.com/v1/projects/%s:allocateIds" % projectID,
-        data=json.dumps(postData).encode("UTF-8"),
-    )
-    if is_viur_datastore_request_ok(resp):
-        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-        element = parser.parse(data_ptr, pysize, 1)
-        res = []
-        if (element.at_pointer("/keys").error() == SUCCESS):
-            arrayElem = element.at_key("keys").get_array()
-            arrayIt = arrayElem.begin()
-            while arrayIt != arrayElem.end():
-                innerArrayElem = dereference(arrayIt)
-                res.append(parseKey(innerArrayElem))
-                preincrement(arrayIt)
-            if not res:
-                raise ValueError("Empty response received from Datastore API")
-            elif not isMulti:
-                return res[0]
-            else:
-                return res
-        else:
-            logging.error("Invalid data received from Datastore API")
-            logging.error(resp.content)
-            raise ValueError("Invalid data received from Datastore API")
+cdef list _decodeAllocatedKeys(object resp):
+    """
+        Internal helper decoding the keys of the response to allocateIds.
+    """
+    cdef _ParserSlot parser
+    cdef simdjsonElement element, innerArrayElem
+    cdef simdjsonArray arrayElem
+    cdef simdjsonArray.iterator arrayIt
+    is_viur_datastore_request_ok(resp)
+    parser = _acquireParser()
+    element = parser.parse(resp.content)
+    res = []
+    if (element.at_pointer("/keys").error() == SUCCESS):
+        arrayElem = element.at_key("keys").get_array()
+        arrayIt = arrayElem.begin()
+        while arrayIt != arrayElem.end():
+            innerArrayElem = dereference(arrayIt)
+            res.append(parseKey(innerArrayElem))
+            preincrement(arrayIt)
+        _releaseParser(parser)
+        if not res:
+            raise ValueError("Empty response received from Datastore API")
+        return res
+    else:
+        logging.error("Invalid data received from Datastore API")
+        logging.error(resp.content)
+        raise ValueError("Invalid data received from Datastore API")
 
+def _kindOfCount(kind: str = None, up_to: int = None, queryDefinition: QueryDefinition = None) -> Optional[str]:
+    """
+        Internal helper returning the kind counted by Count, to label the metrics of a call.
+    """
+    return kind or queryDefinition and queryDefinition.kind
+
+@_instrumented("Count", _kindOfCount)
 def Count(kind: str = None, up_to= 2 ** 63 - 1, queryDefinition: QueryDefinition = None) -> Union[Key, List[Key]]:
     """
         Count all entries in a kind if there is only a kind is provided
@@ -948,79 +2682,38 @@ def Count(kind: str = None, up_to= 2 ** 63 - 1, queryDefinition: QueryDefinition
         .. warning: This function does not support transactions! Even if called inside transactions, the keys will
             be allocated immediately, even if the transaction aborts.
     """
-    cdef simdjsonParser parser = simdjsonParser()
-    cdef Py_ssize_t pysize
-    cdef char * data_ptr
-    cdef simdjsonElement element
-    cdef simdjsonElement element_inner
-    cdef simdjsonArray array_element, array_element_inner
+    return _drive(_countSteps(kind, up_to, queryDefinition))
+
+def _countSteps(kind: str = None, up_to= 2 ** 63 - 1, queryDefinition: QueryDefinition = None) -> Generator:
+    """
+        The steps of Count.
+    """
     logging.warning(
         "The 'Count() aggregation' query is a technical preview and cannot be guaranteed to work at this time!!!")
     if not kind:
         kind = queryDefinition.kind
+    resp = yield "runAggregationQuery", encodeCountRequest(kind, up_to, queryDefinition), True
+    count = _decodeCount(resp)
+    metrics = currentOperation.get()
+    if metrics is not None:
+        metrics.query = queryDefinition or QueryDefinition(kind, {}, [])
+        metrics.add(index_entries=count)
+    return count
 
-    post_data = {
-
-        "partitionId": {
-            "project_id": projectID,
-        }, "aggregation_query": {
-            "aggregations": {"count": {"up_to": up_to}},
-            "nested_query": {"kind": [{"name": kind}]}
-        },
-
-    }
-    if queryDefinition:
-        if queryDefinition.filters:
-            filterList = []
-            for k, v in queryDefinition.filters.items():
-                key, op = k.split(" ")
-                if op == "=":
-                    op = "EQUAL"
-                elif op == "<":
-                    op = "LESS_THAN"
-                elif op == "<=":
-                    op = "LESS_THAN_OR_EQUAL"
-                elif op == ">":
-                    op = "GREATER_THAN"
-                elif op == ">=":
-                    op = "GREATER_THAN_OR_EQUAL"
-                else:
-                    raise ValueError("Invalid op %s" % op)
-                if not isinstance(v, list):
-                    # An entity can have a list of values for a single property, so it's possible to enforce
-                    # more an one constraint for a a single property (e.g. x==5 and x==7 can be true), so
-                    # enforce we always have a list here
-                    v = [v]
-                for singleValue in v:
-                    filterList.append({
-                        "propertyFilter": {
-                            "property": {
-                                "name": key,
-                            },
-                            "op": op,
-                            "value": pythonPropToJson(singleValue)
-                        }
-                    })
-            if len(filterList) == 1:  # Special, single filter
-                post_data["aggregation_query"]["nested_query"]["filter"] = filterList[0]
-            else:
-                post_data["aggregation_query"]["nested_query"]["filter"] = {
-                    "compositeFilter": {
-                        "op": "AND",
-                        "filters": filterList
-                    }
-                }
-    resp = authenticated_request(
-        url="https://datastore.googleapis.com/v1/projects/%s:runAggregationQuery" % projectID,
-        data=json.dumps(post_data).encode("UTF-8"),
-    )
-    if is_viur_datastore_request_ok(resp):
-        assert PyBytes_AsStringAndSize(resp.content, &data_ptr, &pysize) != -1
-        element = parser.parse(data_ptr, pysize, 1)
-        if element.at_pointer("/batch").error() != SUCCESS:
-            logging.error("INVALID RESPONSE RECEIVED")
-            logging.error(json.loads(resp.content))
-        element = element.at_key("batch")
-        # TODO  maybe this can be solved more elegant
-        return int(
-            toPythonStructure(element)["aggregationResults"][0]["aggregateProperties"]["property_1"]["integerValue"])
+cdef object _decodeCount(object resp):
+    """
+        Internal helper decoding the count of the response to an aggregation query.
+    """
+    cdef _ParserSlot parser
+    cdef simdjsonElement element
+    is_viur_datastore_request_ok(resp)
+    parser = _acquireParser()
+    element = parser.parse(resp.content)
+    if element.at_pointer("/batch").error() != SUCCESS:
+        logging.error("INVALID RESPONSE RECEIVED")
+        logging.error(json.loads(resp.content))
+    element = element.at_key("batch")
+    # TODO  maybe this can be solved more elegant
+    batch = toPythonStructure(element)
+    _releaseParser(parser)
+    return int(batch["aggregationResults"][0]["aggregateProperties"]["property_1"]["integerValue"])
@@ -3,6 +3,7 @@ The constants, global variables and container classes used in the datastore api
 """
 from __future__ import annotations
 
+import os
 import typing as t
 from base64 import urlsafe_b64decode, urlsafe_b64encode
 from contextvars import ContextVar
@@ -12,6 +13,7 @@ from enum import Enum
 from typing import Dict, List, Optional, Set, Tuple, Union
 
 import google.auth
+import google.auth.exceptions
 from google.cloud.datastore import _app_engine_key_pb2
 
 if t.TYPE_CHECKING:
@@ -25,8 +27,14 @@ DATASTORE_BASE_TYPES = Union[None, str, int, float, bool, datetime, date, time,
 currentTransaction = ContextVar("CurrentTransaction", default=None)
 # If set to a set for the current thread/request, we'll log all entities / kinds accessed
 currentDbAccessLog: ContextVar[Optional[Set[Union[Key, str]]]] = ContextVar("Database-Accesslog", default=None)
-# The current projectID, which can't be imported from transport.pyx
-_, projectID = google.auth.default(scopes=["https://www.googleapis.com/auth/datastore"])
+# If set, non-transactional writes are collected in this WriteBuffer (see utils.bufferedWrites) instead of committed
+currentWriteBuffer = ContextVar("Write-Buffer", default=None)
+# The current projectID, which can't be imported from transport.pyx. Without credentials (like when running offline
+# against a fake backend, see transport.setBackend), it's taken from the GOOGLE_CLOUD_PROJECT environment variable.
+try:
+    _, projectID = google.auth.default(scopes=["https://www.googleapis.com/auth/datastore"])
+except google.auth.exceptions.DefaultCredentialsError:
+    projectID = os.environ.get("GOOGLE_CLOUD_PROJECT", "viur-datastore-offline")
 
 
 class SortOrder(Enum):
@@ -61,6 +69,23 @@ class SkelListRef(list):
         self.customQueryInfo = {}
 
 
+def _escapeCacheKeyPart(value: Optional[str]) -> str:
+    """
+        Escapes the characters used as separators in :attr:Key.cache_key.
+    """
+    if not value:
+        return ""
+    if "%" in value:
+        value = value.replace("%", "%25")
+    if "/" in value:
+        value = value.replace("/", "%2F")
+    if ":" in value:
+        value = value.replace(":", "%3A")
+    if "#" in value:
+        value = value.replace("#", "%23")
+    return value
+
+
 class Key:
     """
         The python representation of one datastore key. Unlike the original implementation, we don't store a
@@ -68,23 +93,62 @@ class Key:
         does not support accessing data in multiple projects.
     """
 
-    __slots__ = ["id", "name", "kind", "parent"]
+    __slots__ = ["_id", "_name", "_kind", "_parent", "_cache_key"]
 
     def __init__(self, kind: str, subKey: Union[int, str, None] = None, parent: 'Key' = None):
         super().__init__()
-        self.kind = kind
-        self.id = None
-        self.name = None
+        self._cache_key = None
+        self._kind = kind
+        self._id = None
+        self._name = None
         if isinstance(subKey, int):
-            self.id = subKey
+            self._id = subKey
         elif isinstance(subKey, str):
             if subKey.isdigit():
-                self.id = int(subKey)
+                self._id = int(subKey)
             else:
-                self.name = subKey
+                self._name = subKey
         elif subKey is not None:
             raise ValueError(f"Invalid argument type {subKey = }")
-        self.parent = parent
+        self._parent = parent
+
+    # The setters drop the memoized cache_key, so it's never used for a key that has been changed since
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    @kind.setter
+    def kind(self, value: str) -> None:
+        self._kind = value
+        self._cache_key = None
+
+    @property
+    def id(self) -> Optional[int]:
+        return self._id
+
+    @id.setter
+    def id(self, value: Optional[int]) -> None:
+        self._id = value
+        self._cache_key = None
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._name
+
+    @name.setter
+    def name(self, value: Optional[str]) -> None:
+        self._name = value
+        self._cache_key = None
+
+    @property
+    def parent(self) -> Optional['Key']:
+        return self._parent
+
+    @parent.setter
+    def parent(self, value: Optional['Key']) -> None:
+        self._parent = value
+        self._cache_key = None
 
     @property
     def id_or_name(self) -> Union[None, str, int]:
@@ -100,11 +164,11 @@ class Key:
         return "<viur.datastore.Key %s/%s, parent=%s>" % (self.kind, self.id_or_name, self.parent)
 
     def __hash__(self):
-        return hash("%s.%s.%s" % (self.kind, self.id, self.name))
+        return hash("%s.%s.%s" % (self._kind, self._id, self._name))
 
     def __eq__(self, other):
-        return isinstance(other, Key) and self.kind == other.kind and self.id == other.id and self.name == other.name \
-            and self.parent == other.parent
+        return isinstance(other, Key) and self._kind == other._kind and self._id == other._id \
+            and self._name == other._name and self._parent == other._parent
 
     def to_legacy_urlsafe(self) -> bytes:
         """
@@ -127,6 +191,30 @@ class Key:
         raw_bytes = reference.SerializeToString()
         return urlsafe_b64encode(raw_bytes).strip(b"=")
 
+    @property
+    def cache_key(self) -> str:
+        """
+            A compact representation of this key used to store its entity in the cache. Unlike
+            :meth:to_legacy_urlsafe, it doesn't involve protobuf and is memoized on this key until it's changed.
+            The parent's cache key it has been built from is kept as well; as that one is memoized itself, it's
+            compared by identity to notice changes to the parents.
+            :return: The path of this key, like "parentKind:name/kind#id"
+        """
+        memo = self._cache_key
+        parent = self._parent.cache_key if self._parent is not None else None
+        if memo is not None and memo[1] is parent:
+            return memo[0]
+        if self._id:
+            res = "%s#%s" % (_escapeCacheKeyPart(self._kind), self._id)
+        elif self._name:
+            res = "%s:%s" % (_escapeCacheKeyPart(self._kind), _escapeCacheKeyPart(self._name))
+        else:
+            res = _escapeCacheKeyPart(self._kind)
+        if parent:
+            res = "%s/%s" % (parent, res)
+        self._cache_key = (res, parent)
+        return res
+
     @property
     def is_partial(self) -> bool:
         """
@@ -159,8 +247,11 @@ class Entity(dict):
     """
         The python representation of one datastore entity. The values of this entity are stored inside this dictionary,
         while the meta-data (it's key, the list of properties excluded from indexing and our version) as property values.
+
+        Entities returned by projection queries only contain the projected properties. Their projection attribute
+        is set to the tuple of these property names, and they cannot be written back using Put.
     """
-    __slots__ = ["key", "_exclude_from_indexes", "version"]
+    __slots__ = ["key", "_exclude_from_indexes", "version", "projection"]
 
     def __init__(self, key: Optional[Key] = None, exclude_from_indexes: Optional[Set[str]] = None):
         super(Entity, self).__init__()
@@ -169,13 +260,172 @@ class Entity(dict):
         self.exclude_from_indexes = exclude_from_indexes or set()
         assert isinstance(self.exclude_from_indexes, set)
         self.version = None
+        self.projection = None
+
+    @property
+    def exclude_from_indexes(self) -> set[str]:
+        return self._exclude_from_indexes
+
+    @exclude_from_indexes.setter
+    def exclude_from_indexes(self, value: set[str] | list[str] | tuple[str]) -> None:
+        self._exclude_from_indexes = set(value)
+
+
+class LazyEntity(Entity):
+    """
+        An Entity returned by queries with QueryDefinition.lazy set. Its properties are kept in the parsed response
+        and are only converted to python objects the first time they're accessed, so properties that are never read
+        are never decoded.
+
+        Everything that needs all properties at once (iterating, len(), comparing, copying, pickling and reading
+        exclude_from_indexes - which includes writing it back using Put) decodes the remaining properties first,
+        after which the parsed response is no longer referenced by this entity.
+
+        The source must provide a dictionary of all property names (in their original order) as its names attribute
+        and a decode(name) method returning the value of that property and whether it's excluded from indexing.
+    """
+    __slots__ = ["_source"]
+
+    def __init__(self, key: Optional[Key] = None, source: t.Any = None):
+        self._source = None
+        super(LazyEntity, self).__init__(key)
+        self._source = source
+
+    def _isPending(self, name: str) -> bool:
+        # Unpickling sets the items before any of our slots, so _source might not be set yet
+        source = getattr(self, "_source", None)
+        return source is not None and name in source.names and not dict.__contains__(self, name)
+
+    def _decode(self, name: str) -> t.Any:
+        value, excluded = self._source.decode(name)
+        dict.__setitem__(self, name, value)
+        if excluded:
+            self._exclude_from_indexes.add(name)
+        return value
+
+    def materialize(self) -> None:
+        """
+            Decodes all properties that haven't been accessed yet. The properties keep the order of the response.
+        """
+        if self._source is None:
+            return
+        names = self._source.names
+        decoded = {name: dict.__getitem__(self, name) if dict.__contains__(self, name) else self._decode(name)
+                   for name in names}
+        added = {name: value for name, value in dict.items(self) if name not in names}
+        dict.clear(self)
+        dict.update(self, decoded)
+        dict.update(self, added)
+        self._source = None
+
+    def __missing__(self, name: str) -> t.Any:
+        if self._isPending(name):
+            return self._decode(name)
+        raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return dict.__contains__(self, name) or self._isPending(name)
+
+    def get(self, name: str, default: t.Any = None) -> t.Any:
+        if self._isPending(name):
+            return self._decode(name)
+        return dict.get(self, name, default)
+
+    def setdefault(self, name: str, default: t.Any = None) -> t.Any:
+        if name in self:
+            return self[name]
+        self[name] = default
+        return default
+
+    def __setitem__(self, name: str, value: t.Any) -> None:
+        if self._isPending(name):
+            self._decode(name)  # Keep whether it's excluded from indexing
+        dict.__setitem__(self, name, value)
+
+    def __delitem__(self, name: str) -> None:
+        self.materialize()
+        dict.__delitem__(self, name)
+
+    def pop(self, *args) -> t.Any:
+        self.materialize()
+        return dict.pop(self, *args)
+
+    def popitem(self) -> Tuple[str, t.Any]:
+        self.materialize()
+        return dict.popitem(self)
+
+    def clear(self) -> None:
+        self.materialize()
+        dict.clear(self)
+
+    def update(self, *args, **kwargs) -> None:
+        self.materialize()
+        dict.update(self, *args, **kwargs)
+
+    def __iter__(self):
+        self.materialize()
+        return dict.__iter__(self)
+
+    def __reversed__(self):
+        self.materialize()
+        return dict.__reversed__(self)
+
+    def __len__(self) -> int:
+        self.materialize()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.materialize()
+        return dict.keys(self)
+
+    def values(self):
+        self.materialize()
+        return dict.values(self)
+
+    def items(self):
+        self.materialize()
+        return dict.items(self)
+
+    def copy(self) -> dict:
+        self.materialize()
+        return dict.copy(self)
+
+    def __eq__(self, other: object) -> bool:
+        self.materialize()
+        if isinstance(other, LazyEntity):
+            other.materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other: object) -> bool:
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    __hash__ = None
+
+    def __or__(self, other: dict) -> dict:
+        self.materialize()
+        return dict.__or__(self, other)
+
+    def __ior__(self, other: dict) -> LazyEntity:
+        self.update(other)
+        return self
+
+    def __repr__(self) -> str:
+        self.materialize()
+        return dict.__repr__(self)
+
+    def __reduce_ex__(self, protocol: int):
+        self.materialize()
+        return super(LazyEntity, self).__reduce_ex__(protocol)
 
     @property
     def exclude_from_indexes(self) -> set[str]:
+        self.materialize()
         return self._exclude_from_indexes
 
     @exclude_from_indexes.setter
     def exclude_from_indexes(self, value: set[str] | list[str] | tuple[str]) -> None:
+        self.materialize()
         self._exclude_from_indexes = set(value)
 
 
@@ -193,3 +443,5 @@ class QueryDefinition:
     endCursor: Optional[str] = None  # If set, we'll only return entities up to this cursor in the index.
     currentCursor: Optional[
         str] = None  # Will be set after this query has been run, pointing after the last entity returned
+    projection: Union[None, List[str]] = None  # If set, only these properties (or with "__key__" only keys) are fetched
+    lazy: bool = False  # If set, entities are returned as LazyEntity, decoding their properties on first access
@@ -1,9 +1,11 @@
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Set, Tuple, Union
+from typing import Iterator, List, Optional, Set, Tuple, Union
 
-from viur.datastore.transport import Get, Put, RunInTransaction
+from viur.datastore.metrics import currentProfile, RequestProfile
+from viur.datastore.transport import COMMIT_MAX_MUTATIONS, Get, Put, RunInTransaction, WriteBuffer
 
-from viur.datastore.types import Entity, Key, currentDbAccessLog, currentTransaction
+from viur.datastore.types import Entity, Key, currentDbAccessLog, currentTransaction, currentWriteBuffer
 
 
 def fixUnindexableProperties(entry: Entity) -> Entity:
@@ -175,3 +177,61 @@ def endDataAccessLog(outerAccessLog: Optional[Set[Union[Key, str]]] = None) -> O
     else:
         currentDbAccessLog.set(None)
     return res
+
+
+def startProfiling(slow_queries: int = 5) -> Optional[RequestProfile]:
+    """
+        Starts a new :class:`viur.datastore.metrics.RequestProfile`, collecting the costs of all datastore calls made
+        in the current context (like the current request) from now on. The profile active before (if any) is
+        returned, so that it can be restored with :func:`endProfiling` in case of nested profiling.
+        :param slow_queries: How many of the slowest queries the profile should keep
+        :return: The profile that has been active before
+    """
+    old = currentProfile.get()
+    currentProfile.set(RequestProfile(slow_queries))
+    return old
+
+
+def endProfiling(outerProfile: Optional[RequestProfile] = None) -> Optional[RequestProfile]:
+    """
+        Stops the profile started by :func:`startProfiling` and returns it, e.g. to log its summary():
+        ..  code-block:: python
+        outer = startProfiling()
+        ...  # Handle the request
+        logging.info("Datastore usage:\n%s", endProfiling(outer))
+
+        :param outerProfile: The profile returned by :func:`startProfiling`. If given, it's reactivated and the
+            totals of the profile ended are added to it. Otherwise, profiling is disabled.
+        :return: The profile ended
+    """
+    res = currentProfile.get()
+    if outerProfile is not None and res is not None:
+        outerProfile.merge(res)
+    currentProfile.set(outerProfile)
+    return res
+
+
+@contextmanager
+def bufferedWrites(max_mutations: int = COMMIT_MAX_MUTATIONS) -> Iterator[WriteBuffer]:
+    """
+        Collects all non-transactional Put and Delete calls made inside this context in a
+        :class:`viur.datastore.transport.WriteBuffer` and commits them at its end (even if an exception is raised),
+        or as soon as max_mutations have been collected. Writes to the same key are deduplicated, the last one wins.
+        Pending writes are also flushed before a transaction is started.
+
+        Nested contexts share the buffer of the outermost one.
+
+        :param max_mutations: Flush the buffer as soon as it holds this many mutations
+        :return: The WriteBuffer in use, which can be flushed early by calling its flush() method
+    """
+    writeBuffer = currentWriteBuffer.get()
+    if writeBuffer is not None:  # The outer context will flush
+        yield writeBuffer
+        return
+    writeBuffer = WriteBuffer(max_mutations)
+    token = currentWriteBuffer.set(writeBuffer)
+    try:
+        yield writeBuffer
+    finally:
+        currentWriteBuffer.reset(token)
+        writeBuffer.flush()
@@ -3,4 +3,11 @@ from .transactions import TransactionTest
 from .queryvalues import QueryValuesTest
 from .querycustomfunctions import QueryCustomFunctionsTest
 from .dataaccesslog import DataAccessLogTest
-
+from .cache import InProcessCacheTest, CacheEntryTest, CacheKeyTest, CacheConsistencyTest
+from .codec import CodecTest
+from .encoder import EncoderTest
+from .decoder import DecoderTest
+from .writebuffer import WriteBufferTest
+from .aio import AioTest
+from .fakebackend import FakeDatastoreTest
+from .metrics import MetricsTest, ProfilingTest
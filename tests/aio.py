@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+import unittest
+from viur import datastore
+from viur.datastore import aio, fake, transport, utils
+from .base import BaseTestClass, testKindName
+
+"""
+	Ensure the awaitable functions of viur.datastore.aio work concurrently and keep the ContextVars per task
+"""
+
+
+class AioTest(BaseTestClass):
+
+	def test_concurrent(self):
+		"""
+			Many awaitable calls can be in flight at once and return the same results as the blocking ones
+		"""
+		keys = [datastore.Key(testKindName, "entity-%s" % x) for x in range(10)]
+
+		async def main():
+			entities = []
+			for key in keys:
+				entity = datastore.Entity(key)
+				entity["value"] = key.name
+				entities.append(entity)
+			await asyncio.gather(*[aio.Put(entity) for entity in entities])
+			return await asyncio.gather(*[aio.Get(key) for key in keys]), await aio.Count(testKindName)
+
+		results, count = asyncio.run(main())
+		self.assertEqual([e["value"] for e in results], [key.name for key in keys])
+		self.assertEqual(count, 10)
+		self.assertEqual(len(asyncio.run(aio.run(datastore.Query(testKindName), 20))), 10)
+
+	def test_context_per_task(self):
+		"""
+			Transactions and data access logs are only visible to the task they have been started in
+		"""
+		key = datastore.Key(testKindName, "test-entity")
+		inTransaction = asyncio.Event()
+
+		async def txn():
+			entity = datastore.Entity(key)
+			entity["value"] = 1
+			await aio.Put(entity)
+			inTransaction.set()
+			await asyncio.sleep(0.1)
+			return utils.IsInTransaction()
+
+		async def other():
+			await inTransaction.wait()
+			utils.startDataAccessLog()
+			self.assertFalse(utils.IsInTransaction())
+			self.assertIsNone(await aio.Get(key))  # Not committed yet
+			return utils.endDataAccessLog()
+
+		async def main():
+			return await asyncio.gather(aio.RunInTransaction(txn), other())
+
+		wasInTransaction, accessLog = asyncio.run(main())
+		self.assertTrue(wasInTransaction)
+		self.assertEqual(accessLog, {key})
+		self.assertEqual(datastore.Get(key)["value"], 1)
+
+	def test_sync_transaction(self):
+		"""
+			Regular callbacks of RunInTransaction are run on the thread pool, inside the transaction
+		"""
+		key = datastore.Key(testKindName, "test-entity")
+		loopThreads = []
+
+		def txn():
+			entity = datastore.Entity(key)
+			entity["value"] = 1
+			datastore.Put(entity)
+			return threading.get_ident(), utils.IsInTransaction()
+
+		async def main():
+			loopThreads.append(threading.get_ident())
+			return await aio.RunInTransaction(txn)
+
+		thread, wasInTransaction = asyncio.run(main())
+		self.assertNotEqual(thread, loopThreads[0])
+		self.assertTrue(wasInTransaction)
+		self.assertEqual(datastore.Get(key)["value"], 1)
+
+
+class AioNativeTest(unittest.TestCase):
+
+	def setUp(self) -> None:
+		super().setUp()
+		self.oldSession = transport._http_internal
+		self.backend = fake.FakeDatastore(latency=0.05, max_lookup_results=2)
+		transport.setBackend(self.backend)
+		self.oldRun = aio._run
+
+		async def noThreads(func, *args, **kwargs):
+			raise AssertionError("%s has been run on the thread pool" % func)
+
+		aio._run = noThreads
+
+	def tearDown(self) -> None:
+		aio._run = self.oldRun
+		transport.setBackend(self.oldSession)
+		super().tearDown()
+
+	def test_event_loop(self):
+		"""
+			Requests are awaited on the event loop instead of occupying a thread each
+		"""
+		keys = [datastore.Key(testKindName, "entity-%s" % x) for x in range(50)]
+
+		async def main():
+			await aio.Put([datastore.Entity(key) for key in keys])
+			start = time.perf_counter()
+			entities = await asyncio.gather(*[aio.Get(key) for key in keys])
+			return entities, time.perf_counter() - start
+
+		entities, duration = asyncio.run(main())
+		self.assertEqual([e.key for e in entities], keys)
+		self.assertLess(duration, 50 * 0.05 / 2)
+
+	def test_functions(self):
+		"""
+			All functions (except for BulkDelete) work without the thread pool
+		"""
+		keys = [datastore.Key(testKindName, "entity-%s" % x) for x in range(5)]
+
+		async def txn():
+			entity = await aio.Get(keys[0])
+			entity["value"] = -1
+			await aio.Put(entity)
+			await aio.Delete(keys[1])
+
+		async def main():
+			entities = []
+			for idx, key in enumerate(keys):
+				entity = datastore.Entity(key)
+				entity["value"] = idx
+				entities.append(entity)
+			await aio.Put(entities)
+			self.assertEqual(await aio.Count(testKindName), 5)
+			self.assertEqual(len(await aio.Get(keys)), 5)  # Deferred keys are looked up again
+			await aio.RunInTransaction(txn)
+			async with aio.bufferedWrites():
+				await aio.Delete(keys[2])
+			newKeys = await aio.AllocateIDs([datastore.Key(testKindName), datastore.Key(testKindName)])
+			self.assertTrue(all(not key.is_partial for key in newKeys))
+			query = datastore.Query(testKindName).filter("value IN", [-1, 3])
+			return await aio.run(query)
+
+		res = asyncio.run(main())
+		self.assertEqual([e["value"] for e in res], [-1, 3])
+		self.assertEqual(datastore.Get(keys[1:3]), [None, None])
+		self.assertGreater(self.backend.requests["lookup"], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,6 +1,10 @@
+import json
+import threading
+import time
 import typing as t
 import unittest
 
+import requests
 from viur import datastore
 from .base import BaseTestClass, datastoreSampleValues, testKindName, viurTypeToGoogleType
 
@@ -133,6 +137,226 @@ class BasicFunctionTest(BaseTestClass):
 		self.assertEqual(datastore.Count(testKindName), 10)
 		self.assertEqual(datastore.Count(testKindName, 4), 4)
 
+	def test_put_delete_chunked(self):
+		"""
+			Large lists are written and deleted in several (concurrent) commits, keeping the input order
+		"""
+		entities = []
+		for x in range(25):
+			e = datastore.Entity(datastore.Key(testKindName))
+			e["test"] = x
+			e["padding"] = "x" * 1000
+			e.exclude_from_indexes.add("padding")
+			entities.append(e)
+		oldValues = datastore.transport.COMMIT_MAX_MUTATIONS, datastore.transport.COMMIT_MAX_BYTES
+		try:
+			datastore.transport.COMMIT_MAX_MUTATIONS = 10
+			datastore.transport.COMMIT_MAX_BYTES = 5000  # About four entities per commit
+			res = datastore.Put(entities)
+			self.assertIs(res, entities)
+			self.assertTrue(all(not e.key.is_partial and e.version for e in entities))
+			self.assertEqual(len(set(e.key for e in entities)), 25)
+			for e, fetched in zip(entities, datastore.Get([e.key for e in entities])):
+				self.assertEqual(fetched["test"], e["test"])
+			datastore.Delete([e.key for e in entities])
+		finally:
+			datastore.transport.COMMIT_MAX_MUTATIONS, datastore.transport.COMMIT_MAX_BYTES = oldValues
+		self.assertEqual(datastore.Count(testKindName), 0)
+
+	def test_get_coalesced(self):
+		"""
+			Concurrent lookups of the same keys (or within the window) are combined, each caller gets its own entity
+		"""
+		keys = [datastore.Key(testKindName, "coalesced-%s" % x) for x in range(5)]
+		for key in keys:
+			entity = datastore.Entity(key)
+			entity["value"] = key.name
+			datastore.Put(entity)
+		lookups = []
+		origLookupBatch = datastore.transport._lookupBatch
+
+		def lookupBatch(keys, readOptions):
+			lookups.append(keys)
+			time.sleep(0.1)
+			return origLookupBatch(keys, readOptions)
+
+		def run(getKeys):
+			results = [None] * len(getKeys)
+
+			def worker(idx):
+				results[idx] = datastore.Get(getKeys[idx])
+
+			threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(len(getKeys))]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			return results
+
+		oldValues = datastore.config["coalesce_lookups"], datastore.config["coalesce_lookups_window"]
+		datastore.transport._lookupBatch = lookupBatch
+		try:
+			datastore.config["coalesce_lookups"] = True
+			results = run([keys[0]] * 5)
+			self.assertEqual(len(lookups), 1)
+			self.assertTrue(all(e == results[0] and e.key == keys[0] for e in results))
+			self.assertEqual(len(set(id(e) for e in results)), 5)
+			lookups.clear()
+			datastore.config["coalesce_lookups_window"] = 0.05
+			results = run(keys)
+			self.assertEqual(len(lookups), 1)
+			self.assertEqual([e["value"] for e in results], [key.name for key in keys])
+		finally:
+			datastore.transport._lookupBatch = origLookupBatch
+			datastore.config["coalesce_lookups"], datastore.config["coalesce_lookups_window"] = oldValues
+
+	def test_get_coalesced_mutated(self):
+		"""
+			Changes the first caller makes to its entity right away must not leak into the copies of the others
+		"""
+		key = datastore.Key(testKindName, "coalesced")
+		entity = datastore.Entity(key)
+		for x in range(500):
+			entity["value-%s" % x] = x
+		datastore.Put(entity)
+		origLookupBatch = datastore.transport._lookupBatch
+
+		def lookupBatch(keys, readOptions):
+			time.sleep(0.1)
+			return origLookupBatch(keys, readOptions)
+
+		results = []
+		errors = []
+
+		def owner():
+			entity = datastore.Get(key)
+			for x in range(500):
+				entity["changed-%s" % x] = x
+				del entity["value-%s" % x]
+
+		def waiter():
+			try:
+				results.append(datastore.Get(key))
+			except Exception as e:
+				errors.append(e)
+
+		oldValue = datastore.config["coalesce_lookups"]
+		datastore.transport._lookupBatch = lookupBatch
+		try:
+			datastore.config["coalesce_lookups"] = True
+			threads = [threading.Thread(target=owner)]
+			threads[0].start()
+			time.sleep(0.02)  # Let the owner start the lookup
+			threads += [threading.Thread(target=waiter) for _ in range(5)]
+			for thread in threads[1:]:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		finally:
+			datastore.transport._lookupBatch = origLookupBatch
+			datastore.config["coalesce_lookups"] = oldValue
+		self.assertEqual(errors, [])
+		self.assertEqual(len(results), 5)
+		self.assertTrue(all(result == entity for result in results))
+
+	def test_get_coalesced_interrupted(self):
+		"""
+			Keys queued by other threads are fetched even if the thread waiting for the window to end is interrupted
+		"""
+		keys = [datastore.Key(testKindName, "coalesced-%s" % x) for x in range(2)]
+		datastore.Put([datastore.Entity(key) for key in keys])
+		coalescer = datastore.transport._lookupCoalescer
+		origSleep = datastore.transport.sleep
+
+		def sleep(seconds):
+			for _ in range(100):  # Wait until the other thread queued its key
+				if len(coalescer._queued) == 2:
+					break
+				time.sleep(0.01)
+			raise TimeoutError()
+
+		results = {}
+
+		def worker(key):
+			try:
+				results[key] = datastore.Get(key)
+			except TimeoutError as e:
+				results[key] = e
+
+		oldValues = datastore.config["coalesce_lookups"], datastore.config["coalesce_lookups_window"]
+		datastore.transport.sleep = sleep
+		try:
+			datastore.config["coalesce_lookups"] = True
+			datastore.config["coalesce_lookups_window"] = 0.05
+			threads = [threading.Thread(target=worker, args=(key,), daemon=True) for key in keys]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join(5)
+			self.assertFalse(any(thread.is_alive() for thread in threads))
+			self.assertEqual(sum(isinstance(x, TimeoutError) for x in results.values()), 1)
+			self.assertEqual(sum(isinstance(x, datastore.Entity) for x in results.values()), 1)
+			self.assertEqual(coalescer._inFlight, {})
+			datastore.config["coalesce_lookups_window"] = 0
+			self.assertEqual([e.key for e in datastore.Get(keys)], keys)
+		finally:
+			datastore.transport.sleep = origSleep
+			datastore.config["coalesce_lookups"], datastore.config["coalesce_lookups_window"] = oldValues
+
+	def test_retry_unavailable(self):
+		"""
+			Reads answered with UNAVAILABLE are retried, commits are not (as they might have been applied)
+		"""
+		session = datastore.transport._getHttpSession()
+		failures = []
+
+		class UnavailableSession:
+			def post(self, url, data, **kwargs):
+				if len(failures) < 1:
+					failures.append(url)
+					resp = requests.Response()
+					resp.status_code = 503
+					resp._content = b'{"error": {"code": 503, "message": "Unavailable", "status": "UNAVAILABLE"}}'
+					return resp
+				return session.post(url=url, data=data, **kwargs)
+
+		datastore.transport._http_internal = UnavailableSession()
+		try:
+			self.assertIsNone(datastore.Get(datastore.Key(testKindName, "test-entity")))
+			self.assertTrue(failures[0].endswith(":lookup"))
+			failures.clear()
+			with self.assertRaises(datastore.errors.UnavailableError):
+				datastore.Put(datastore.Entity(datastore.Key(testKindName, "test-entity")))
+			self.assertGreaterEqual(datastore.transport.httpPoolStats()["retries"], 1)
+		finally:
+			datastore.transport._http_internal = session
+
+	def test_lookup_deferred_forever(self):
+		"""
+			Lookups give up if the datastore keeps deferring keys, instead of retrying forever
+		"""
+		lookups = []
+
+		class DeferringSession:
+			def post(self, url, data, **kwargs):
+				lookups.append(url)
+				resp = requests.Response()
+				resp.status_code = 200
+				resp._content = json.dumps({"deferred": json.loads(data)["keys"]}).encode("UTF-8")
+				return resp
+
+		session = datastore.transport._http_internal
+		oldValues = datastore.transport.LOOKUP_DEFERRED_MAX_RETRIES, datastore.transport.LOOKUP_DEFERRED_BACKOFF
+		datastore.transport._http_internal = DeferringSession()
+		try:
+			datastore.transport.LOOKUP_DEFERRED_MAX_RETRIES, datastore.transport.LOOKUP_DEFERRED_BACKOFF = 3, 0.001
+			with self.assertRaises(datastore.DeadlineExceededError):
+				datastore.Get(datastore.Key(testKindName, "test-entity"))
+			self.assertEqual(len(lookups), 4)
+		finally:
+			datastore.transport._http_internal = session
+			datastore.transport.LOOKUP_DEFERRED_MAX_RETRIES, datastore.transport.LOOKUP_DEFERRED_BACKOFF = oldValues
+
 	def test_key_init(self) -> None:
 		key = datastore.Key(testKindName, 42)
 		self.assertIsInstance(key.id, int)
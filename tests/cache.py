@@ -0,0 +1,240 @@
+import unittest
+from time import sleep
+from viur import datastore
+from viur.datastore import cache
+from .base import BaseTestClass, testKindName
+
+"""
+	Ensure the in-process cache tiers evict, expire and stay consistent with the datastore
+"""
+
+
+class InProcessCacheTest(unittest.TestCase):
+
+	def test_lru_eviction(self):
+		"""
+			The least recently used entry has to be evicted first
+		"""
+		localCache = cache.InProcessCache(max_entries=2)
+		localCache.set_multi({"a": 1, "b": 2})
+		self.assertEqual(localCache.get_multi(["a"]), {"a": 1})  # a is now the most recently used entry
+		localCache.set_multi({"c": 3})
+		self.assertEqual(localCache.get_multi(["a", "b", "c"]), {"a": 1, "c": 3})
+		stats = localCache.stats()
+		self.assertEqual((stats["hits"], stats["misses"], stats["evictions"]), (3, 1, 1))
+
+	def test_size_limit(self):
+		"""
+			The cache must not grow beyond max_bytes
+		"""
+		localCache = cache.InProcessCache(max_bytes=1000)
+		localCache.set_multi({str(x): "x" * 100 for x in range(100)})
+		self.assertLessEqual(localCache.stats()["bytes"], 1000)
+		self.assertGreater(localCache.stats()["evictions"], 0)
+
+	def test_expiry(self):
+		"""
+			Expired entries are neither returned nor kept
+		"""
+		localCache = cache.InProcessCache()
+		localCache.set_multi({"a": 1}, time=1)
+		localCache.set_multi({"b": 2}, time=100)
+		sleep(1.1)
+		self.assertEqual(localCache.get_multi(["a", "b"]), {"b": 2})
+		localCache = cache.InProcessCache()
+		localCache.set_multi({"a": 1}, time=1)
+		sleep(1.1)
+		localCache.set_multi({"c": 3})  # Writing drops the expired entry, even if it's never read again
+		self.assertEqual(localCache.stats()["entries"], 1)
+
+	def test_mixed_expiry(self):
+		"""
+			Expired entries are dropped on writes, even if entries with a longer timeout have been written before them
+		"""
+		localCache = cache.InProcessCache()
+		localCache.set_multi({"a": 1}, time=100)
+		localCache.set_multi({"b": 2, "c": 3}, time=1)
+		localCache.set_multi({"c": 4}, time=100)  # Overwriting c extends its lifetime
+		sleep(1.1)
+		localCache.set_multi({"d": 5})
+		self.assertEqual(localCache.stats()["entries"], 3)
+		self.assertEqual(localCache.stats()["expirations"], 1)
+		self.assertEqual(localCache.get_multi(["a", "b", "c", "d"]), {"a": 1, "c": 4, "d": 5})
+
+	def test_tiered(self):
+		"""
+			Entries found in the shared tier are copied to the local one
+		"""
+		shared = cache.LocalMemcache()
+		tieredCache = cache.TieredCache(cache.InProcessCache(), shared)
+		shared.set_multi({"a": 1})
+		self.assertEqual(tieredCache.get_multi(["a", "b"]), {"a": 1})
+		self.assertEqual(tieredCache.local.get_multi(["a"]), {"a": 1})
+		tieredCache.delete_multi(["a"])
+		self.assertEqual(shared.get_multi(["a"]), {})
+		self.assertEqual(tieredCache.get_multi(["a"]), {})
+
+
+class CacheEntryTest(unittest.TestCase):
+
+	def setUp(self) -> None:
+		self.oldMemcacheClient = datastore.config["memcache_client"]
+		datastore.config["memcache_client"] = cache.InProcessCache()
+		self.entity = datastore.Entity(datastore.Key(testKindName, "test-entity"))
+		self.entity["intVal"] = 1
+
+	def tearDown(self) -> None:
+		datastore.config["memcache_client"] = self.oldMemcacheClient
+
+	def test_missing(self):
+		"""
+			Keys cached as missing are only returned if requested, and replaced by entities put later on
+		"""
+		cacheKey = self.entity.key.cache_key
+		cache.put_missing(self.entity.key)
+		self.assertEqual(cache.get(self.entity.key), {})
+		self.assertEqual(cache.get(self.entity.key, include_missing=True), {cacheKey: None})
+		cache.put(self.entity)
+		self.assertEqual(cache.get(self.entity.key, include_missing=True)[cacheKey]["intVal"], 1)
+
+	def test_jittered_timeout(self):
+		"""
+			Timeouts are shortened by at most MEMCACHE_TIMEOUT_JITTER
+		"""
+		timeouts = {cache.jittered_timeout(1000) for _ in range(100)}
+		self.assertGreater(len(timeouts), 1)
+		self.assertTrue(all(1000 * (1 - cache.MEMCACHE_TIMEOUT_JITTER) <= x <= 1000 for x in timeouts))
+
+	def test_early_refresh(self):
+		"""
+			Entries that are expensive to fetch are refreshed (reported as not found) early
+		"""
+		cache.put(self.entity, fetch_time=0)
+		self.assertIn(self.entity.key.cache_key, cache.get(self.entity.key))
+		cache.put(self.entity, fetch_time=10 ** 9)
+		self.assertEqual(cache.get(self.entity.key), {})
+		self.assertEqual(datastore.config["memcache_client"].stats()["entries"], 1)
+
+	def test_legacy_urlsafe(self):
+		"""
+			Keys passed as legacy urlsafe strings refer to the entries of these keys
+		"""
+		cache.put(self.entity)
+		with self.assertLogs(level="WARNING"):
+			self.assertIn(self.entity.key.cache_key, cache.get(str(self.entity.key)))
+			cache.delete(str(self.entity.key))
+		self.assertEqual(cache.get(self.entity.key), {})
+		self.assertEqual(cache.to_cache_key("someEntry"), "someEntry")
+
+
+class CacheKeyTest(unittest.TestCase):
+
+	def test_unique(self):
+		"""
+			Different keys must never share the same cache key
+		"""
+		keys = [
+			datastore.Key(testKindName, 1),
+			datastore.Key(testKindName, "1a"),
+			datastore.Key(testKindName, "a#1"),
+			datastore.Key(testKindName, "a/b"),
+			datastore.Key(testKindName, "b", parent=datastore.Key(testKindName, "a")),
+			datastore.Key("%s#1" % testKindName),
+			datastore.Key(testKindName, "x:y"),
+			datastore.Key("%s:x" % testKindName, "y"),
+		]
+		self.assertEqual(len({key.cache_key for key in keys}), len(keys))
+		self.assertEqual(datastore.Key(testKindName, 1).cache_key, datastore.Key(testKindName, 1).cache_key)
+
+	def test_memoized(self):
+		"""
+			The memoized cache key must follow changes to the key and its parents
+		"""
+		parent = datastore.Key(testKindName, "parent")
+		key = datastore.Key(testKindName, 1, parent=parent)
+		cacheKey = key.cache_key
+		parent.name = "otherParent"
+		self.assertNotEqual(key.cache_key, cacheKey)
+		key.kind = "otherKind"
+		self.assertEqual(key.cache_key, "%s:otherParent/otherKind#1" % testKindName)
+		key.id = 2
+		self.assertEqual(key.cache_key, "%s:otherParent/otherKind#2" % testKindName)
+		key.parent = None
+		self.assertEqual(key.cache_key, "otherKind#2")
+
+
+class CacheConsistencyTest(BaseTestClass):
+
+	def setUp(self) -> None:
+		super().setUp()
+		self.oldMemcacheClient = datastore.config["memcache_client"]
+		datastore.config["memcache_client"] = cache.InProcessCache()
+
+	def tearDown(self) -> None:
+		datastore.config["memcache_client"] = self.oldMemcacheClient
+		super().tearDown()
+
+	def test_put_delete(self):
+		"""
+			Put and Delete must update the cache
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity"))
+		entity["intVal"] = 1
+		datastore.Put(entity)
+		self.assertEqual(datastore.Get(entity.key)["intVal"], 1)
+		entity["intVal"] = 2
+		datastore.Put(entity)
+		self.assertEqual(datastore.Get(entity.key)["intVal"], 2)
+		datastore.Delete(entity.key)
+		self.assertIsNone(datastore.Get(entity.key))
+
+	def test_transaction(self):
+		"""
+			Changes made inside a transaction must be visible after it has been committed
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity"))
+		entity["intVal"] = 1
+		datastore.Put(entity)
+		self.assertEqual(datastore.Get(entity.key)["intVal"], 1)
+
+		def txn():
+			txnEntity = datastore.Get(entity.key)
+			txnEntity["intVal"] = 2
+			datastore.Put(txnEntity)
+
+		datastore.RunInTransaction(txn)
+		self.assertEqual(datastore.Get(entity.key)["intVal"], 2)
+
+	def test_negative_caching(self):
+		"""
+			Keys that haven't been found are only looked up once, until they're written
+		"""
+		lookups = []
+		origLookupBatch = datastore.transport._lookupBatch
+
+		def lookupBatch(keys, readOptions):
+			lookups.append(keys)
+			return origLookupBatch(keys, readOptions)
+
+		key = datastore.Key(testKindName, "test-entity")
+		datastore.transport._lookupBatch = lookupBatch
+		try:
+			self.assertIsNone(datastore.Get(key))
+			self.assertEqual(datastore.Get([key]), [None])
+			self.assertEqual(len(lookups), 1)
+			entity = datastore.Entity(key)
+			entity["intVal"] = 1
+			datastore.Put(entity)
+			self.assertEqual(datastore.Get(key)["intVal"], 1)
+		finally:
+			datastore.transport._lookupBatch = origLookupBatch
+
+	def test_returned_copies(self):
+		"""
+			Modifying a cached entity must not modify the cache
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity"))
+		entity["intVal"] = 1
+		datastore.Put(entity)
+		datastore.Get(entity.key)["intVal"] = 2
+		self.assertEqual(datastore.Get(entity.key)["intVal"], 1)
@@ -0,0 +1,52 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from viur import datastore
+from viur.datastore import codec
+from .base import datastoreSampleValues, testKindName
+
+"""
+	Ensure the binary serialization used by the cache round-trips all supported values
+"""
+
+
+class CodecTest(unittest.TestCase):
+
+	def test_roundtrip(self):
+		"""
+			Each sample value must be decoded to the value that has been encoded
+		"""
+		for k, v in datastoreSampleValues.items():
+			self.assertEqual(codec.decode(codec.encode(v)), v, k)
+
+	def test_entity_metadata(self):
+		"""
+			Key, version and the excluded properties of entities must be preserved
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity", parent=datastore.Key(testKindName, 42)))
+		entity.update(datastoreSampleValues)
+		entity.version = "1234"
+		entity.exclude_from_indexes = {"strTypeAscii"}
+		entity2 = codec.decode(codec.encode(entity))
+		self.assertIsInstance(entity2, datastore.Entity)
+		self.assertEqual(entity2, entity)
+		self.assertEqual(entity2.key, entity.key)
+		self.assertEqual(entity2.version, "1234")
+		self.assertEqual(entity2.exclude_from_indexes, {"strTypeAscii"})
+
+	def test_datetime_to_utc(self):
+		"""
+			Datetimes are returned in UTC, as the datastore does
+		"""
+		value = datetime(2023, 5, 15, 12, 30, 15, 123456, tzinfo=timezone(timedelta(hours=2)))
+		decoded = codec.decode(codec.encode(value))
+		self.assertEqual(decoded, value)
+		self.assertEqual(decoded.tzinfo, timezone.utc)
+
+	def test_unsupported(self):
+		"""
+			Values the datastore can't store must be refused
+		"""
+		with self.assertRaises(TypeError):
+			codec.encode({"a": object()})
+		with self.assertRaises(ValueError):
+			codec.decode(b"\x00")
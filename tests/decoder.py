@@ -0,0 +1,122 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from viur import datastore
+from viur.datastore import transport
+from .base import datastoreSampleValues, testKindName
+
+"""
+	Ensure values returned by the rest API are decoded correctly
+"""
+
+
+class DecoderTest(unittest.TestCase):
+
+	def test_timestamp(self):
+		"""
+			Timestamps as returned by the datastore, with and without fractional seconds
+		"""
+		self.assertEqual(transport.parseTimestamp("2023-05-15T12:30:15.123456Z"),
+						 datetime(2023, 5, 15, 12, 30, 15, 123456, tzinfo=timezone.utc))
+		self.assertEqual(transport.parseTimestamp("2023-05-15T12:30:15Z"),
+						 datetime(2023, 5, 15, 12, 30, 15, tzinfo=timezone.utc))
+		self.assertEqual(transport.parseTimestamp("0001-01-01T00:00:00Z"),
+						 datetime(1, 1, 1, tzinfo=timezone.utc))
+		self.assertEqual(transport.parseTimestamp("9999-12-31T23:59:59.999999Z"),
+						 datetime(9999, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc))
+		self.assertIs(transport.parseTimestamp("2023-05-15T12:30:15Z").tzinfo, timezone.utc)
+
+	def test_timestamp_fraction(self):
+		"""
+			Fractional seconds of any length are truncated to microseconds
+		"""
+		for fraction, microsecond in [("1", 100000), ("12", 120000), ("123", 123000), ("123456", 123456),
+									  ("1234567", 123456), ("123456789", 123456), ("000000001", 0)]:
+			self.assertEqual(transport.parseTimestamp("2023-05-15T12:30:15.%sZ" % fraction).microsecond, microsecond)
+
+	def test_timestamp_offset(self):
+		"""
+			Timestamps with an offset are converted to UTC
+		"""
+		self.assertEqual(transport.parseTimestamp("2023-05-15T12:30:15+02:00"),
+						 datetime(2023, 5, 15, 10, 30, 15, tzinfo=timezone.utc))
+		self.assertEqual(transport.parseTimestamp("2023-05-15T23:30:15.5-05:30"),
+						 datetime(2023, 5, 16, 5, 0, 15, 500000, tzinfo=timezone.utc))
+		self.assertEqual(transport.parseTimestamp("2023-05-15t12:30:15z"),
+						 datetime(2023, 5, 15, 12, 30, 15, tzinfo=timezone.utc))
+
+	def test_timestamp_roundtrip(self):
+		"""
+			Timestamps written by us must be read back unchanged
+		"""
+		value = datetime(2023, 5, 15, 12, 30, 15, 123456, tzinfo=timezone(timedelta(hours=-3)))
+		encoded = json.loads(transport.encodeValue(value))["timestampValue"]
+		self.assertEqual(transport.parseTimestamp(encoded), value)
+
+	def test_timestamp_invalid(self):
+		for value in ["", "2023-05-15", "2023-05-15T12:30:15", "2023-05-15T12:30:15.Z", "2023-05-15T12:30:15ZZ",
+					  "2023-05-15T12:30:15+0200", "2023-05-1xT12:30:15Z", "2023-13-15T12:30:15Z",
+					  "2023-02-30T00:00:00Z", "2023-05-15T12:30:15+ab:00"]:
+			with self.assertRaises(ValueError, msg=value):
+				transport.parseTimestamp(value)
+
+	def test_roundtrip(self):
+		"""
+			Each sample value must be decoded to the value that has been encoded
+		"""
+		for k, v in datastoreSampleValues.items():
+			self.assertEqual(transport.decodeValue(transport.encodeValue(v)), v, k)
+
+	def test_entity(self):
+		"""
+			Key and excluded properties of entities, including embedded ones
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity", parent=datastore.Key(testKindName, 42)))
+		entity.update(datastoreSampleValues)
+		entity["dictType"] = {"a": datastore.Entity(), "b": [1, {"c": 2}]}
+		entity.exclude_from_indexes = {"strTypeAscii", "listType", "dictType"}
+		entity2 = transport.decodeValue(transport.encodeValue(entity))
+		self.assertIsInstance(entity2, datastore.Entity)
+		self.assertEqual(entity2, entity)
+		self.assertEqual(entity2.key, entity.key)
+		self.assertEqual(entity2.exclude_from_indexes, entity.exclude_from_indexes)
+		self.assertIsNone(entity2["dictType"].key)
+
+	def test_list_excluded(self):
+		"""
+			A list is excluded from indexing only if all of its values are
+		"""
+		entity = transport.decodeValue(json.dumps({"entityValue": {"properties": {
+			"all": {"arrayValue": {"values": [{"integerValue": "1", "excludeFromIndexes": True},
+											  {"stringValue": "a", "excludeFromIndexes": True}]}},
+			"some": {"arrayValue": {"values": [{"integerValue": "1", "excludeFromIndexes": True},
+											   {"stringValue": "a"}]}},
+			"none": {"arrayValue": {"values": [{"integerValue": "1"}]}},
+			"scalar": {"excludeFromIndexes": True, "integerValue": "1"},
+		}}}).encode())
+		self.assertEqual(entity, {"all": [1, "a"], "some": [1, "a"], "none": [1], "scalar": 1})
+		self.assertEqual(entity.exclude_from_indexes, {"all", "scalar"})
+
+	def test_property_names_shared(self):
+		"""
+			Entities decoded from the same response share the strings of their property names
+		"""
+		entities = []
+		for idx in range(3):
+			entity = datastore.Entity(datastore.Key(testKindName, idx + 1))
+			entity["name"] = "entity %s" % idx
+			entity["nested"] = {"inner": idx}
+			entities.append(entity)
+		entities[1] = datastore.Entity(entities[1].key)
+		entities[1].update({"nested": {"inner": 1}, "name": "entity 1"})  # Different order
+		decoded = transport.decodeValue(transport.encodeValue(entities))
+		self.assertEqual(decoded, entities)
+		names = [{name: name for name in entity} for entity in decoded]
+		for idx in (1, 2):
+			self.assertIs(names[idx]["name"], names[0]["name"])
+			self.assertIs(names[idx]["nested"], names[0]["nested"])
+			self.assertIs(next(iter(decoded[idx]["nested"])), next(iter(decoded[0]["nested"])))
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			transport.decodeValue(b'{"unknownValue": 1}')
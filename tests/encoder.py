@@ -0,0 +1,200 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
+from viur import datastore
+from viur.datastore import transport
+from viur.datastore.transport import pythonPropToJson, keyToPath
+from .base import datastoreSampleValues, testKindName
+
+"""
+	Ensure the direct JSON encoder produces exactly the same request bodies as json.dumps() of the dictionaries
+	built by pythonPropToJson / keyToPath.
+"""
+
+
+def dumps(obj) -> bytes:
+	return json.dumps(obj).encode("UTF-8")
+
+
+def keyJson(key):
+	return {"partitionId": {"project_id": transport.projectID}, "path": keyToPath(key)}
+
+
+def filterJson(filters):
+	filterList = []
+	for k, v in filters.items():
+		key, op = k.split(" ")
+		op = {"=": "EQUAL", "<": "LESS_THAN", "<=": "LESS_THAN_OR_EQUAL", ">": "GREATER_THAN",
+			  ">=": "GREATER_THAN_OR_EQUAL"}[op]
+		for singleValue in (v if isinstance(v, list) else [v]):
+			filterList.append({
+				"propertyFilter": {"property": {"name": key}, "op": op, "value": pythonPropToJson(singleValue)}
+			})
+	if len(filterList) == 1:
+		return filterList[0]
+	return {"compositeFilter": {"op": "AND", "filters": filterList}}
+
+
+class Color(IntEnum):
+	red = 1
+
+
+class EncoderTest(unittest.TestCase):
+
+	def assertSameEncoding(self, value):
+		self.assertEqual(transport.encodeValue(value), dumps(pythonPropToJson(value)), repr(value))
+
+	def test_sample_values(self):
+		"""
+			Each sample value must be encoded exactly like json.dumps(pythonPropToJson(value))
+		"""
+		for k, v in datastoreSampleValues.items():
+			self.assertSameEncoding(v)
+
+	def test_strings(self):
+		"""
+			Escaping must match json.dumps with ensure_ascii
+		"""
+		for value in ["", "plain", 'quote " and backslash \\', "\x00\x01\x1f\x7f", "\b\f\n\r\t", "/<>&'",
+					  "öäüß", "€ and  ", "\U0001F600 emoji", "\ud800 lone surrogate", "mixed \x7f ö \U0001F600",
+					  "x" * 10000]:
+			self.assertSameEncoding(value)
+
+	def test_numbers(self):
+		"""
+			Integers of any size, int subclasses and special floats
+		"""
+		for value in [0, 1, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 64, -2 ** 70, Color.red,
+					  0.0, -0.0, 1.5, 1e16, 1e300, 1e-300, 123456789.123456789, float("nan"), float("inf"),
+					  float("-inf")]:
+			self.assertSameEncoding(value)
+
+	def test_datetimes(self):
+		self.assertSameEncoding(datetime(2023, 5, 15, 12, 30, 15, 123456, tzinfo=timezone(timedelta(hours=2))))
+		self.assertSameEncoding(datetime(1, 1, 1, tzinfo=timezone.utc))
+
+	def test_keys(self):
+		key = datastore.Key(testKindName, 123, parent=datastore.Key("parent-kind", "ö-name"))
+		self.assertSameEncoding(key)
+		self.assertSameEncoding(datastore.Key(testKindName))
+		self.assertSameEncoding(datastore.Key(testKindName, parent=key))
+
+	def test_entities(self):
+		"""
+			Nested entities, dicts and lists, with and without excluded properties
+		"""
+		entity = datastore.Entity(datastore.Key(testKindName, "test-entity"))
+		entity.update(datastoreSampleValues)
+		entity["emptyList"] = []
+		entity["nestedList"] = [[1, 2], ["a", None]]
+		entity["dictType"] = {"a": 1, "b": [datastore.Entity(), {"c": b"\xff"}]}
+		entity.exclude_from_indexes = {"strTypeAscii", "listType", "emptyList", "dictType", "unknown"}
+		self.assertSameEncoding(entity)
+		self.assertSameEncoding(datastore.Entity())
+		self.assertSameEncoding({})
+
+	def test_unsupported(self):
+		with self.assertRaises(AssertionError):
+			transport.encodeValue(object())
+		with self.assertRaises(AssertionError):
+			transport.encodeValue([1, {"a": set()}])
+		# The buffer must be usable again after an error
+		self.assertSameEncoding("test")
+
+	def test_commit(self):
+		entities = [datastore.Entity(datastore.Key(testKindName, x)) for x in range(1, 4)]
+		for entity in entities:
+			entity.update(datastoreSampleValues)
+		keys = [datastore.Key(testKindName, "a"), datastore.Key(testKindName, 5)]
+		mutations = [transport.encodeUpsertMutation(x) for x in entities]
+		mutations += [transport.encodeDeleteMutation(x) for x in keys]
+		expectedMutations = [{"upsert": pythonPropToJson(x)["entityValue"]} for x in entities]
+		expectedMutations += [{"delete": pythonPropToJson(x)["keyValue"]} for x in keys]
+		self.assertEqual(
+			transport.encodeCommitRequest("NON_TRANSACTIONAL", mutations),
+			dumps({"mode": "NON_TRANSACTIONAL", "mutations": expectedMutations})
+		)
+		self.assertEqual(
+			transport.encodeCommitRequest("TRANSACTIONAL", mutations, "txn-key=="),
+			dumps({"mode": "TRANSACTIONAL", "transaction": "txn-key==", "mutations": expectedMutations})
+		)
+		self.assertEqual(
+			transport.encodeCommitRequest("NON_TRANSACTIONAL", []),
+			dumps({"mode": "NON_TRANSACTIONAL", "mutations": []})
+		)
+
+	def test_lookup(self):
+		keys = [datastore.Key(testKindName, x) for x in range(1, 300)]
+		keys.append(datastore.Key(testKindName, "name", parent=datastore.Key(testKindName, 1)))
+		for readOptions in [{"readConsistency": "STRONG"}, {"transaction": "txn-key=="}]:
+			self.assertEqual(
+				transport.encodeLookupRequest(keys, readOptions),
+				dumps({"readOptions": readOptions, "keys": [keyJson(x) for x in keys]})
+			)
+		self.assertEqual(
+			transport.encodeAllocateIdsRequest(keys[:3]),
+			dumps({"keys": [keyJson(x) for x in keys[:3]]})
+		)
+
+	def test_run_query(self):
+		"""
+			Queries with filters, orders, distinct, projections and cursors
+		"""
+		readOptions = {"readConsistency": "STRONG"}
+		queries = [
+			datastore.QueryDefinition(testKindName, {}, []),
+			datastore.QueryDefinition(testKindName, {"intType =": 5}, []),
+			datastore.QueryDefinition(testKindName, {"listType =": [1, "a"], "intType >=": 3.5, "a <": None},
+									  [("intType", datastore.SortOrder.Descending),
+									   ("__key__", datastore.SortOrder.InvertedDescending)]),
+			datastore.QueryDefinition(testKindName, {"keyType =": datastore.Key(testKindName, 1)},
+									  [("x", datastore.SortOrder.InvertedAscending)], distinct=["x", "y"],
+									  startCursor="start==", endCursor="end=="),
+			datastore.QueryDefinition(None, {"x =": []}, []),
+			datastore.QueryDefinition(testKindName, {"x =": 1}, [("y", datastore.SortOrder.Ascending)],
+									  projection=["y", "z"]),
+			datastore.QueryDefinition(testKindName, {}, [], projection=[datastore.KEY_SPECIAL_PROPERTY]),
+		]
+		for queryDefinition in queries:
+			for startCursor in [None, "internal=="]:
+				expected = {
+					"partitionId": {"project_id": transport.projectID},
+					"readOptions": readOptions,
+					"query": {"kind": [{"name": queryDefinition.kind}], "limit": 42},
+				}
+				if queryDefinition.filters:
+					expected["query"]["filter"] = filterJson(queryDefinition.filters)
+				if queryDefinition.orders:
+					expected["query"]["order"] = [{
+						"property": {"name": sortOrder[0]},
+						"direction": "ASCENDING" if sortOrder[1].value in [1, 4] else "DESCENDING"
+					} for sortOrder in queryDefinition.orders]
+				if queryDefinition.distinct:
+					expected["query"]["distinctOn"] = [{"name": x} for x in queryDefinition.distinct]
+				if queryDefinition.projection:
+					expected["query"]["projection"] = [{"property": {"name": x}} for x in queryDefinition.projection]
+				if startCursor or queryDefinition.startCursor:
+					expected["query"]["startCursor"] = startCursor or queryDefinition.startCursor
+				if queryDefinition.endCursor:
+					expected["query"]["endCursor"] = queryDefinition.endCursor
+				self.assertEqual(
+					transport.encodeRunQueryRequest(queryDefinition, 42, readOptions, startCursor),
+					dumps(expected)
+				)
+		with self.assertRaises(ValueError):
+			transport.encodeRunQueryRequest(datastore.QueryDefinition(testKindName, {"x !=": 1}, []), 1, readOptions)
+
+	def test_count(self):
+		for queryDefinition in [None, datastore.QueryDefinition(testKindName, {}, []),
+								datastore.QueryDefinition(testKindName, {"a =": 1, "b >": "x"}, [])]:
+			expected = {
+				"partitionId": {"project_id": transport.projectID},
+				"aggregation_query": {
+					"aggregations": {"count": {"up_to": 2 ** 63 - 1}},
+					"nested_query": {"kind": [{"name": testKindName}]}
+				},
+			}
+			if queryDefinition and queryDefinition.filters:
+				expected["aggregation_query"]["nested_query"]["filter"] = filterJson(queryDefinition.filters)
+			self.assertEqual(transport.encodeCountRequest(testKindName, 2 ** 63 - 1, queryDefinition), dumps(expected))
@@ -0,0 +1,91 @@
+import threading
+import unittest
+from viur import datastore
+from viur.datastore import fake, transport
+
+"""
+	Ensure the in-memory FakeDatastore answers the requests of the transport like the datastore would,
+	so that benchmarks run against it exercise the same code paths.
+"""
+
+testKindName = "test-kind"
+
+
+class FakeDatastoreTest(unittest.TestCase):
+
+	def setUp(self) -> None:
+		super().setUp()
+		self.oldSession = transport._http_internal
+		self.backend = fake.FakeDatastore(max_lookup_results=2, query_batch_size=3)
+		transport.setBackend(self.backend)
+
+	def tearDown(self) -> None:
+		super().tearDown()
+		transport.setBackend(self.oldSession)
+
+	def _putEntities(self, count):
+		entities = []
+		for x in range(count):
+			entity = datastore.Entity(datastore.Key(testKindName, "entity-%s" % x))
+			entity["value"] = x
+			entities.append(entity)
+		datastore.Put(entities)
+		return entities
+
+	def test_lookup_deferred(self):
+		"""
+			Keys the backend deferred are looked up again until all of them are answered
+		"""
+		entities = self._putEntities(5)
+		keys = [e.key for e in entities] + [datastore.Key(testKindName, "missing")]
+		self.backend.requests.clear()
+		res = datastore.Get(keys)
+		self.assertEqual([e["value"] for e in res[:5]], list(range(5)))
+		self.assertIsNone(res[5])
+		self.assertEqual(self.backend.requests["lookup"], 3)
+
+	def test_query_batches(self):
+		"""
+			Queries spanning several batches and cursors return each entity exactly once, in order
+		"""
+		self._putEntities(10)
+		query = datastore.Query(testKindName).filter("value >=", 2).order(("value", datastore.SortOrder.Descending))
+		self.assertEqual([e["value"] for e in query.run(20)], list(range(9, 1, -1)))
+		query = datastore.Query(testKindName).order("value")
+		values = [e["value"] for e in query.run(4)]
+		query = datastore.Query(testKindName).order("value").setCursor(query.getCursor())
+		values += [e["value"] for e in query.run(4)]
+		self.assertEqual(values, list(range(8)))
+		self.assertEqual(datastore.Count(testKindName), 10)
+		self.assertEqual(datastore.Count(testKindName, 4), 4)
+
+	def test_transaction_conflict(self):
+		"""
+			A transaction conflicting with a concurrent write is aborted and retried
+		"""
+		key = self._putEntities(1)[0].key
+		attempts = []
+
+		def increment():
+			entity = datastore.Get(key)
+			if not attempts:  # Another thread changes the entity after we've read it
+				thread = threading.Thread(target=lambda: datastore.Put(entity))
+				thread.start()
+				thread.join()
+			attempts.append(entity["value"])
+			entity["value"] += 1
+			datastore.Put(entity)
+
+		oldSleep = transport.sleep
+		transport.sleep = lambda seconds: None  # Don't wait for the backoff
+		try:
+			datastore.RunInTransaction(increment)
+		finally:
+			transport.sleep = oldSleep
+		self.assertEqual(len(attempts), 2)
+		self.assertEqual(datastore.Get(key)["value"], 1)
+		self.assertEqual(self.backend.requests["rollback"], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
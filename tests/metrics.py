@@ -0,0 +1,202 @@
+import asyncio
+import unittest
+from viur import datastore
+from viur.datastore import aio, metrics, utils
+from .base import BaseTestClass, testKindName
+
+"""
+	Ensure the calls of the transport functions are measured and reported to config["metrics_sink"]
+"""
+
+
+class MetricsTest(BaseTestClass):
+
+	def setUp(self) -> None:
+		super().setUp()
+		self.collector = metrics.MetricsCollector()
+		datastore.config["metrics_sink"] = self.collector
+
+	def tearDown(self) -> None:
+		datastore.config["metrics_sink"] = None
+		datastore.config["memcache_client"] = None
+		super().tearDown()
+
+	def test_collector(self):
+		"""
+			Each call is reported with its requests, payload sizes and entities, labeled by operation and kind
+		"""
+		entities = []
+		for x in range(5):
+			entity = datastore.Entity(datastore.Key(testKindName, "entity-%s" % x))
+			entity["value"] = x
+			entities.append(entity)
+		datastore.Put(entities)
+		datastore.Get([e.key for e in entities])
+		self.assertEqual(len(datastore.Query(testKindName).run(10)), 5)
+		totals = self.collector.snapshot()
+		for operation in ["Put", "Get", "runSingleFilter"]:
+			values = totals[(operation, testKindName)]
+			self.assertEqual(values["calls"], 1)
+			self.assertEqual(values["errors"], 0)
+			self.assertEqual(values["requests"], 1)
+			self.assertEqual(values["entities"], 5)
+			self.assertGreater(values["request_bytes"], 0)
+			self.assertGreater(values["response_bytes"], 0)
+			self.assertGreater(values["network_time"], 0)
+			self.assertGreaterEqual(values["duration"], values["network_time"])
+		self.collector.reset()
+		self.assertEqual(self.collector.snapshot(), {})
+
+	def test_cache_hits(self):
+		"""
+			Keys served from the cache are counted as hits and cause no requests
+		"""
+		datastore.config["memcache_client"] = datastore.cache.LocalMemcache()
+		keys = [datastore.Key(testKindName, "entity-%s" % x) for x in range(3)]
+		datastore.Put(datastore.Entity(keys[0]))
+		datastore.Get(keys)
+		values = self.collector.snapshot()[("Get", testKindName)]
+		self.assertEqual((values["cache_hits"], values["cache_misses"], values["requests"]), (1, 2, 1))
+		datastore.Get(keys)
+		values = self.collector.snapshot()[("Get", testKindName)]
+		self.assertEqual((values["cache_hits"], values["cache_misses"], values["requests"]), (4, 2, 1))
+
+	def test_errors(self):
+		"""
+			Failed calls are reported with their exception, and failing sinks don't break any calls
+		"""
+		reported = []
+		datastore.config["metrics_sink"] = reported.append
+		with self.assertRaises(datastore.InvalidArgumentError):
+			datastore.Get(datastore.Key(testKindName))
+		self.assertEqual(reported[0].operation, "Get")
+		self.assertEqual(reported[0].error, "InvalidArgumentError")
+
+		def failingSink(metrics):
+			raise ValueError()
+
+		datastore.config["metrics_sink"] = failingSink
+		with self.assertLogs(level="ERROR"):
+			self.assertIsNone(datastore.Get(datastore.Key(testKindName, "test-entity")))
+
+	def test_buffered_writes(self):
+		"""
+			The commits of buffered writes are reported when the buffer is flushed
+		"""
+		with utils.bufferedWrites():
+			for x in range(3):
+				datastore.Put(datastore.Entity(datastore.Key(testKindName, "entity-%s" % x)))
+			datastore.Delete(datastore.Key(testKindName, "entity-3"))
+		totals = self.collector.snapshot()
+		self.assertEqual(totals[("Put", testKindName)]["requests"], 0)
+		values = totals[("Commit", testKindName)]
+		self.assertEqual((values["calls"], values["requests"], values["entities"]), (1, 1, 4))
+		self.assertGreater(values["network_time"], 0)
+
+	def test_aio_transaction(self):
+		"""
+			Transactions run by viur.datastore.aio are reported like the blocking ones, including their commit
+		"""
+		key = datastore.Key(testKindName, "test-entity")
+
+		async def txn():
+			await aio.Put(datastore.Entity(key))
+
+		asyncio.run(aio.RunInTransaction(txn))
+		values = self.collector.snapshot()[("RunInTransaction", None)]
+		self.assertEqual((values["calls"], values["errors"], values["requests"]), (1, 0, 2))
+		self.assertEqual(values["entities"], 1)
+		self.assertEqual(self.collector.snapshot()[("Put", testKindName)]["calls"], 1)
+
+
+class ProfilingTest(BaseTestClass):
+
+	def tearDown(self) -> None:
+		datastore.endProfiling()
+		super().tearDown()
+
+	def test_profile(self):
+		"""
+			The profile sums up round trips, reads and writes and reports slow and repeated queries and lookups
+		"""
+		datastore.startProfiling(slow_queries=2)
+		keys = [datastore.Key(testKindName, "entity-%s" % x) for x in range(6)]
+		datastore.Put([datastore.Entity(key) for key in keys])
+		for key in keys:  # An N+1 pattern
+			datastore.Get(key)
+		for x in range(3):
+			datastore.Query(testKindName).run(10)
+		datastore.Count(testKindName)
+
+		def txn():
+			entity = datastore.Get(keys[0])
+			entity["value"] = 1
+			datastore.Put(entity)
+
+		datastore.RunInTransaction(txn)
+		profile = datastore.endProfiling()
+		self.assertIsNone(metrics.currentProfile.get())
+		self.assertEqual(profile.rpcs["lookup"], 7)
+		self.assertEqual(profile.rpcs["runQuery"], 3)
+		self.assertEqual(profile.rpcs["commit"], 2)
+		self.assertEqual(profile.rpcs["beginTransaction"], 1)
+		self.assertEqual(profile.entities_read, 6 + 18 + 1)
+		self.assertEqual(profile.entities_written, 7)
+		self.assertEqual(profile.index_entries, 6)
+		self.assertEqual(len(profile.slowestQueries()), 2)
+		repeated = profile.repeatedCalls(threshold=3)
+		self.assertEqual(repeated[("Get", testKindName)], 7)
+		self.assertEqual(repeated[("query", testKindName, (), ())], 3)
+		summary = profile.summary()
+		self.assertEqual(summary["calls"], 14)
+		self.assertIsNone(summary["cache_hit_ratio"])
+		self.assertIn("Repeated 7 times", str(profile))
+
+	def test_buffered_writes(self):
+		"""
+			Flushing buffered writes is part of the profile, and the entities committed count as written
+		"""
+		datastore.startProfiling()
+		with utils.bufferedWrites():
+			for x in range(3):
+				datastore.Put(datastore.Entity(datastore.Key(testKindName, "entity-%s" % x)))
+		profile = datastore.endProfiling()
+		self.assertEqual(profile.rpcs["commit"], 1)
+		self.assertEqual(profile.entities_written, 3)
+		self.assertEqual(profile.calls[("Commit", testKindName)], 1)
+		self.assertGreater(profile.duration, 0)
+
+	def test_failing_profile(self):
+		"""
+			Queries without orders are profiled, and failing to record a call in the profile doesn't break it
+		"""
+		datastore.startProfiling()
+		profile = metrics.currentProfile.get()
+		datastore.transport.runSingleFilter(datastore.QueryDefinition(testKindName, {}, None), 10)
+		self.assertEqual(len(profile.slowestQueries()), 1)
+
+		def failingRecord(metrics):
+			raise ValueError()
+
+		profile.record = failingRecord
+		with self.assertLogs(level="ERROR"):
+			self.assertIsNone(datastore.Get(datastore.Key(testKindName, "test-entity")))
+
+	def test_nested(self):
+		"""
+			Nested profiles are added to the outer one when they end
+		"""
+		key = datastore.Key(testKindName, "test-entity")
+		outer = datastore.startProfiling()
+		datastore.Get(key)
+		inner = datastore.startProfiling()
+		datastore.Get(key)
+		innerProfile = datastore.endProfiling(inner)
+		self.assertEqual(innerProfile.rpcs["lookup"], 1)
+		outerProfile = datastore.endProfiling(outer)
+		self.assertEqual(outerProfile.rpcs["lookup"], 2)
+		self.assertIsNone(metrics.currentProfile.get())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -144,3 +144,64 @@ class QueryCustomFunctionsTest(BaseTestClass):
 		qry = datastore.Query(testKindName).filter("intVal >", 9)
 		self.assertEqual(qry.count(), 0)
 		self.assertEqual(datastore.Query(testKindName).count(up_to=5), 5)  # Ensure we cover up_to
+
+	def test_query_iter(self):
+		# Iterate over single- and multi-queries, with and without prefetching
+		for x in range(0, 50):
+			e = datastore.Entity(datastore.Key(testKindName))
+			e["intVal"] = x
+			e["modVal"] = x % 3
+			datastore.Put(e)
+		for prefetch in (False, True):
+			qry = datastore.Query(testKindName).order(("intVal", datastore.SortOrder.Ascending))
+			self.assertEqual([x["intVal"] for x in qry.iter(prefetch=prefetch)], list(range(0, 50)))
+			qry = datastore.Query(testKindName).filter("modVal IN", [0, 2]) \
+				.order(("intVal", datastore.SortOrder.Descending))
+			self.assertEqual([x["intVal"] for x in qry.iter(prefetch=prefetch)],
+							 [x for x in range(49, -1, -1) if x % 3 != 1])
+			# Sub-queries returning the same entities
+			qry = datastore.Query(testKindName).filter("modVal IN", [0, 0, 1]) \
+				.order(("intVal", datastore.SortOrder.Ascending))
+			self.assertEqual([x["intVal"] for x in qry.iter(prefetch=prefetch)],
+							 [x for x in range(0, 50) if x % 3 != 2])
+		# A custom merge needs all results at once
+		qry = datastore.Query(testKindName).filter("modVal IN", [0, 2])
+		qry._customMultiQueryMerge = lambda query, res, limit: res[0]
+		with self.assertRaises(ValueError):
+			next(qry.iter())
+
+	def test_multi_query_merge(self):
+		# The results of multi-queries must be deduplicated, sorted and cut off after the limit
+		for x in range(0, 30):
+			e = datastore.Entity(datastore.Key(testKindName))
+			e["intVal"] = x
+			e["listVal"] = [x % 3, x % 5]
+			datastore.Put(e)
+		qry = datastore.Query(testKindName).filter("listVal IN", [1, 2]) \
+			.order(("intVal", datastore.SortOrder.Descending))
+		res = [x["intVal"] for x in qry.run(100)]
+		self.assertEqual(res, [x for x in range(29, -1, -1) if {x % 3, x % 5} & {1, 2}])
+		qry = datastore.Query(testKindName).filter("listVal IN", [1, 2]) \
+			.order(("intVal", datastore.SortOrder.Descending))
+		# The merged results are cut off at the limit, although each sub-query returns up to 5 entities
+		self.assertEqual([x["intVal"] for x in qry.run(5)], res[:5])
+		qry = datastore.Query(testKindName).filter("intVal !=", 10)
+		self.assertEqual([x["intVal"] for x in qry.run(100)], [x for x in range(0, 30) if x != 10])
+
+	def test_multi_query_merge_mixed_types(self):
+		# Integers and timestamps are sorted together by the datastore, so merging must not separate them
+		epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+		for x in range(0, 8):
+			e = datastore.Entity(datastore.Key(testKindName, "entity-%s" % x))
+			e["mixedVal"] = x if x % 2 == 0 else epoch + timedelta(microseconds=x)
+			e["listVal"] = [x % 2, x % 3]
+			datastore.Put(e)
+
+		def query():
+			return datastore.Query(testKindName).filter("listVal IN", [0, 1]) \
+				.order(("mixedVal", datastore.SortOrder.Ascending))
+
+		expected = ["entity-%s" % x for x in range(0, 8)]
+		self.assertEqual([x.key.name for x in query().run(100)], expected)
+		self.assertEqual([x.key.name for x in query().run(5)], expected[:5])
+		self.assertEqual([x.key.name for x in query().iter()], expected)
@@ -201,3 +201,95 @@ class QueryValuesTest(BaseTestClass):
 			innerKeyList.append(innerEntry.key)
 		self.assertEqual(len(datastore.Query(testKindName).filter("__key__ IN", outerKeyList).run()), 3)
 		self.assertEqual(len(datastore.Query(testKindName).filter("innerEntry.__key__ IN", innerKeyList).run()), 3)
+
+	def test_in_filter_concurrent(self):
+		# Sub-queries of an IN filter must yield the same results, whether they're run concurrently or not
+		for x in range(0, 10):
+			e = datastore.Entity(datastore.Key(testKindName))
+			e["intVal"] = x
+			datastore.Put(e)
+		oldValue = datastore.config["max_concurrent_queries"]
+		try:
+			datastore.config["max_concurrent_queries"] = 1
+			serialRes = datastore.Query(testKindName).filter("intVal IN", list(range(0, 12))).run(100)
+			datastore.config["max_concurrent_queries"] = 8
+			concurrentRes = datastore.Query(testKindName).filter("intVal IN", list(range(0, 12))).run(100)
+		finally:
+			datastore.config["max_concurrent_queries"] = oldValue
+		self.assertEqual(len(serialRes), 10)
+		self.assertEqual([x.key for x in serialRes], [x.key for x in concurrentRes])
+
+	def test_lazy_query(self):
+		# Lazy entities must only decode what's accessed, yet compare equal to (and round-trip like) regular ones
+		e = datastore.Entity(datastore.Key(testKindName, "lazy-entity"))
+		e.update(datastoreSampleValues)
+		e.exclude_from_indexes = {"strTypeAscii", "listType"}
+		datastore.Put(e)
+		eagerRes = datastore.Query(testKindName).run(10)
+		lazyRes = datastore.Query(testKindName).lazy().run(10)
+		self.assertEqual(len(lazyRes), 1)
+		lazyEntity = lazyRes[0]
+		self.assertIsInstance(lazyEntity, datastore.LazyEntity)
+		self.assertEqual(lazyEntity.key, e.key)
+		self.assertEqual(lazyEntity["intType123456789"], 123456789)
+		self.assertEqual(lazyEntity.get("strTypeUnicode"), "öäüÖÄÜ")
+		self.assertIn("keyTypeParent", lazyEntity)
+		self.assertNotIn("missing", lazyEntity)
+		self.assertIsNone(lazyEntity.get("missing"))
+		self.assertEqual(dict.__len__(lazyEntity), 2)  # Nothing else has been decoded yet
+		self.assertEqual(lazyEntity, eagerRes[0])
+		self.assertEqual(list(lazyEntity.keys()), list(eagerRes[0].keys()))
+		self.assertEqual(lazyEntity.exclude_from_indexes, eagerRes[0].exclude_from_indexes)
+		# Writing it back (after modifying a single property) must keep everything else
+		lazyEntity = datastore.Query(testKindName).lazy().getEntry()
+		lazyEntity["strTypeAscii"] = "modified"
+		datastore.Put(lazyEntity)
+		e2 = datastore.Get(e.key)
+		self.assertEqual(e2["strTypeAscii"], "modified")
+		self.assertEqual(e2.exclude_from_indexes, {"strTypeAscii", "listType"})
+		for k, v in datastoreSampleValues.items():
+			if k != "strTypeAscii":
+				self.assertEqual(e2[k], v)
+
+	def test_projection_query(self):
+		# Projections and keys-only queries return partial entities, which can't be written back
+		for x in range(0, 5):
+			e = datastore.Entity(datastore.Key(testKindName, "projection-%s" % x))
+			e["intVal"] = x
+			e["strVal"] = "value-%s" % x
+			datastore.Put(e)
+		res = datastore.Query(testKindName).projection(["intVal"]).filter("intVal >=", 2).run(10)
+		self.assertEqual(sorted([x["intVal"] for x in res]), [2, 3, 4])
+		for e in res:
+			self.assertNotIn("strVal", e)
+			self.assertEqual(e.projection, ("intVal",))
+		with self.assertRaises(datastore.PartialEntityError):
+			datastore.Put(res[0])
+		res = datastore.Query(testKindName).keysOnly().run(10)
+		self.assertEqual(sorted([x.key.name for x in res]), ["projection-%s" % x for x in range(0, 5)])
+		self.assertTrue(all(len(x) == 0 for x in res))
+		self.assertEqual(res[0].projection, (datastore.KEY_SPECIAL_PROPERTY,))
+		# Full entities stay writable
+		e = datastore.Query(testKindName).getEntry()
+		self.assertIsNone(e.projection)
+		datastore.Put(e)
+
+	def test_iter_keys_bulk_delete(self):
+		# Keys-only scans yield each key once, and BulkDelete removes them in several (concurrent) commits
+		for x in range(0, 30):
+			e = datastore.Entity(datastore.Key(testKindName))
+			e["intVal"] = x % 10
+			datastore.Put(e)
+		keys = list(datastore.Query(testKindName).filter("intVal IN", [1, 2, 3]).iterKeys())
+		self.assertEqual(len(keys), 9)
+		self.assertEqual(len(set(keys)), 9)
+		self.assertTrue(all(isinstance(x, datastore.Key) for x in keys))
+		oldValue = datastore.transport.COMMIT_MAX_MUTATIONS
+		try:
+			datastore.transport.COMMIT_MAX_MUTATIONS = 4
+			self.assertEqual(datastore.BulkDelete(iter(keys)), 9)
+		finally:
+			datastore.transport.COMMIT_MAX_MUTATIONS = oldValue
+		self.assertEqual(len(datastore.Query(testKindName).run(100)), 21)
+		self.assertEqual(datastore.BulkDelete(datastore.Query(testKindName).iterKeys()), 21)
+		self.assertEqual(datastore.Query(testKindName).run(100), [])
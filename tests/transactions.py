@@ -162,5 +162,48 @@ class TransactionTest(BaseTestClass):
 		# The number of increments on the datastore object must match the number of successful transactions
 		self.assertEqual(e["count"], sum([thread.successCount for thread in threadList]))
 
+	def test_read_your_writes(self):
+		"""
+			Inside a transaction, keys are looked up once and writes are visible to later reads. The final state
+			is published to the cache on commit.
+		"""
+		for name in ["a", "b"]:
+			e = datastore.Entity(datastore.Key(testKindName, name))
+			e["count"] = 0
+			datastore.Put(e)
+		lookups = []
+		origLookupBatch = datastore.transport._lookupBatch
+
+		def lookupBatch(keys, readOptions):
+			lookups.append(keys)
+			return origLookupBatch(keys, readOptions)
+
+		def txn():
+			e = datastore.Get(datastore.Key(testKindName, "a"))
+			e["count"] += 1
+			self.assertEqual(datastore.Get(datastore.Key(testKindName, "a"))["count"], 0)  # Not written yet
+			datastore.Put(e)
+			e["count"] += 1  # Changed after the Put, so this must not be visible
+			self.assertEqual(datastore.Get(datastore.Key(testKindName, "a"))["count"], 1)
+			datastore.Delete(datastore.Key(testKindName, "b"))
+			self.assertEqual(datastore.Get([datastore.Key(testKindName, "a"), datastore.Key(testKindName, "b")])[1],
+							 None)
+			self.assertEqual(len(lookups), 1)
+
+		oldMemcacheClient = datastore.config["memcache_client"]
+		datastore.config["memcache_client"] = datastore.cache.InProcessCache()
+		datastore.transport._lookupBatch = lookupBatch
+		try:
+			datastore.RunInTransaction(txn)
+			cached = datastore.cache.get([datastore.Key(testKindName, "a"), datastore.Key(testKindName, "b")],
+										 include_missing=True)
+			self.assertEqual(list(cached.values())[0]["count"], 1)
+			self.assertEqual(list(cached.values())[1], None)
+		finally:
+			datastore.transport._lookupBatch = origLookupBatch
+			datastore.config["memcache_client"] = oldMemcacheClient
+		self.assertEqual(datastore.Get(datastore.Key(testKindName, "a"))["count"], 1)
+		self.assertIsNone(datastore.Get(datastore.Key(testKindName, "b")))
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,80 @@
+from viur import datastore
+from viur.datastore import utils
+from .base import BaseTestClass, testKindName
+
+"""
+	Ensure writes collected by bufferedWrites() are committed together and leave the datastore in the expected state
+"""
+
+
+class WriteBufferTest(BaseTestClass):
+
+	def test_flush_at_exit(self):
+		"""
+			Nothing is written before the context ends, the entities get their keys and versions afterwards
+		"""
+		with utils.bufferedWrites() as writeBuffer:
+			entities = []
+			for x in range(5):
+				e = datastore.Entity(datastore.Key(testKindName))
+				e["value"] = x
+				datastore.Put(e)
+				entities.append(e)
+			self.assertEqual(len(writeBuffer), 5)
+			self.assertEqual(datastore.Query(testKindName).run(10), [])
+		self.assertEqual(len(writeBuffer), 0)
+		self.assertTrue(all(not e.key.is_partial and e.version for e in entities))
+		self.assertEqual(sorted(e["value"] for e in datastore.Query(testKindName).run(10)), [0, 1, 2, 3, 4])
+
+	def test_last_write_wins(self):
+		"""
+			Writes to the same key are deduplicated, and later changes to an entity are not written
+		"""
+		key = datastore.Key(testKindName, "buffered")
+		with utils.bufferedWrites() as writeBuffer:
+			e = datastore.Entity(key)
+			e["value"] = 1
+			datastore.Put(e)
+			e["value"] = 2  # Not written, as it's changed after Put
+			datastore.Delete(key)
+			e2 = datastore.Entity(key)
+			e2["value"] = 3
+			datastore.Put(e2)
+			self.assertEqual(len(writeBuffer), 1)
+		self.assertEqual(datastore.Get(key)["value"], 3)
+		with utils.bufferedWrites():
+			datastore.Put(e)
+			datastore.Delete(key)
+		self.assertIsNone(datastore.Get(key))
+
+	def test_threshold_and_nesting(self):
+		"""
+			Full buffers are flushed early, nested contexts share the outer buffer
+		"""
+		with utils.bufferedWrites(max_mutations=3) as writeBuffer:
+			with utils.bufferedWrites() as innerBuffer:
+				self.assertIs(innerBuffer, writeBuffer)
+				for x in range(4):
+					datastore.Put(datastore.Entity(datastore.Key(testKindName, "entity-%s" % x)))
+			self.assertEqual(len(writeBuffer), 1)
+			self.assertEqual(len(datastore.Query(testKindName).run(10)), 3)
+		self.assertEqual(len(datastore.Query(testKindName).run(10)), 4)
+
+	def test_transaction(self):
+		"""
+			Pending writes are flushed before a transaction starts, writes inside it are not buffered
+		"""
+		key = datastore.Key(testKindName, "buffered")
+
+		def txn():
+			e = datastore.Get(key)
+			e["value"] += 1
+			datastore.Put(e)
+
+		with utils.bufferedWrites() as writeBuffer:
+			e = datastore.Entity(key)
+			e["value"] = 1
+			datastore.Put(e)
+			datastore.RunInTransaction(txn)
+			self.assertEqual(len(writeBuffer), 0)
+		self.assertEqual(datastore.Get(key)["value"], 2)